@@ -0,0 +1,32 @@
+import math
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def add_service_path(service: str):
+    """Services import their siblings as top-level modules, so put the service dir on sys.path."""
+    for path in (str(ROOT), str(ROOT / "services" / service)):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    return {
+        "count": len(latencies),
+        "elapsed_s": round(elapsed, 4),
+        "throughput_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
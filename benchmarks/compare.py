@@ -0,0 +1,60 @@
+"""
+Compare a benchmark run against a stored baseline and fail on regressions.
+
+    python -m benchmarks.compare benchmarks/baseline.json results.json --tolerance 0.15
+
+Latency percentiles and peak RSS regress when they grow, throughput when it shrinks, by more
+than ``--tolerance`` (a fraction). Exits with status 1 if anything regressed.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Iterator, Tuple
+
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "peak_rss_mb")
+HIGHER_IS_BETTER = ("throughput_per_s", "pages_per_s")
+
+
+def _metrics(results: dict, prefix: str = "") -> Iterator[Tuple[str, str, float]]:
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _metrics(value, f"{prefix}{key}/")
+        elif key in LOWER_IS_BETTER + HIGHER_IS_BETTER and isinstance(value, (int, float)):
+            yield prefix.rstrip("/"), key, float(value)
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list:
+    base = {(name, metric): value for name, metric, value in _metrics(baseline["results"])}
+    rows = []
+    for name, metric, value in _metrics(current["results"]):
+        before = base.get((name, metric))
+        if not before:
+            continue
+        change = (value - before) / before
+        worse = change > tolerance if metric in LOWER_IS_BETTER else change < -tolerance
+        rows.append((name, metric, before, value, change, worse))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark results with a baseline.")
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("current", type=Path)
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    rows = compare(
+        json.loads(args.baseline.read_text()), json.loads(args.current.read_text()), args.tolerance
+    )
+    regressions = 0
+    for name, metric, before, after, change, worse in rows:
+        regressions += worse
+        flag = "REGRESSION" if worse else ""
+        print(f"{name:45} {metric:17} {before:>10.2f} -> {after:>10.2f} {change:+7.1%} {flag}")
+    print(f"{regressions} regression(s) in {len(rows)} metrics, tolerance {args.tolerance:.0%}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Deterministic benchmark corpora.
+
+Every document is generated from a seeded RNG, so the same ``--seed`` always produces the same
+text (PDF bytes may differ in metadata between PyMuPDF versions; ``manifest.json`` records the
+text digest that matters). PDFs cover the shapes the parser routes differently:
+
+* ``text``    born-digital pages with a text layer
+* ``scanned`` image-only pages (rendered text, no text layer), which need OCR
+* ``mixed``   alternating text and scanned pages
+* ``table``   ruled tables whose rows are laid out in columns
+
+HTML pages mimic saved articles: navigation, headings, paragraphs, lists, a table and footer
+boilerplate.
+
+    python -m benchmarks.corpus --output benchmarks/corpus --pages 1 10 50
+"""
+import argparse
+import hashlib
+import json
+import random
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+import fitz
+
+PDF_KINDS = ("text", "scanned", "mixed", "table")
+DEFAULT_PAGE_COUNTS = (1, 10, 50)
+HTML_PAGES = 20
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 56
+SCAN_DPI = 150
+
+WORDS = (
+    "ingestion pipeline document extraction storage bucket message topic subscription tenant "
+    "chunk overlap embedding vector latency throughput parser layout table figure section "
+    "heading paragraph revenue quarter forecast contract clause party agreement invoice amount "
+    "total balance payment schedule delivery warranty liability notice termination schedule "
+    "the of and to in is for on with as by at from that this be are was it an or"
+).split()
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraph(rng: random.Random) -> str:
+    return " ".join(_sentence(rng) for _ in range(rng.randint(3, 7)))
+
+
+def _heading(rng: random.Random, number: int) -> str:
+    return f"{number}. " + " ".join(rng.choice(WORDS) for _ in range(3)).title()
+
+
+def _write_text_page(page: fitz.Page, rng: random.Random, number: int):
+    page.insert_text((MARGIN, MARGIN + 10), _heading(rng, number), fontsize=14)
+    rect = fitz.Rect(MARGIN, MARGIN + 30, PAGE_WIDTH - MARGIN, PAGE_HEIGHT - MARGIN)
+    page.insert_textbox(rect, "\n\n".join(_paragraph(rng) for _ in range(4)), fontsize=10)
+
+
+def _write_table_page(page: fitz.Page, rng: random.Random, number: int):
+    page.insert_text((MARGIN, MARGIN + 10), f"Table {number}: quarterly figures", fontsize=12)
+    columns, rows = 5, 30
+    col_width = (PAGE_WIDTH - 2 * MARGIN) / columns
+    row_height = 22
+    top = MARGIN + 30
+    for r in range(rows + 1):
+        y = top + r * row_height
+        page.draw_line((MARGIN, y), (PAGE_WIDTH - MARGIN, y), width=0.5)
+    for c in range(columns + 1):
+        x = MARGIN + c * col_width
+        page.draw_line((x, top), (x, top + rows * row_height), width=0.5)
+    for r in range(rows):
+        if r == 0:
+            cells = ["Item", "Q1", "Q2", "Q3", "Total"]
+        else:
+            values = [rng.randint(100, 99999) for _ in range(3)]
+            cells = [rng.choice(WORDS).title(), *map(str, values), str(sum(values))]
+        for c, cell in enumerate(cells):
+            page.insert_text(
+                (MARGIN + c * col_width + 4, top + r * row_height + 15), cell, fontsize=9
+            )
+
+
+def _write_scanned_page(doc: fitz.Document, rng: random.Random, number: int):
+    """Render a text page to pixels and place only the image, like a scanner would."""
+    with fitz.open() as scratch:
+        _write_text_page(scratch.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT), rng, number)
+        pixmap = scratch[0].get_pixmap(dpi=SCAN_DPI, colorspace=fitz.csGRAY)
+    page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+    page.insert_image(page.rect, pixmap=pixmap)
+
+
+def build_pdf(kind: str, pages: int, seed: int) -> bytes:
+    rng = random.Random(f"{seed}:{kind}:{pages}")
+    with fitz.open() as doc:
+        for number in range(1, pages + 1):
+            scanned = kind == "scanned" or (kind == "mixed" and number % 2 == 0)
+            if scanned:
+                _write_scanned_page(doc, rng, number)
+                continue
+            page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+            if kind == "table":
+                _write_table_page(page, rng, number)
+            else:
+                _write_text_page(page, rng, number)
+        return doc.tobytes(garbage=3, deflate=True)
+
+
+def build_html(index: int, seed: int) -> str:
+    rng = random.Random(f"{seed}:html:{index}")
+    sections = []
+    for number in range(1, rng.randint(4, 10) + 1):
+        body = "".join(f"<p>{_paragraph(rng)}</p>" for _ in range(rng.randint(2, 5)))
+        if number % 3 == 0:
+            items = "".join(f"<li>{_sentence(rng)}</li>" for _ in range(rng.randint(3, 6)))
+            body += f"<ul>{items}</ul>"
+        if number % 4 == 0:
+            rows = "".join(
+                f"<tr><td>{rng.choice(WORDS)}</td><td>{rng.randint(1, 9999)}</td></tr>"
+                for _ in range(rng.randint(3, 8))
+            )
+            body += f"<table><tr><th>Item</th><th>Amount</th></tr>{rows}</table>"
+        sections.append(f"<h2>{_heading(rng, number)}</h2>{body}")
+    nav = "".join(f'<li><a href="/{w}">{w}</a></li>' for w in rng.sample(WORDS, 8))
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+        f"<title>Benchmark article {index}</title>"
+        "<style>body{font-family:sans-serif}</style><script>var tracking = 1;</script></head>"
+        f"<body><header><nav><ul>{nav}</ul></nav></header>"
+        f"<main><article><h1>Benchmark article {index}</h1>{''.join(sections)}</article></main>"
+        "<footer><p>Copyright. All rights reserved.</p><a href='/privacy'>Privacy</a></footer>"
+        "</body></html>"
+    )
+
+
+def _text_digest(pdf_bytes: bytes) -> str:
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        text = "".join(page.get_text("text") for page in doc)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def generate(
+    output: Path,
+    page_counts: Iterable[int] = DEFAULT_PAGE_COUNTS,
+    seed: int = 0,
+    kinds: Iterable[str] = PDF_KINDS,
+    html_pages: int = HTML_PAGES,
+) -> Dict[str, List[dict]]:
+    """Write the corpus under ``output`` (``pdf/`` and ``html/``) and return its manifest."""
+    (output / "pdf").mkdir(parents=True, exist_ok=True)
+    (output / "html").mkdir(parents=True, exist_ok=True)
+    manifest = {"seed": seed, "pdf": [], "html": []}
+
+    for kind in kinds:
+        for pages in page_counts:
+            data = build_pdf(kind, pages, seed)
+            path = output / "pdf" / f"{kind}-{pages:03d}.pdf"
+            path.write_bytes(data)
+            manifest["pdf"].append(
+                {
+                    "path": str(path.relative_to(output)),
+                    "kind": kind,
+                    "pages": pages,
+                    "size_bytes": len(data),
+                    "text_sha256": _text_digest(data),
+                }
+            )
+
+    for index in range(html_pages):
+        html = build_html(index, seed)
+        path = output / "html" / f"article-{index:03d}.html"
+        path.write_text(html, encoding="utf-8")
+        manifest["html"].append(
+            {
+                "path": str(path.relative_to(output)),
+                "size_bytes": len(html.encode("utf-8")),
+                "sha256": hashlib.sha256(html.encode("utf-8")).hexdigest(),
+            }
+        )
+
+    (output / "manifest.json").write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def load_manifest(corpus: Path) -> dict:
+    return json.loads((corpus / "manifest.json").read_text())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the benchmark corpus.")
+    parser.add_argument("--output", type=Path, default=Path(__file__).parent / "corpus")
+    parser.add_argument("--pages", type=int, nargs="+", default=list(DEFAULT_PAGE_COUNTS))
+    parser.add_argument("--kinds", nargs="+", choices=PDF_KINDS, default=list(PDF_KINDS))
+    parser.add_argument("--html-pages", type=int, default=HTML_PAGES)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    manifest = generate(args.output, args.pages, args.seed, args.kinds, args.html_pages)
+    pdfs, pages = len(manifest["pdf"]), len(manifest["html"])
+    print(f"Wrote {pdfs} PDFs and {pages} HTML pages to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+In-process stand-ins for GCS and Pub/Sub so the extractor and chunker handlers can run end
+to end in one process. Storage is the shared ``MemoryBlobStore``; the broker below queues
+payloads per topic and lets the benchmark drain them synchronously.
+"""
+import collections
+import itertools
+import threading
+from concurrent.futures import Future
+from typing import Deque, Dict, Tuple
+
+from shared.pubsub.broker import Broker, set_broker
+from shared.storage.blob_store import MemoryBlobStore, set_blob_store
+
+
+class DequeBroker(Broker):
+    def __init__(self):
+        self.topics: Dict[str, Deque[Tuple[dict, dict]]] = collections.defaultdict(
+            collections.deque
+        )
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def publish(self, topic, payload, **attributes):
+        with self._lock:
+            self.topics[topic].append((payload, attributes))
+            message_id = str(next(self._ids))
+        future = Future()
+        future.set_result(message_id)
+        return future
+
+    def pending(self, topic: str) -> int:
+        return len(self.topics[topic])
+
+    def pop(self, topic: str) -> Tuple[dict, dict]:
+        with self._lock:
+            return self.topics[topic].popleft()
+
+
+def install() -> Tuple[MemoryBlobStore, DequeBroker]:
+    """Point the shared storage and publishing helpers at in-memory stand-ins."""
+    store, broker = MemoryBlobStore(), DequeBroker()
+    set_blob_store(store)
+    set_broker(broker)
+    return store, broker
@@ -0,0 +1,158 @@
+"""
+Load benchmark for the ingestion API hot path.
+
+Runs ``/api/upload`` and ``/api/url`` in-process against stand-ins for GCS and Pub/Sub that
+sleep for a configurable latency, once with the legacy blocking handlers and once with the
+executor-backed ones, and prints requests/sec and latency percentiles for both.
+
+    python -m benchmarks.ingestion_api_load --requests 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import httpx
+
+from benchmarks.common import add_service_path, summarize
+
+add_service_path("ingestion_api")
+
+import api  # noqa: E402
+import utils  # noqa: E402
+from dedup import DocumentOwners, SQLiteDigestIndex  # noqa: E402
+from main import app  # noqa: E402
+
+
+class FakeBlob:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def upload_from_string(self, data, **kwargs):
+        time.sleep(self.latency)
+
+    def open(self, mode="rb", **kwargs):
+        return self
+
+    def write(self, data):
+        return len(data)
+
+    def close(self):
+        time.sleep(self.latency)
+
+
+class FakeBucket:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def blob(self, name, chunk_size=None):
+        return FakeBlob(self.latency)
+
+
+class FakeStorageClient:
+    def __init__(self, latency: float, setup_latency: float = 0.0):
+        time.sleep(setup_latency)
+        self.latency = latency
+
+    def bucket(self, name):
+        return FakeBucket(self.latency)
+
+    def close(self):
+        pass
+
+
+def make_fake_publish(latency: float):
+    def publish_event_async(topic, payload, **attributes):
+        future = Future()
+        threading.Timer(latency, future.set_result, args=("fake-message-id",)).start()
+        return future
+
+    return publish_event_async
+
+
+def install_legacy_handlers(args):
+    """Recreate the pre-lifespan behaviour: a client per request and blocking calls on the loop."""
+    fake_publish = make_fake_publish(args.publish_latency)
+
+    async def save_file_to_gcs(file, tenant_id, file_id, sha256=None):
+        content = await file.read()
+        client = FakeStorageClient(args.storage_latency, args.client_setup_latency)
+        client.bucket("bench").blob(f"{tenant_id}/{file_id}").upload_from_string(content)
+        path = f"{tenant_id}/{file_id}_{file.filename}"
+        return {"gcs_path": path, "sha256": "", "size_bytes": len(content), "page_estimate": 0}
+
+    async def publish_ingestion_event(payload):
+        time.sleep(args.client_setup_latency)
+        return fake_publish("bench", payload).result()
+
+    utils.save_file_to_gcs = save_file_to_gcs
+    utils.publish_ingestion_event = api.publish_ingestion_event = publish_ingestion_event
+
+
+ORIGINAL_HANDLERS = (utils.save_file_to_gcs, utils.publish_ingestion_event)
+
+
+def install_async_handlers(args):
+    utils._storage_client = FakeStorageClient(args.storage_latency)
+    utils._executor = ThreadPoolExecutor(max_workers=args.io_workers)
+    utils.publish_event_async = make_fake_publish(args.publish_latency)
+    utils.save_file_to_gcs, utils.publish_ingestion_event = ORIGINAL_HANDLERS
+    api.publish_ingestion_event = utils.publish_ingestion_event
+
+
+async def run_load(endpoint: str, total: int, concurrency: int, body_size: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    body = b"%PDF-1.4\n" + b"0" * body_size
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def one(i: int):
+            async with semaphore:
+                started = time.perf_counter()
+                if endpoint == "upload":
+                    response = await client.post(
+                        "/api/upload",
+                        data={"tenant_id": "bench"},
+                        files={"file": (f"doc-{i}.pdf", body, "application/pdf")},
+                    )
+                else:
+                    response = await client.post(
+                        "/api/url", data={"tenant_id": "bench", "url": f"https://example.com/{i}"}
+                    )
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        return summarize(latencies, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--body-size", type=int, default=256 * 1024)
+    parser.add_argument("--storage-latency", type=float, default=0.05)
+    parser.add_argument("--publish-latency", type=float, default=0.02)
+    parser.add_argument("--client-setup-latency", type=float, default=0.01)
+    parser.add_argument("--io-workers", type=int, default=32)
+    args = parser.parse_args()
+
+    # Every request claims its document id; keep the owner records in memory.
+    utils._document_owners = DocumentOwners(SQLiteDigestIndex(":memory:"))
+    results = {}
+    for mode, install in (("before", install_legacy_handlers), ("after", install_async_handlers)):
+        install(args)
+        for endpoint in ("upload", "url"):
+            results[f"{mode}/{endpoint}"] = asyncio.run(
+                run_load(endpoint, args.requests, args.concurrency, args.body_size)
+            )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""
+Extraction, chunking and end-to-end benchmarks over the generated corpus.
+
+Each (suite, strategy) group runs in a fresh interpreter so its peak RSS is its own, and
+results are written as JSON that ``benchmarks.compare`` can check against a stored baseline.
+
+    python -m benchmarks.corpus
+    python -m benchmarks.pipeline --output results.json
+    python -m benchmarks.pipeline --suites extraction --strategies auto pymupdf --repeat 5
+    python -m benchmarks.compare benchmarks/baseline.json results.json
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks.common import ROOT, add_service_path, summarize
+from benchmarks.corpus import load_manifest
+
+SUITES = ("extraction", "url", "html", "chunking", "end_to_end", "fanout")
+STRATEGIES = ("auto", "pymupdf", "pdfplumber", "ocr", "unstructured")
+DEFAULT_CORPUS = Path(__file__).parent / "corpus"
+
+
+def peak_rss_mb() -> float:
+    """Peak RSS of this process or any worker it waited on (ru_maxrss is KiB on Linux)."""
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return round(peak / 1024, 1)
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit,
+    }
+
+
+def _quiet_logging():
+    # The services configure INFO logging on import; per-document lines would swamp timings.
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def _measure(func, items: List, repeat: int) -> dict:
+    """Time ``func(item)`` for each item, ``repeat`` times, after one warm-up call."""
+    if items:
+        func(items[0])
+    latencies, chars = [], 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            call_started = time.perf_counter()
+            chars = func(item) or 0
+            latencies.append(time.perf_counter() - call_started)
+    return {**summarize(latencies, time.perf_counter() - started), "output_chars": chars}
+
+
+def _group_by_document(manifest: dict, kinds=None) -> Dict[str, List[dict]]:
+    groups = {}
+    for entry in manifest["pdf"]:
+        if kinds is None or entry["kind"] in kinds:
+            groups[f"{entry['kind']}-{entry['pages']:03d}"] = [entry]
+    return groups
+
+
+# === Workers (run in a child interpreter) ===
+
+
+def _extract_worker(spec: dict) -> dict:
+    add_service_path("extractor")
+    import fitz
+
+    from services.extractor.utils.pdf_source import PdfSource
+    from services.extractor.utils.text_extractors import _run_strategy, parse_pdf
+
+    _quiet_logging()
+    corpus = Path(spec["corpus"])
+    strategy = spec["strategy"]
+
+    def run(entry: dict) -> int:
+        path = str(corpus / entry["path"])
+        if strategy == "auto":
+            # As the extractor sees it: downloaded into memory, spilled only if needed.
+            with PdfSource(path, data=Path(path).read_bytes()) as source:
+                blocks, _ = parse_pdf(source)
+        else:
+            with fitz.open(path) as doc:
+                blocks = _run_strategy(strategy, PdfSource(path, path=path), doc)
+        return sum(len(block.get("text") or "") for block in blocks)
+
+    results = {}
+    for name, entries in _group_by_document(load_manifest(corpus), spec.get("kinds")).items():
+        result = _measure(run, entries, spec["repeat"])
+        pages = sum(entry["pages"] for entry in entries) * spec["repeat"]
+        result["pages_per_s"] = round(pages / result["elapsed_s"], 2) if result["elapsed_s"] else 0
+        results[name] = result
+    return results
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def _url_worker(spec: dict) -> dict:
+    add_service_path("extractor")
+    from services.extractor.utils.text_extractors import smart_url_parser
+
+    _quiet_logging()
+    corpus = Path(spec["corpus"])
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(_QuietHandler, directory=str(corpus / "html"))
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def run(entry: dict) -> int:
+        parsed = smart_url_parser(f"{base}/{Path(entry['path']).name}")
+        return sum(len(section["text"]) for section in parsed.get("sections", []))
+
+    try:
+        return {"smart_url_parser": _measure(run, load_manifest(corpus)["html"], spec["repeat"])}
+    finally:
+        server.shutdown()
+
+
+def _legacy_xml_sections(extracted: str) -> list:
+    """The pre-lxml section extraction: a second soup over trafilatura's XML plus find_all."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(extracted, "xml")
+    sections = []
+    for section in soup.find_all(["head", "p", "h1", "h2", "h3", "ul", "ol", "li", "table"]):
+        text = section.get_text(strip=True)
+        if text:
+            sections.append({"type": section.name, "text": text})
+    return sections
+
+
+def _legacy_html_sections(html: str) -> list:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style"]):
+        tag.decompose()
+    return [{"type": "text", "text": soup.get_text(separator="\n", strip=True)}]
+
+
+def _html_worker(spec: dict) -> dict:
+    """Section extraction alone, old and new, on trafilatura's XML and on the raw page."""
+    add_service_path("extractor")
+    import trafilatura
+
+    from services.extractor.utils.html_sections import sections_from_html, sections_from_xml
+
+    _quiet_logging()
+    corpus = Path(spec["corpus"])
+    pages = [(corpus / entry["path"]).read_text() for entry in load_manifest(corpus)["html"]]
+    # Same options as parse_html; trafilatura itself is outside the timed part.
+    options = {"include_comments": False, "include_tables": True, "favor_precision": True}
+    extracted = [trafilatura.extract(page, output_format="xml", **options) or "" for page in pages]
+    cases = {
+        "xml/beautifulsoup": (_legacy_xml_sections, extracted),
+        "xml/lxml": (sections_from_xml, extracted),
+        "raw/beautifulsoup": (_legacy_html_sections, pages),
+        "raw/lxml": (sections_from_html, pages),
+    }
+    results = {}
+    for name, (parse, inputs) in cases.items():
+        result = _measure(lambda item: len(parse(item)), inputs, spec["repeat"])
+        # Output size over the whole corpus: sections emitted and characters they carry.
+        outputs = [parse(item) for item in inputs]
+        result.pop("output_chars")
+        result["output_sections"] = sum(map(len, outputs))
+        result["output_chars"] = sum(len(s["text"]) for out in outputs for s in out)
+        results[name] = result
+    return results
+
+
+def _chunk_worker(spec: dict) -> dict:
+    add_service_path("extractor")
+    add_service_path("chunker")
+    import fitz
+    from chunking import chunk_text, iter_blocks, iter_chunks
+
+    from services.extractor.utils.pdf_extractors import blocks_with_pymupdf
+
+    _quiet_logging()
+    corpus = Path(spec["corpus"])
+    documents = []
+    for entry in load_manifest(corpus)["pdf"]:
+        if entry["kind"] in ("text", "table"):
+            with fitz.open(corpus / entry["path"]) as doc:
+                documents.append(blocks_with_pymupdf(doc))
+
+    def run_chunk_text(blocks: list) -> int:
+        text = "\n\n".join(block["text"] for block in blocks)
+        chunks = chunk_text(text, tenant_id="bench", document_id="bench")
+        return sum(len(chunk["chunk_text"]) for chunk in chunks)
+
+    def run_iter_chunks(blocks: list) -> int:
+        chunks = iter_chunks(iter_blocks(blocks), tenant_id="bench", document_id="bench")
+        return sum(len(chunk["chunk_text"]) for chunk in chunks)
+
+    return {
+        "chunk_text": _measure(run_chunk_text, documents, spec["repeat"]),
+        "iter_chunks": _measure(run_iter_chunks, documents, spec["repeat"]),
+    }
+
+
+def _end_to_end_worker(spec: dict) -> dict:
+    """Upload -> extractor handler -> extraction topic -> chunker handler, all in memory."""
+    add_service_path("extractor")
+    add_service_path("chunker")
+    from benchmarks.fakes import install
+
+    store, broker = install()
+
+    from extractor import handle_ingestion_event
+    from pubsub_handler import handle_extracted_text_message
+
+    from config import GCS_BUCKET, PUBSUB_EMBEDDING_TOPIC, PUBSUB_EXTRACTION_TOPIC
+
+    _quiet_logging()
+    corpus = Path(spec["corpus"])
+    counter = iter(range(sys.maxsize))
+
+    def run(entry: dict) -> int:
+        file_id = f"bench-{next(counter)}"
+        gcs_path = f"bench/{file_id}_{Path(entry['path']).name}"
+        store.write(GCS_BUCKET, gcs_path, (corpus / entry["path"]).read_bytes())
+        handle_ingestion_event(
+            {"type": "file", "tenant_id": "bench", "file_id": file_id, "gcs_path": gcs_path}
+        )
+        while broker.pending(PUBSUB_EXTRACTION_TOPIC):
+            payload, _ = broker.pop(PUBSUB_EXTRACTION_TOPIC)
+            handle_extracted_text_message(payload)
+        chunks = 0
+        while broker.pending(PUBSUB_EMBEDDING_TOPIC):
+            broker.pop(PUBSUB_EMBEDDING_TOPIC)
+            chunks += 1
+        return chunks
+
+    results = {}
+    for name, entries in _group_by_document(load_manifest(corpus), spec.get("kinds")).items():
+        result = _measure(run, entries, spec["repeat"])
+        result["chunks"] = result.pop("output_chars")
+        results[name] = result
+    return results
+
+
+def _fanout_worker(spec: dict) -> dict:
+    """
+    Page-range fan-out end to end in memory. Parts are delivered twice each in random order,
+    as Pub/Sub may, and the merged document must match a single-replica extraction.
+    """
+    # Split everything with 2+ pages into 2-page parts; config is read on import.
+    os.environ.setdefault("EXTRACTOR_FANOUT_MIN_PAGES", "2")
+    os.environ.setdefault("EXTRACTOR_FANOUT_PAGES_PER_PART", "2")
+    add_service_path("extractor")
+    from benchmarks.fakes import install
+
+    store, broker = install()
+
+    from extractor import handle_ingestion_event
+
+    from config import GCS_BUCKET, PUBSUB_EXTRACTION_TOPIC, PUBSUB_TOPIC
+    from services.extractor.utils.text_extractors import parse_pdf
+    from shared.storage.gcs_client import read_extracted_document
+
+    _quiet_logging()
+    corpus = Path(spec["corpus"])
+    counter = iter(range(sys.maxsize))
+    rng = random.Random(0)
+    checks = collections.defaultdict(list)
+
+    def run(entry: dict) -> int:
+        file_id = f"bench-{next(counter)}"
+        gcs_path = f"bench/{file_id}_{Path(entry['path']).name}"
+        store.write(GCS_BUCKET, gcs_path, (corpus / entry["path"]).read_bytes())
+        handle_ingestion_event(
+            {"type": "file", "tenant_id": "bench", "file_id": file_id, "gcs_path": gcs_path}
+        )
+        parts = [broker.pop(PUBSUB_TOPIC)[0] for _ in range(broker.pending(PUBSUB_TOPIC))]
+        deliveries = parts * 2
+        rng.shuffle(deliveries)
+        for payload in deliveries:
+            handle_ingestion_event(payload)
+        events = broker.pending(PUBSUB_EXTRACTION_TOPIC)
+        while broker.pending(PUBSUB_EXTRACTION_TOPIC):
+            broker.pop(PUBSUB_EXTRACTION_TOPIC)
+        merged = read_extracted_document(f"file/{file_id}.json")["structured_text"]
+        checks[entry["path"]].append((len(parts), events, merged))
+        return len(parts)
+
+    results = {}
+    for name, entries in _group_by_document(load_manifest(corpus), spec.get("kinds")).items():
+        result = _measure(run, entries, spec["repeat"])
+        result["parts"] = result.pop("output_chars")
+        expected, _ = parse_pdf(str(corpus / entries[0]["path"]))
+        runs = checks.pop(entries[0]["path"])
+        result["final_events"] = sorted({events for _, events, _ in runs})
+        result["matches_single_replica"] = all(merged == expected for _, _, merged in runs)
+        results[name] = result
+    return results
+
+
+WORKERS = {
+    "extraction": _extract_worker,
+    "url": _url_worker,
+    "html": _html_worker,
+    "chunking": _chunk_worker,
+    "end_to_end": _end_to_end_worker,
+    "fanout": _fanout_worker,
+}
+
+
+def _run_worker(spec: dict) -> dict:
+    """Run one worker in a child interpreter and return its results plus its peak RSS."""
+    with tempfile.NamedTemporaryFile("r", suffix=".json") as result_file:
+        command = [sys.executable, "-m", "benchmarks.pipeline", "--worker", json.dumps(spec)]
+        env = {**os.environ, "BENCHMARK_RESULT_FILE": result_file.name}
+        completed = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            return {"error": completed.stderr.strip().splitlines()[-1:] or ["worker failed"]}
+        return json.loads(result_file.read() or "{}")
+
+
+def run_suites(args) -> dict:
+    results = {}
+    base_spec = {"corpus": str(args.corpus), "repeat": args.repeat, "kinds": args.kinds}
+    for suite in args.suites:
+        strategies = args.strategies if suite == "extraction" else [None]
+        for strategy in strategies:
+            key = f"{suite}/{strategy}" if strategy else suite
+            print(f"Running {key} ...", file=sys.stderr)
+            results[key] = _run_worker({**base_spec, "suite": suite, "strategy": strategy})
+    return {"environment": environment(), "corpus": str(args.corpus), "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipeline benchmarks.")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--suites", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument("--strategies", nargs="+", choices=STRATEGIES, default=list(STRATEGIES))
+    parser.add_argument("--kinds", nargs="+", help="limit PDF kinds (text, scanned, ...)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path, help="write results JSON here as well")
+    args = parser.parse_args()
+
+    if args.worker:
+        spec = json.loads(args.worker)
+        results = WORKERS[spec["suite"]](spec)
+        results["peak_rss_mb"] = peak_rss_mb()
+        Path(os.environ["BENCHMARK_RESULT_FILE"]).write_text(json.dumps(results))
+        return
+
+    if not (args.corpus / "manifest.json").exists():
+        parser.error(f"no corpus at {args.corpus}; run python -m benchmarks.corpus first")
+    report = run_suites(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
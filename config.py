@@ -18,4 +18,139 @@ SUBSCRIPTION_NAME = os.getenv("SUBSCRIPTION_NAME", "extractor-sub")
 PUBSUB_EXTRACTION_TOPIC = os.getenv("PUBSUB_EXTRACTION_TOPIC", "extraction-topic")
 PUBSUB_EMBEDDING_TOPIC = os.getenv("PUBSUB_EMBEDDING_TOPIC", "embedding-topic")
 CHUNKER_SUBSCRIPTION = os.getenv("CHUNKER_SUBSCRIPTION", "chunker-sub")
+EMBEDDER_SUBSCRIPTION = os.getenv("EMBEDDER_SUBSCRIPTION", "embedder-sub")
 EXTRACTED_TEXT_BUCKET = "ingestion-extracted-text"
+# Private working state: chunk manifests, fetch cache, fan-out parts, near-dedup snapshots.
+PIPELINE_STATE_BUCKET = os.getenv("PIPELINE_STATE_BUCKET", "ingestion-pipeline-state")
+PUBSUB_BATCH_MAX_MESSAGES = int(os.getenv("PUBSUB_BATCH_MAX_MESSAGES", 100))
+PUBSUB_BATCH_MAX_BYTES = int(os.getenv("PUBSUB_BATCH_MAX_BYTES", 1024 * 1024))
+PUBSUB_BATCH_MAX_LATENCY = float(os.getenv("PUBSUB_BATCH_MAX_LATENCY", 0.05))
+PUBSUB_PUBLISH_TIMEOUT = float(os.getenv("PUBSUB_PUBLISH_TIMEOUT", 60))
+INGESTION_IO_WORKERS = int(os.getenv("INGESTION_IO_WORKERS", 32))
+# Must be a multiple of 256 KiB for resumable GCS uploads.
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "false").lower() == "true"
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", "gcs")  # "gcs" (the blob store) or "sqlite"
+DEDUP_CROSS_TENANT = os.getenv("DEDUP_CROSS_TENANT", "false").lower() == "true"
+DEDUP_ALIAS_EVENTS = os.getenv("DEDUP_ALIAS_EVENTS", "false").lower() == "true"
+DEDUP_SQLITE_PATH = os.getenv("DEDUP_SQLITE_PATH", "dedup_index.sqlite3")
+DEDUP_GCS_PREFIX = os.getenv("DEDUP_GCS_PREFIX", "_dedup")
+PDF_PROFILE_SAMPLE_PAGES = int(os.getenv("PDF_PROFILE_SAMPLE_PAGES", 8))
+PDF_MIN_TEXT_CHARS_PER_PAGE = int(os.getenv("PDF_MIN_TEXT_CHARS_PER_PAGE", 50))
+PDF_MIN_DOCUMENT_CHARS = int(os.getenv("PDF_MIN_DOCUMENT_CHARS", 100))
+PDF_OCR_PAGE_RATIO = float(os.getenv("PDF_OCR_PAGE_RATIO", 0.8))
+PDF_IMAGE_COVERAGE_THRESHOLD = float(os.getenv("PDF_IMAGE_COVERAGE_THRESHOLD", 0.5))
+PDF_TABLE_LINE_RATIO = float(os.getenv("PDF_TABLE_LINE_RATIO", 0.4))
+PDF_TABLE_PAGE_RATIO = float(os.getenv("PDF_TABLE_PAGE_RATIO", 0.5))
+# PyMuPDF blocks set this much larger than the page's body text are typed "Title".
+PDF_HEADING_SIZE_RATIO = float(os.getenv("PDF_HEADING_SIZE_RATIO", 1.15))
+PDF_HEADING_MAX_CHARS = int(os.getenv("PDF_HEADING_MAX_CHARS", 200))
+PDF_FORCE_STRATEGY = os.getenv("PDF_FORCE_STRATEGY", "")  # pymupdf|pdfplumber|ocr|unstructured
+EXTRACTOR_POOL_SIZE = int(os.getenv("EXTRACTOR_POOL_SIZE", 0))  # 0 = CPUs available to container
+PDF_MIN_PAGES_PER_TASK = int(os.getenv("PDF_MIN_PAGES_PER_TASK", 16))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 32))
+OCR_SELECTIVE = os.getenv("OCR_SELECTIVE", "true").lower() == "true"
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", 50))
+OCR_DPI = int(os.getenv("OCR_DPI", 200))
+CHUNK_SPLIT_ON_PAGE = os.getenv("CHUNK_SPLIT_ON_PAGE", "false").lower() == "true"
+CHUNK_INCREMENTAL = os.getenv("CHUNK_INCREMENTAL", "true").lower() == "true"
+CHUNK_DEDUP_ENABLED = os.getenv("CHUNK_DEDUP_ENABLED", "false").lower() == "true"
+CHUNK_DEDUP_MODE = os.getenv("CHUNK_DEDUP_MODE", "mark")  # "mark" or "skip"
+CHUNK_DEDUP_THRESHOLD = float(os.getenv("CHUNK_DEDUP_THRESHOLD", 0.85))  # estimated Jaccard
+CHUNK_DEDUP_NUM_PERM = int(os.getenv("CHUNK_DEDUP_NUM_PERM", 128))
+CHUNK_DEDUP_SHINGLE_SIZE = int(os.getenv("CHUNK_DEDUP_SHINGLE_SIZE", 3))  # words per shingle
+CHUNK_DEDUP_MAX_ENTRIES = int(os.getenv("CHUNK_DEDUP_MAX_ENTRIES", 200000))  # per tenant
+CHUNK_DEDUP_SNAPSHOT_SECONDS = float(os.getenv("CHUNK_DEDUP_SNAPSHOT_SECONDS", 60))
+CHUNK_DEDUP_PREFIX = os.getenv("CHUNK_DEDUP_PREFIX", "_near_dedup")
+CLAIM_CHECK_THRESHOLD_KB = int(os.getenv("CLAIM_CHECK_THRESHOLD_KB", 256))
+
+
+def _subscriber_settings(prefix: str, max_messages, max_bytes, workers, executor, lease_seconds):
+    """Per-service streaming-pull settings, e.g. EXTRACTOR_FLOW_MAX_MESSAGES."""
+    return {
+        "max_messages": int(os.getenv(f"{prefix}_FLOW_MAX_MESSAGES", max_messages)),
+        "max_bytes": int(os.getenv(f"{prefix}_FLOW_MAX_BYTES", max_bytes)),
+        "callback_workers": int(os.getenv(f"{prefix}_CALLBACK_WORKERS", workers)),
+        "callback_executor": os.getenv(f"{prefix}_CALLBACK_EXECUTOR", executor),  # thread|process
+        "max_lease_seconds": int(os.getenv(f"{prefix}_MAX_LEASE_SECONDS", lease_seconds)),
+    }
+
+
+def _tenant_map(name: str, cast) -> dict:
+    """Per-tenant overrides written as ``TENANT=value,...``, e.g. TENANT_WEIGHTS=acme=2,beta=0.5."""
+    entries = (item.split("=", 1) for item in os.getenv(name, "").split(",") if "=" in item)
+    return {tenant.strip(): cast(value) for tenant, value in entries}
+
+
+EXTRACTOR_FAIR_SCHEDULING = os.getenv("EXTRACTOR_FAIR_SCHEDULING", "true").lower() == "true"
+EXTRACTOR_LARGE_LANE_WORKERS = int(os.getenv("EXTRACTOR_LARGE_LANE_WORKERS", 1))
+# Large jobs waiting beyond this are held outside the lease window instead of queued.
+EXTRACTOR_LARGE_LANE_MAX_QUEUED = int(os.getenv("EXTRACTOR_LARGE_LANE_MAX_QUEUED", 4))
+# Queued jobs older than this are held again before their lease can run out (0 = never).
+EXTRACTOR_MAX_QUEUE_SECONDS = float(os.getenv("EXTRACTOR_MAX_QUEUE_SECONDS", 900))
+EXTRACTOR_LARGE_JOB_PAGES = int(os.getenv("EXTRACTOR_LARGE_JOB_PAGES", 50))
+EXTRACTOR_LARGE_JOB_BYTES = int(os.getenv("EXTRACTOR_LARGE_JOB_BYTES", 20 * 1024 * 1024))
+EXTRACTOR_BYTES_PER_PAGE = int(os.getenv("EXTRACTOR_BYTES_PER_PAGE", 100 * 1024))
+# Documents of at least this many pages are split into page-range subtasks (0 = never).
+EXTRACTOR_FANOUT_MIN_PAGES = int(os.getenv("EXTRACTOR_FANOUT_MIN_PAGES", 500))
+EXTRACTOR_FANOUT_PAGES_PER_PART = int(os.getenv("EXTRACTOR_FANOUT_PAGES_PER_PART", 100))
+# An unfinished merge claim older than this may be taken over by another part's delivery.
+EXTRACTOR_MERGE_CLAIM_SECONDS = float(os.getenv("EXTRACTOR_MERGE_CLAIM_SECONDS", 900))
+TENANT_WEIGHTS = _tenant_map("TENANT_WEIGHTS", float)
+TENANT_MAX_CONCURRENCY = _tenant_map("TENANT_MAX_CONCURRENCY", int)
+# The scheduler can only reorder what is leased, so lease more when it is on.
+EXTRACTOR_SUBSCRIBER = _subscriber_settings(
+    "EXTRACTOR", 32 if EXTRACTOR_FAIR_SCHEDULING else 4, 64 * 1024 * 1024, 4, "thread", 3600
+)
+# Unlisted tenants may use 3/4 of the extractor's handler threads, so one bulk tenant can't
+# take every thread (or, through its queue bound, the lease window); 0 = no cap.
+TENANT_DEFAULT_MAX_CONCURRENCY = int(
+    os.getenv(
+        "TENANT_DEFAULT_MAX_CONCURRENCY",
+        max(1, EXTRACTOR_SUBSCRIBER["callback_workers"] * 3 // 4),
+    )
+)
+CHUNKER_SUBSCRIBER = _subscriber_settings("CHUNKER", 50, 256 * 1024 * 1024, 8, "thread", 600)
+# Each callback thread waits for its chunk's batch, so keep workers >= EMBED_BATCH_SIZE.
+EMBEDDER_SUBSCRIBER = _subscriber_settings("EMBEDDER", 256, 64 * 1024 * 1024, 128, "thread", 600)
+QUARANTINE_BACKEND = os.getenv("QUARANTINE_BACKEND", "topic")  # "topic" or "gcs"
+DEAD_LETTER_TOPIC = os.getenv("DEAD_LETTER_TOPIC", "ingestion-dead-letter")
+DEAD_LETTER_SUBSCRIPTION = os.getenv("DEAD_LETTER_SUBSCRIPTION", "ingestion-dead-letter-sub")
+QUARANTINE_GCS_PREFIX = os.getenv("QUARANTINE_GCS_PREFIX", "_quarantine")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0.0))
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", 0))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", 10))
+PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT", "profiles")  # local directory or gs://bucket/prefix
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", 20))
+BLOB_STORE_BACKEND = os.getenv("BLOB_STORE_BACKEND", "gcs")  # "gcs", "local" or "memory"
+LOCAL_BLOB_ROOT = os.getenv("LOCAL_BLOB_ROOT", "blobs")
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 64))
+PIPELINE_EXTRACT_WORKERS = int(os.getenv("PIPELINE_EXTRACT_WORKERS", 4))
+PIPELINE_CHUNK_WORKERS = int(os.getenv("PIPELINE_CHUNK_WORKERS", 2))
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", 16))
+BACKFILL_STATE_FILE = os.getenv("BACKFILL_STATE_FILE", "backfill-state.jsonl")
+FETCH_TIMEOUT_SECONDS = float(os.getenv("FETCH_TIMEOUT_SECONDS", 20))
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", 100))
+FETCH_PER_HOST_LIMIT = int(os.getenv("FETCH_PER_HOST_LIMIT", 4))
+FETCH_HOST_DELAY_SECONDS = float(os.getenv("FETCH_HOST_DELAY_SECONDS", 0.25))
+FETCH_MAX_RESPONSE_BYTES = int(os.getenv("FETCH_MAX_RESPONSE_BYTES", 20 * 1024 * 1024))
+FETCH_CACHE_ENABLED = os.getenv("FETCH_CACHE_ENABLED", "true").lower() == "true"
+FETCH_USER_AGENT = os.getenv("FETCH_USER_AGENT", "Mozilla/5.0 (compatible; ingestion-pipeline)")
+PDF_IN_MEMORY_MAX_BYTES = int(os.getenv("PDF_IN_MEMORY_MAX_BYTES", 64 * 1024 * 1024))
+PDF_RANGED_DOWNLOAD_MIN_BYTES = int(os.getenv("PDF_RANGED_DOWNLOAD_MIN_BYTES", 256 * 1024 * 1024))
+PDF_DOWNLOAD_CHUNK_BYTES = int(os.getenv("PDF_DOWNLOAD_CHUNK_BYTES", 32 * 1024 * 1024))
+PDF_DOWNLOAD_WORKERS = int(os.getenv("PDF_DOWNLOAD_WORKERS", 8))
+EXTRACTOR_TMP_DIR = os.getenv("EXTRACTOR_TMP_DIR", "")  # empty: the system temp directory
+EXTRACTED_OUTPUT_FORMAT = os.getenv("EXTRACTED_OUTPUT_FORMAT", "sharded")  # or "json" (legacy)
+EXTRACTED_PAGES_PER_SHARD = int(os.getenv("EXTRACTED_PAGES_PER_SHARD", 100))
+EMBEDDER_BACKEND = os.getenv("EMBEDDER_BACKEND", "hashing")  # or "package.module:ClassName"
+EMBED_DIM = int(os.getenv("EMBED_DIM", 384))
+EMBED_DTYPE = os.getenv("EMBED_DTYPE", "float16")  # stored vectors: "float16" or "float32"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64))
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", 50))
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", 50000))  # vectors held in memory
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "")  # empty: memory only; never evicted on disk
+EMBEDDINGS_BUCKET = os.getenv("EMBEDDINGS_BUCKET", PIPELINE_STATE_BUCKET)
+EMBEDDINGS_PREFIX = os.getenv("EMBEDDINGS_PREFIX", "embeddings")
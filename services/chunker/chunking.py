@@ -1,7 +1,42 @@
+import hashlib
+import re
+import unicodedata
 import uuid
-from typing import Dict, List
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional
 
-from config import CHUNK_OVERLAP, CHUNK_SIZE
+from config import CHUNK_OVERLAP, CHUNK_SIZE, CHUNK_SPLIT_ON_PAGE
+
+HEADING_TYPES = {"Title", "Header", "head", "h1", "h2", "h3", "h4", "h5", "h6"}
+SKIPPED_TYPES = {"error", "PageBreak", "Footer"}
+BLOCK_SEPARATOR = "\n\n"
+CHUNK_ID_NAMESPACE = uuid.UUID("7f1c2a4e-52d4-4b8e-9a51-3c0f0e6b9d21")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def content_hash(text: str) -> str:
+    """SHA-256 of the chunk text after Unicode and whitespace normalisation."""
+    normalized = _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class ChunkIdentity:
+    """
+    Content-addressed chunk ids for one document. Identical text repeated within the
+    document gets an occurrence suffix so ids stay unique but still stable across runs.
+    """
+
+    def __init__(self, tenant_id: str, document_id: str):
+        self.tenant_id = tenant_id
+        self.document_id = document_id
+        self._seen = Counter()
+
+    def assign(self, text: str) -> tuple:
+        digest = content_hash(text)
+        occurrence = self._seen[digest]
+        self._seen[digest] += 1
+        name = f"{self.tenant_id}:{self.document_id}:{digest}:{occurrence}"
+        return str(uuid.uuid5(CHUNK_ID_NAMESPACE, name)), digest
 
 
 def chunk_text(
@@ -14,11 +49,14 @@ def chunk_text(
     chunks = []
     start = 0
     index = 0
+    identity = ChunkIdentity(tenant_id, document_id)
     while start < len(text):
         end = min(start + chunk_size, len(text))
         chunk = text[start:end]
+        chunk_id, digest = identity.assign(chunk)
         chunk_data = {
-            "chunk_id": str(uuid.uuid4()),
+            "chunk_id": chunk_id,
+            "content_hash": digest,
             "tenant_id": tenant_id,
             "document_id": document_id,
             "chunk_text": chunk,
@@ -30,3 +68,176 @@ def chunk_text(
         start += chunk_size - chunk_overlap
         index += 1
     return chunks
+
+
+def iter_blocks(structured_text) -> Iterator[Dict]:
+    """Yield typed blocks from any extractor output shape (PDF block list or URL sections)."""
+    if isinstance(structured_text, dict):
+        structured_text = structured_text.get("sections", [])
+    for block in structured_text or []:
+        if isinstance(block, dict) and block.get("type") not in SKIPPED_TYPES:
+            yield block
+
+
+def _split_long_text(
+    text: str, chunk_size: int, chunk_overlap: int, first_size: Optional[int] = None
+) -> Iterator[tuple]:
+    """Slide over one oversized block, preferring to cut at whitespace."""
+    start = 0
+    size = first_size or chunk_size
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            cut = text.rfind(" ", start + size // 2, end)
+            end = cut if cut > start else end
+        yield start, end
+        if end >= len(text):
+            break
+        start = max(end - chunk_overlap, start + 1)
+        size = chunk_size
+
+
+class _Window:
+    """The chunk being assembled: text parts plus the pages and block types they came from."""
+
+    def __init__(self, prefix: str = ""):
+        self.parts = [prefix] if prefix else []
+        self.length = len(prefix)
+        self.pages: List[int] = []
+        self.types: List[str] = []
+        self.start: Optional[int] = None
+        self.end: Optional[int] = None
+
+    def add(self, text: str, block_type: str, page, start: int):
+        if self.parts:
+            self.length += len(BLOCK_SEPARATOR)
+        self.parts.append(text)
+        self.length += len(text)
+        if page is not None and page not in self.pages:
+            self.pages.append(page)
+        if block_type not in self.types:
+            self.types.append(block_type)
+        self.start = start if self.start is None else self.start
+        self.end = start + len(text)
+
+    @property
+    def has_content(self) -> bool:
+        return self.start is not None
+
+    @property
+    def heading_only(self) -> bool:
+        return bool(self.types) and all(t in HEADING_TYPES for t in self.types)
+
+    def text(self) -> str:
+        return BLOCK_SEPARATOR.join(self.parts)
+
+
+def iter_chunks(
+    blocks: Iterable[Dict],
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+    tenant_id: str = "default",
+    document_id: str = "unknown",
+    split_on_page: bool = CHUNK_SPLIT_ON_PAGE,
+) -> Iterator[Dict]:
+    """
+    Lazily chunk a stream of typed extractor blocks.
+
+    Blocks are packed whole into chunks of up to ``chunk_size`` characters (plus a leading
+    heading); only a block longer than that is split. A heading always starts a new chunk
+    (and is carried as ``section`` on the chunks under it), as does a page change when
+    ``split_on_page`` is set. Consecutive chunks within a section share ``chunk_overlap``
+    trailing characters.
+    Headings are known only from block types: HTML sections, unstructured's ``Title`` and
+    ``Header``, and PyMuPDF blocks the extractor typed ``Title`` by font size or weight.
+    pdfplumber and OCR output carries no such types, so those documents chunk without sections.
+    Chunks are yielded as soon as they close, so memory is bounded by one window.
+    """
+    index = 0
+    offset = 0
+    section = None
+    window = _Window()
+    identity = ChunkIdentity(tenant_id, document_id)
+
+    def emit(current: _Window) -> Dict:
+        nonlocal index
+        text = current.text()
+        chunk_id, digest = identity.assign(text)
+        chunk = {
+            "chunk_id": chunk_id,
+            "content_hash": digest,
+            "tenant_id": tenant_id,
+            "document_id": document_id,
+            "chunk_text": text,
+            "chunk_index": index,
+            "start_offset": current.start,
+            "end_offset": current.end,
+            "metadata": {
+                "page_numbers": current.pages,
+                "block_types": current.types,
+                "section": section,
+            },
+        }
+        index += 1
+        return chunk
+
+    def overlap_prefix(current: _Window) -> str:
+        if chunk_overlap <= 0:
+            return ""
+        tail = current.text()[-chunk_overlap:]
+        # Start the overlap on a word boundary when there is one.
+        space = tail.find(" ")
+        return tail[space + 1 :] if 0 <= space < len(tail) - 1 else tail
+
+    for block in blocks:
+        text = (block.get("text") or "").strip()
+        if not text:
+            continue
+        block_type = block.get("type") or "Text"
+        page = (block.get("metadata") or {}).get("page_number")
+        block_start = offset
+        offset += len(text) + len(BLOCK_SEPARATOR)
+
+        is_heading = block_type in HEADING_TYPES
+        page_changed = split_on_page and window.pages and page not in window.pages
+        if window.has_content and (is_heading or page_changed):
+            yield emit(window)
+            window = _Window()
+        if is_heading:
+            section = text
+
+        if window.length + len(BLOCK_SEPARATOR) + len(text) <= chunk_size:
+            window.add(text, block_type, page, block_start)
+            continue
+        if window.heading_only and len(text) <= chunk_size:
+            # The heading goes with the block under it, and only the block is sized: a block
+            # that fits a chunk is not split because a heading precedes it.
+            window.add(text, block_type, page, block_start)
+            continue
+
+        if window.has_content and not window.heading_only:
+            yield emit(window)
+            window = _Window(overlap_prefix(window))
+            if window.length + len(BLOCK_SEPARATOR) + len(text) <= chunk_size:
+                window.add(text, block_type, page, block_start)
+                continue
+            window = _Window()
+
+        # A single block larger than a chunk: emit full-size slices, keep the tail open. A
+        # pending heading stays attached to the first slice.
+        first_size = None
+        if window.has_content:
+            first_size = chunk_size - window.length - len(BLOCK_SEPARATOR)
+            if first_size < chunk_size // 4:
+                yield emit(window)
+                window, first_size = _Window(), None
+        pieces = list(_split_long_text(text, chunk_size, chunk_overlap, first_size))
+        for piece_start, piece_end in pieces[:-1]:
+            piece, window = window, _Window()
+            piece.add(text[piece_start:piece_end], block_type, page, block_start + piece_start)
+            yield emit(piece)
+        tail_start, tail_end = pieces[-1]
+        window.add(text[tail_start:tail_end], block_type, page, block_start + tail_start)
+
+    if window.has_content:
+        yield emit(window)
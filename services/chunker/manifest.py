@@ -0,0 +1,54 @@
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+def manifest_blob_name(payload: dict) -> str:
+    """Named after the extracted JSON, in the pipeline-state bucket: ``file/<id>.chunks.json``."""
+    extracted = payload.get("extracted_blob") or (
+        f"{payload.get('source', 'file')}/{payload['document_id']}.json"
+    )
+    if extracted.endswith(".json"):
+        extracted = extracted[: -len(".json")]
+    return f"{extracted}.chunks.json"
+
+
+class ChunkDiff:
+    """
+    Compares freshly generated chunks against the previous manifest of the same document.
+
+    Because chunk ids are content-addressed, an unchanged chunk keeps its id: ``filter``
+    passes through only ids the previous run did not publish, and ``tombstones`` lists the
+    ids that disappeared.
+    """
+
+    def __init__(self, previous: Optional[dict]):
+        self.previous: Dict[str, dict] = (previous or {}).get("chunks", {})
+        self.current: Dict[str, dict] = {}
+        self.unchanged = 0
+
+    def filter(self, chunks: Iterable[dict]) -> Iterator[dict]:
+        for chunk in chunks:
+            chunk_id = chunk["chunk_id"]
+            self.current[chunk_id] = {
+                "chunk_index": chunk["chunk_index"],
+                "content_hash": chunk["content_hash"],
+            }
+            if chunk_id in self.previous:
+                self.unchanged += 1
+                continue
+            chunk["op"] = "upsert"
+            yield chunk
+
+    def tombstones(self, tenant_id: str, document_id: str) -> List[dict]:
+        return [
+            {
+                "op": "delete",
+                "chunk_id": chunk_id,
+                "tenant_id": tenant_id,
+                "document_id": document_id,
+            }
+            for chunk_id in self.previous
+            if chunk_id not in self.current
+        ]
+
+    def manifest(self, tenant_id: str, document_id: str) -> dict:
+        return {"tenant_id": tenant_id, "document_id": document_id, "chunks": self.current}
@@ -0,0 +1,471 @@
+"""
+Near-duplicate chunk detection with MinHash signatures and a per-tenant LSH index.
+
+Each chunk's text is lower-cased, cut into word ``CHUNK_DEDUP_SHINGLE_SIZE``-grams and reduced
+to a ``CHUNK_DEDUP_NUM_PERM``-value MinHash signature. The share of equal values in two
+signatures estimates the Jaccard similarity of their shingle sets. Signatures are split into
+bands, and chunks sharing a band bucket are candidates. A candidate whose estimated similarity
+reaches ``CHUNK_DEDUP_THRESHOLD`` makes the new chunk its near-duplicate; the first chunk seen
+stays canonical. The band layout is chosen to sit just below the threshold, so candidates are
+rarely missed and the exact check weeds out the extra ones.
+
+In ``skip`` mode the index also remembers each canonical chunk's aliases. When a canonical chunk
+is tombstoned it leaves the index, and its first alias is promoted in its place: an
+``op: "promote"`` event lets the embedder store the canonical vector under the alias's id, and
+the remaining aliases are re-published pointing at the promoted chunk. So an alias never
+resolves to a deleted vector.
+
+Indexes are kept in memory per tenant and snapshotted to ``<CHUNK_DEDUP_PREFIX>/<tenant>.npz``
+in the pipeline-state bucket by a background thread, at most every
+``CHUNK_DEDUP_SNAPSHOT_SECONDS``. A snapshot merges with the one already stored, so chunker
+replicas converge on one index over time; a duplicate that one replica has not heard of yet is
+simply embedded as before. Snapshots carry the ids removed from the index so a merge does not
+bring them back.
+"""
+import collections
+import hashlib
+import io
+import logging
+import re
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config import (CHUNK_DEDUP_MAX_ENTRIES, CHUNK_DEDUP_MODE, CHUNK_DEDUP_NUM_PERM,
+                    CHUNK_DEDUP_PREFIX, CHUNK_DEDUP_SHINGLE_SIZE, CHUNK_DEDUP_SNAPSHOT_SECONDS,
+                    CHUNK_DEDUP_THRESHOLD, PIPELINE_STATE_BUCKET)
+from shared.instrumentation import REGISTRY
+from shared.storage.blob_store import BlobNotFound, get_blob_store
+
+logger = logging.getLogger(__name__)
+
+NEAR_DUPLICATES = REGISTRY.counter(
+    "chunker_near_duplicates_total", "Chunks found to be near-duplicates", ("action",)
+)
+EMBEDDINGS_AVOIDED = REGISTRY.counter(
+    "chunker_embeddings_avoided_total", "Chunks not sent for embedding as near-duplicates"
+)
+PROMOTED = REGISTRY.counter(
+    "chunker_dedup_promotions_total", "Aliases promoted to canonical after a tombstone"
+)
+INDEX_SIZE = REGISTRY.gauge("chunker_dedup_index_entries", "Canonical chunks indexed", ("tenant",))
+
+_WORD = re.compile(r"\w+")
+SEED = 1
+
+
+def band_layout(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """
+    ``(bands, rows)`` with ``bands * rows == num_perm`` whose LSH threshold ``(1/b)^(1/r)`` is
+    the highest one not above ``threshold``.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+
+class MinHasher:
+    def __init__(self, num_perm: int, shingle_size: int, seed: int = SEED):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hashing; an odd multiplier keeps each permutation a bijection mod 2^64.
+        self._a = rng.integers(1, 2**63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        words = _WORD.findall(text.lower())
+        n = self.shingle_size
+        grams = {" ".join(words[i : i + n]) for i in range(max(len(words) - n + 1, 1))}
+        digests = (hashlib.blake2b(gram.encode("utf-8"), digest_size=4).digest() for gram in grams)
+        return np.fromiter(
+            (int.from_bytes(digest, "little") for digest in digests),
+            dtype=np.uint64,
+            count=len(grams),
+        )
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = self.shingles(text)
+        # uint64 arithmetic wraps, which is exactly the mod 2^64 the hash family needs.
+        values = (self._a[:, None] * hashes[None, :] + self._b[:, None]) >> np.uint64(32)
+        return values.min(axis=1).astype(np.uint32)
+
+
+Entry = Tuple[str, str, str]  # (chunk_id, document_id, content_hash)
+
+
+class LshIndex:
+    def __init__(self, bands: int, rows: int, max_removed: int = 0):
+        self.bands = bands
+        self.rows = rows
+        self.max_removed = max_removed
+        self.entries: Dict[str, Tuple[Entry, np.ndarray]] = {}
+        self.aliases: Dict[str, List[Entry]] = {}  # canonical chunk_id -> its aliases
+        self.removed: Dict[str, None] = {}  # insertion-ordered set of evicted chunk ids
+        self._canonical_of: Dict[str, str] = {}
+        self._buckets: List[Dict[int, List[str]]] = [{} for _ in range(bands)]
+
+    def _keys(self, signature: np.ndarray) -> Iterator[int]:
+        for band in range(self.bands):
+            yield hash(signature[band * self.rows : (band + 1) * self.rows].tobytes())
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def query(self, signature: np.ndarray, threshold: float) -> Optional[Tuple[Entry, float]]:
+        """The most similar indexed chunk at or above ``threshold``, with its similarity."""
+        best, seen = None, set()
+        for buckets, key in zip(self._buckets, self._keys(signature)):
+            for chunk_id in buckets.get(key, ()):
+                if chunk_id in seen:
+                    continue
+                seen.add(chunk_id)
+                entry, indexed = self.entries[chunk_id]
+                similarity = float(np.mean(indexed == signature))
+                if similarity >= threshold and (best is None or similarity > best[1]):
+                    best = (entry, similarity)
+        return best
+
+    def add(self, entry: Entry, signature: np.ndarray):
+        if entry[0] in self.entries:
+            return
+        self.entries[entry[0]] = (entry, signature)
+        self.removed.pop(entry[0], None)
+        for buckets, key in zip(self._buckets, self._keys(signature)):
+            buckets.setdefault(key, []).append(entry[0])
+
+    def add_alias(self, canonical_id: str, alias: Entry):
+        if alias[0] in self._canonical_of or alias[0] in self.entries:
+            return
+        self.aliases.setdefault(canonical_id, []).append(alias)
+        self._canonical_of[alias[0]] = canonical_id
+
+    def remove(self, chunk_id: str) -> Optional[Tuple[Entry, np.ndarray, List[Entry]]]:
+        """
+        Drop a chunk from the index. Returns its entry, signature and aliases if it was
+        canonical; an alias is only dropped from its canonical chunk's list.
+        """
+        self.removed[chunk_id] = None
+        while self.max_removed and len(self.removed) > self.max_removed:
+            del self.removed[next(iter(self.removed))]
+        canonical_id = self._canonical_of.pop(chunk_id, None)
+        if canonical_id is not None:
+            remaining = [alias for alias in self.aliases[canonical_id] if alias[0] != chunk_id]
+            if remaining:
+                self.aliases[canonical_id] = remaining
+            else:
+                del self.aliases[canonical_id]
+            return None
+        if chunk_id not in self.entries:
+            return None
+        entry, signature = self.entries.pop(chunk_id)
+        for buckets, key in zip(self._buckets, self._keys(signature)):
+            bucket = buckets[key]
+            bucket.remove(chunk_id)
+            if not bucket:
+                del buckets[key]
+        aliases = self.aliases.pop(chunk_id, [])
+        for alias in aliases:
+            del self._canonical_of[alias[0]]
+        return entry, signature, aliases
+
+    def export(self) -> Tuple[List[Tuple[Entry, np.ndarray]], List[Tuple[str, ...]], List[str]]:
+        """Shallow copies of entries, alias rows and removed ids, for a snapshot."""
+        alias_rows = [
+            (canonical_id, *alias)
+            for canonical_id, aliases in self.aliases.items()
+            for alias in aliases
+        ]
+        return list(self.entries.values()), alias_rows, list(self.removed)
+
+
+def _canonical(entry: Entry, similarity: Optional[float] = None) -> dict:
+    chunk_id, document_id, content_hash = entry
+    canonical = {"chunk_id": chunk_id, "document_id": document_id, "content_hash": content_hash}
+    if similarity is not None:
+        canonical["similarity"] = round(similarity, 3)
+    return canonical
+
+
+class NearDuplicateFilter:
+    """
+    The chunker's dedup stage. ``apply`` passes chunks through in order; a near-duplicate is
+    either published with a ``near_duplicate_of`` reference (``mode="mark"``) or replaced by an
+    ``op: "alias"`` event without text that points at its canonical chunk (``mode="skip"``),
+    so it is never embedded. ``evict`` takes tombstoned chunks out of the index.
+    """
+
+    def __init__(
+        self,
+        threshold: float = CHUNK_DEDUP_THRESHOLD,
+        mode: str = CHUNK_DEDUP_MODE,
+        num_perm: int = CHUNK_DEDUP_NUM_PERM,
+        shingle_size: int = CHUNK_DEDUP_SHINGLE_SIZE,
+        max_entries: int = CHUNK_DEDUP_MAX_ENTRIES,
+        snapshot_seconds: float = CHUNK_DEDUP_SNAPSHOT_SECONDS,
+    ):
+        if mode not in ("mark", "skip"):
+            raise ValueError(f"CHUNK_DEDUP_MODE must be 'mark' or 'skip', not {mode!r}")
+        self.threshold = threshold
+        self.mode = mode
+        self.max_entries = max_entries
+        self.snapshot_seconds = snapshot_seconds
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.bands, self.rows = band_layout(num_perm, threshold)
+        self._indexes: Dict[str, LshIndex] = {}
+        self._locks: Dict[str, threading.Lock] = collections.defaultdict(threading.Lock)
+        self._locks_guard = threading.Lock()
+        self._dirty: set = set()
+        self._saved_at: Dict[str, float] = {}
+        # Events owed because a merged snapshot evicted canonical chunks; sent with the next
+        # ``evict`` for the tenant.
+        self._pending: Dict[str, List[dict]] = collections.defaultdict(list)
+        self._requested: set = set()
+        self._saving = threading.Lock()  # one write per snapshot at a time
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._snapshot_loop, name="near-dedup-snapshots", daemon=True
+        )
+        self._thread.start()
+
+    def _lock(self, tenant_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks[tenant_id]
+
+    def _snapshot_name(self, tenant_id: str) -> str:
+        return f"{CHUNK_DEDUP_PREFIX}/{tenant_id}.npz"
+
+    def _read_snapshot(self, tenant_id: str) -> Optional[dict]:
+        """The stored snapshot as plain lists, or None. Does not touch the in-memory index."""
+        try:
+            data = get_blob_store().read(PIPELINE_STATE_BUCKET, self._snapshot_name(tenant_id))
+        except BlobNotFound:
+            return None
+        with np.load(io.BytesIO(data), allow_pickle=False) as stored:
+            params = tuple(int(value) for value in stored["params"])
+            if params != (self.hasher.num_perm, self.hasher.shingle_size, SEED):
+                logger.warning("Ignoring dedup snapshot for %s built with %s", tenant_id, params)
+                return None
+            # Snapshots from before eviction have neither aliases nor removed ids.
+            return {
+                "entries": [tuple(entry) for entry in stored["entries"].tolist()],
+                "signatures": stored["signatures"],
+                "aliases": stored["aliases"].tolist() if "aliases" in stored.files else [],
+                "removed": stored["removed"].tolist() if "removed" in stored.files else [],
+            }
+
+    def _merge(self, index: LshIndex, tenant_id: str, stored: dict) -> int:
+        """
+        Fold a stored snapshot into ``index``; returns how many entries were new. Hold the
+        tenant lock.
+        """
+        for chunk_id in stored["removed"]:
+            if chunk_id not in index.removed:
+                self._pending[tenant_id].extend(self._evict(index, tenant_id, chunk_id))
+        added = 0
+        for entry, signature in zip(stored["entries"], stored["signatures"]):
+            if entry[0] not in index and entry[0] not in index.removed:
+                # Copy the row so the whole stored array is not kept alive by it.
+                index.add(entry, signature.copy())
+                added += 1
+        for canonical_id, *alias in stored["aliases"]:
+            if canonical_id in index and alias[0] not in index.removed:
+                index.add_alias(canonical_id, tuple(alias))
+        return added
+
+    def _index(self, tenant_id: str) -> LshIndex:
+        """The tenant's index, loaded from its snapshot on first use. Hold the tenant lock."""
+        index = self._indexes.get(tenant_id)
+        if index is None:
+            index = LshIndex(self.bands, self.rows, max_removed=self.max_entries)
+            stored = self._read_snapshot(tenant_id)
+            loaded = self._merge(index, tenant_id, stored) if stored else 0
+            logger.info("Loaded %d dedup entries for tenant %s", loaded, tenant_id)
+            self._indexes[tenant_id] = index
+            self._saved_at[tenant_id] = time.monotonic()
+            INDEX_SIZE.set(len(index), tenant=tenant_id)
+        return index
+
+    def apply(
+        self, chunks: Iterable[dict], tenant_id: str, stats: Dict[str, int]
+    ) -> Iterator[dict]:
+        """Yield chunks or alias events; counts ``marked``/``skipped`` into ``stats``."""
+        lock = self._lock(tenant_id)
+        for chunk in chunks:
+            signature = self.hasher.signature(chunk["chunk_text"])
+            entry = (chunk["chunk_id"], chunk["document_id"], chunk["content_hash"])
+            with lock:
+                index = self._index(tenant_id)
+                match = index.query(signature, self.threshold)
+                if match is None and len(index) < self.max_entries:
+                    index.add(entry, signature)
+                    self._dirty.add(tenant_id)
+                    INDEX_SIZE.set(len(index), tenant=tenant_id)
+                elif match is not None and self.mode == "skip" and match[0][0] != entry[0]:
+                    index.add_alias(match[0][0], entry)
+                    self._dirty.add(tenant_id)
+            if match is None or match[0][0] == chunk["chunk_id"]:
+                yield chunk
+                continue
+
+            canonical = _canonical(*match)
+            NEAR_DUPLICATES.inc(action=self.mode)
+            if self.mode == "mark":
+                stats["marked"] += 1
+                yield {**chunk, "near_duplicate_of": canonical}
+                continue
+            stats["skipped"] += 1
+            EMBEDDINGS_AVOIDED.inc()
+            yield {
+                **{key: value for key, value in chunk.items() if key != "chunk_text"},
+                "op": "alias",
+                "canonical": canonical,
+            }
+
+    def _evict(self, index: LshIndex, tenant_id: str, chunk_id: str) -> List[dict]:
+        removed = index.remove(chunk_id)
+        if removed is None:
+            return []
+        entry, signature, aliases = removed
+        if not aliases:
+            return []
+        # The alias is a near-duplicate of the evicted chunk, so its signature stands in.
+        promoted, rest = aliases[0], aliases[1:]
+        index.add(promoted, signature)
+        events = [
+            {
+                "op": "promote",
+                "tenant_id": tenant_id,
+                "chunk_id": promoted[0],
+                "document_id": promoted[1],
+                "content_hash": promoted[2],
+                "canonical": _canonical(entry),
+            }
+        ]
+        for alias in rest:
+            index.add_alias(promoted[0], alias)
+            events.append(
+                {
+                    "op": "alias",
+                    "tenant_id": tenant_id,
+                    "chunk_id": alias[0],
+                    "document_id": alias[1],
+                    "content_hash": alias[2],
+                    "canonical": _canonical(promoted),
+                }
+            )
+        PROMOTED.inc()
+        return events
+
+    def evict(self, tenant_id: str, chunk_ids: Iterable[str]) -> List[dict]:
+        """
+        Remove tombstoned chunks from the index. Returns the events that keep their aliases
+        resolvable (a ``promote`` and re-pointed ``alias`` events per evicted canonical chunk),
+        to be published before the tombstones.
+        """
+        with self._lock(tenant_id):
+            index = self._index(tenant_id)
+            events = self._pending.pop(tenant_id, [])
+            for chunk_id in chunk_ids:
+                events.extend(self._evict(index, tenant_id, chunk_id))
+                self._dirty.add(tenant_id)
+            INDEX_SIZE.set(len(index), tenant=tenant_id)
+        return events
+
+    def snapshot(self, tenant_id: str):
+        """Ask the background thread to persist the tenant's index once it is due."""
+        with self._condition:
+            self._requested.add(tenant_id)
+            self._condition.notify()
+
+    def _due_in(self, tenant_id: str) -> float:
+        return self._saved_at.get(tenant_id, 0.0) + self.snapshot_seconds - time.monotonic()
+
+    def _snapshot_loop(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopped:
+                        return
+                    due = [tenant for tenant in self._requested if self._due_in(tenant) <= 0]
+                    if due:
+                        break
+                    waits = [self._due_in(tenant) for tenant in self._requested]
+                    self._condition.wait(min(waits) if waits else None)
+                self._requested.difference_update(due)
+            for tenant_id in due:
+                try:
+                    self._save(tenant_id)
+                except Exception:
+                    logger.error("Dedup snapshot for %s failed", tenant_id, exc_info=True)
+
+    def _save(self, tenant_id: str):
+        """
+        Merge the stored snapshot in and write the result. Reading, compressing and writing
+        happen outside the tenant lock, so ``apply`` is only held up by the merge itself.
+        """
+        lock = self._lock(tenant_id)
+        with self._saving:
+            with lock:
+                if tenant_id not in self._dirty:
+                    return
+                self._dirty.discard(tenant_id)
+            self._write(tenant_id, lock)
+
+    def _write(self, tenant_id: str, lock: threading.Lock):
+        try:
+            # Pick up what other replicas stored since we loaded, so we don't overwrite it.
+            stored = self._read_snapshot(tenant_id)
+            with lock:
+                index = self._indexes[tenant_id]
+                if stored:
+                    self._merge(index, tenant_id, stored)
+                items, alias_rows, removed = index.export()
+                INDEX_SIZE.set(len(index), tenant=tenant_id)
+            buffer = io.BytesIO()
+            np.savez_compressed(
+                buffer,
+                params=np.array([self.hasher.num_perm, self.hasher.shingle_size, SEED]),
+                entries=np.array([entry for entry, _ in items], dtype=str).reshape(-1, 3),
+                signatures=(
+                    np.stack([signature for _, signature in items])
+                    if items
+                    else np.zeros((0, self.hasher.num_perm), dtype=np.uint32)
+                ),
+                aliases=np.array(alias_rows, dtype=str).reshape(-1, 4),
+                removed=np.array(removed, dtype=str),
+            )
+            get_blob_store().write(
+                PIPELINE_STATE_BUCKET,
+                self._snapshot_name(tenant_id),
+                buffer.getvalue(),
+                content_type="application/octet-stream",
+            )
+        except Exception:
+            with lock:
+                self._dirty.add(tenant_id)
+            raise
+        self._saved_at[tenant_id] = time.monotonic()
+        logger.info("Saved dedup snapshot for tenant %s (%d entries)", tenant_id, len(items))
+
+    def flush(self):
+        """Snapshot every changed tenant now, e.g. at shutdown."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for tenant_id in list(self._dirty):
+            try:
+                self._save(tenant_id)
+            except Exception:
+                logger.error("Dedup snapshot for %s failed", tenant_id, exc_info=True)
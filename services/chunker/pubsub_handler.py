@@ -1,22 +1,113 @@
-from chunking import chunk_text
+import atexit
+import collections
+import logging
 
-from shared.pubsub.publisher import publish_event
+from chunking import chunk_text, iter_blocks, iter_chunks
+from manifest import ChunkDiff, manifest_blob_name
+from near_dedup import NearDuplicateFilter
 
+from config import (CHUNK_DEDUP_ENABLED, CHUNK_INCREMENTAL, CHUNK_OVERLAP, CHUNK_SIZE,
+                    PUBSUB_EMBEDDING_TOPIC)
+from shared.instrumentation import REGISTRY, stage_timer
+from shared.profiling import profiled
+from shared.pubsub.publisher import publish_events
+from shared.storage.claim_check import has_structured_text, resolve_structured_text
+from shared.storage.gcs_client import load_state_json, save_state_json
 
+logger = logging.getLogger(__name__)
+
+CHUNKS = REGISTRY.counter("chunker_chunks_total", "Chunk events published", ("op",))
+
+near_duplicates = NearDuplicateFilter() if CHUNK_DEDUP_ENABLED else None
+if near_duplicates is not None:
+    atexit.register(near_duplicates.flush)
+
+
+def _log_near_duplicates(document_id: str, stats: dict):
+    if stats["marked"] or stats["skipped"]:
+        logger.info(
+            "Document %s: %d near-duplicate chunks marked, %d skipped (embedding calls avoided)",
+            document_id,
+            stats["marked"],
+            stats["skipped"],
+        )
+
+
+@profiled("chunk")
 def handle_extracted_text_message(payload: dict):
     document_id = payload["document_id"]
     tenant_id = payload["tenant_id"]
-    text = payload["text"]
-    chunk_size = payload.get("chunk_size", 1000)
-    chunk_overlap = payload.get("chunk_overlap", 200)
-
-    chunks = chunk_text(
-        text=text,
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        tenant_id=tenant_id,
-        document_id=document_id,
-    )
+    chunk_size = payload.get("chunk_size", CHUNK_SIZE)
+    chunk_overlap = payload.get("chunk_overlap", CHUNK_OVERLAP)
+
+    if has_structured_text(payload):
+        # Chunks are generated lazily and published as they close.
+        chunks = iter_chunks(
+            iter_blocks(resolve_structured_text(payload)),
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            tenant_id=tenant_id,
+            document_id=document_id,
+        )
+    else:
+        chunks = chunk_text(
+            text=payload["text"],
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            tenant_id=tenant_id,
+            document_id=document_id,
+        )
 
-    for chunk in chunks:
-        publish_event("embedding-topic", chunk)
+    near_duplicate_stats = collections.Counter()
+    if not CHUNK_INCREMENTAL:
+        if near_duplicates is not None:
+            chunks = near_duplicates.apply(chunks, tenant_id, near_duplicate_stats)
+        # Chunking is lazy, so this stage covers claim-check resolution and chunking too.
+        with stage_timer("chunk_publish"):
+            message_ids = publish_events(PUBSUB_EMBEDDING_TOPIC, chunks)
+        CHUNKS.inc(len(message_ids) - near_duplicate_stats["skipped"], op="upsert")
+        CHUNKS.inc(near_duplicate_stats["skipped"], op="alias")
+        logger.info("Published %d chunks for document %s", len(message_ids), document_id)
+        if near_duplicates is not None:
+            _log_near_duplicates(document_id, near_duplicate_stats)
+            near_duplicates.snapshot(tenant_id)
+        return
+
+    # Publish only chunks the previous version did not have, then tombstones for the ones
+    # it had that are gone. The manifest is written last so a crash simply repeats the work.
+    manifest_name = manifest_blob_name(payload)
+    with stage_timer("load_manifest"):
+        diff = ChunkDiff(load_state_json(manifest_name))
+    new_chunks = diff.filter(chunks)
+    if near_duplicates is not None:
+        # After the diff, so only chunks that are new to this document are looked up.
+        new_chunks = near_duplicates.apply(new_chunks, tenant_id, near_duplicate_stats)
+    with stage_timer("chunk_publish"):
+        message_ids = publish_events(PUBSUB_EMBEDDING_TOPIC, new_chunks)
+        tombstones = diff.tombstones(tenant_id, document_id)
+        promotions = []
+        if near_duplicates is not None:
+            # Before the tombstones, so aliases of a removed canonical chunk keep a vector.
+            promotions = near_duplicates.evict(
+                tenant_id, [tombstone["chunk_id"] for tombstone in tombstones]
+            )
+            if promotions:
+                publish_events(PUBSUB_EMBEDDING_TOPIC, promotions)
+        if tombstones:
+            publish_events(PUBSUB_EMBEDDING_TOPIC, tombstones)
+    with stage_timer("save_manifest"):
+        save_state_json(manifest_name, diff.manifest(tenant_id, document_id))
+    CHUNKS.inc(len(message_ids) - near_duplicate_stats["skipped"], op="upsert")
+    CHUNKS.inc(near_duplicate_stats["skipped"], op="alias")
+    CHUNKS.inc(len(tombstones), op="delete")
+    CHUNKS.inc(len(promotions), op="promote")
+    logger.info(
+        "Document %s: %d new chunks, %d unchanged, %d removed",
+        document_id,
+        len(message_ids),
+        diff.unchanged,
+        len(tombstones),
+    )
+    if near_duplicates is not None:
+        _log_near_duplicates(document_id, near_duplicate_stats)
+        near_duplicates.snapshot(tenant_id)
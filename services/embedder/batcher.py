@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Generic, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Collects items submitted from many threads into batches for ``process``.
+
+    A batch is handed over when it holds ``max_size`` items or ``max_wait`` seconds after its
+    first item arrived, whichever comes first, so a quiet topic still sees low latency and a
+    busy one gets full batches. ``process`` runs on one background thread and returns one
+    result per item; ``submit`` returns a Future for that item's result, or the exception
+    ``process`` raised for the whole batch. A result that is an exception fails its item alone.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[List[T]], List[R]],
+        max_size: int,
+        max_wait: float,
+        name: str = "micro-batcher",
+    ):
+        self.process = process
+        self.max_size = max(max_size, 1)
+        self.max_wait = max_wait
+        self._pending: List[Tuple[T, Future, float]] = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: T) -> Future:
+        future: Future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._pending.append((item, future, time.monotonic()))
+            self._condition.notify_all()
+        return future
+
+    def _next_batch(self) -> List[Tuple[T, Future, float]]:
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            while self._pending and len(self._pending) < self.max_size and not self._closed:
+                remaining = self._pending[0][2] + self.max_wait - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending[: self.max_size]
+            del self._pending[: self.max_size]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return  # closed and drained
+            try:
+                results = self.process([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"process returned {len(results)} results for {len(batch)}")
+            except BaseException as e:
+                logger.error("Batch of %d failed: %s", len(batch), e, exc_info=True)
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def close(self, timeout: Optional[float] = None):
+        """Flush what is queued, then stop the worker thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
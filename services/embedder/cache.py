@@ -0,0 +1,92 @@
+"""
+Vectors by chunk content hash, so unchanged text is never embedded twice.
+
+An in-process LRU of ``EMBED_CACHE_SIZE`` vectors sits in front of an optional on-disk tier
+(``EMBED_CACHE_DIR``, one small raw file per vector, off by default) that survives restarts and
+can be shared by workers on the same volume. Nothing evicts files from it. Entries live under
+a directory named after the embedder, so switching embedders or dimensions never serves vectors
+from another space.
+"""
+import collections
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional, OrderedDict, Tuple
+
+import numpy as np
+
+from config import EMBED_CACHE_DIR, EMBED_CACHE_SIZE, EMBED_DTYPE
+from shared.instrumentation import REGISTRY
+
+LOOKUPS = REGISTRY.counter(
+    "embedder_cache_lookups_total", "Cache lookups by tier that answered", ("result",)
+)
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        namespace: str,
+        dim: int,
+        capacity: int = EMBED_CACHE_SIZE,
+        directory: Optional[str] = EMBED_CACHE_DIR,
+        dtype: str = EMBED_DTYPE,
+    ):
+        self.dim = dim
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.directory = Path(directory) / namespace if directory else None
+        self._entries: OrderedDict[str, np.ndarray] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.bin"
+
+    def _remember(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[np.ndarray]:
+        try:
+            data = self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+        if len(data) != self.dim * self.dtype.itemsize:
+            return None  # torn or foreign file; recompute and overwrite
+        return np.frombuffer(data, dtype=self.dtype)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        for key in dict.fromkeys(keys):
+            with self._lock:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+            if vector is not None:
+                LOOKUPS.inc(result="memory")
+            elif self.directory is not None and (vector := self._read_disk(key)) is not None:
+                LOOKUPS.inc(result="disk")
+                self._remember(key, vector)
+            else:
+                LOOKUPS.inc(result="miss")
+                continue
+            found[key] = vector
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, np.ndarray]]):
+        for key, vector in items:
+            vector = np.ascontiguousarray(vector, dtype=self.dtype)
+            self._remember(key, vector)
+            if self.directory is None:
+                continue
+            path = self._path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(vector.tobytes())
+            os.replace(tmp, path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,104 @@
+"""
+CPU embedders for chunk text.
+
+``HashingEmbedder`` is the default: signed feature hashing of word unigrams, word bigrams and
+character trigrams into ``EMBED_DIM`` buckets, with sublinear term frequency and L2
+normalisation. It needs no model download, GPU or network, and because features are hashed
+with blake2b (not Python's per-process ``hash``) the same text gives the same vector on every
+replica, which is what makes cached and stored vectors reusable. A model-backed embedder can
+replace it with ``EMBEDDER_BACKEND=package.module:ClassName``.
+"""
+import collections
+import hashlib
+import importlib
+import math
+import re
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from config import EMBED_DIM, EMBEDDER_BACKEND
+
+_WORD = re.compile(r"\w+")
+# Memoised feature -> (bucket, sign); cleared when it grows past this many entries.
+_MAX_MEMO = 1_000_000
+
+
+class Embedder(ABC):
+    #: Identifies the vector space; cached and stored vectors are keyed by it.
+    name: str
+    dim: int
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """A ``(len(texts), dim)`` float32 array, one L2-normalised row per text."""
+
+
+class HashingEmbedder(Embedder):
+    def __init__(self, dim: int = EMBED_DIM, char_ngram: int = 3, char_weight: float = 0.5):
+        self.dim = dim
+        self.char_ngram = char_ngram
+        self.char_weight = char_weight
+        self.name = f"hashing-v1-{dim}-c{char_ngram}"
+        self._memo: Dict[str, Tuple[int, float]] = {}
+
+    def _slot(self, feature: str) -> Tuple[int, float]:
+        slot = self._memo.get(feature)
+        if slot is None:
+            digest = int.from_bytes(
+                hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little"
+            )
+            # The top bit picks the sign, so collisions cancel out instead of piling up.
+            slot = (digest % self.dim, 1.0 if digest >> 63 else -1.0)
+            if len(self._memo) >= _MAX_MEMO:
+                self._memo.clear()
+            self._memo[feature] = slot
+        return slot
+
+    def _features(self, text: str) -> Dict[str, float]:
+        words = _WORD.findall(text.lower())
+        counts = collections.Counter(words)
+        counts.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+        weights = {feature: 1.0 + math.log(count) for feature, count in counts.items()}
+        if self.char_ngram:
+            n = self.char_ngram
+            grams = collections.Counter()
+            for word in words:
+                padded = f"<{word}>"
+                # "#" keeps character n-grams apart from words of the same spelling.
+                grams.update(f"#{padded[i:i + n]}" for i in range(max(len(padded) - n + 1, 1)))
+            for gram, count in grams.items():
+                weights[gram] = self.char_weight * (1.0 + math.log(count))
+        return weights
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        rows, columns, values = [], [], []
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text).items():
+                column, sign = self._slot(feature)
+                rows.append(row)
+                columns.append(column)
+                values.append(sign * weight)
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        # add.at, not fancy-index assignment, so colliding features in one row accumulate.
+        np.add.at(
+            matrix,
+            (np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp)),
+            np.asarray(values, dtype=np.float32),
+        )
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms > 0, norms, 1.0)
+
+
+EMBEDDERS = {"hashing": HashingEmbedder}
+
+
+def load_embedder(spec: str = EMBEDDER_BACKEND) -> Embedder:
+    """A registered embedder by name, or ``package.module:ClassName`` built with no arguments."""
+    if spec in EMBEDDERS:
+        return EMBEDDERS[spec]()
+    module, _, attribute = spec.partition(":")
+    if not attribute:
+        raise ValueError(f"Unknown embedder {spec!r}; use {sorted(EMBEDDERS)} or module:Class")
+    return getattr(importlib.import_module(module), attribute)()
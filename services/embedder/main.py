@@ -0,0 +1,15 @@
+from pubsub_handler import handle_chunk_message
+
+from config import EMBEDDER_SUBSCRIBER, EMBEDDER_SUBSCRIPTION, METRICS_PORT, PUBSUB_EMBEDDING_TOPIC
+from shared.instrumentation import configure, start_metrics_server
+from shared.pubsub.subscriber import subscribe_to_topic
+
+if __name__ == "__main__":
+    configure("embedder")
+    start_metrics_server(METRICS_PORT)
+    subscribe_to_topic(
+        topic=PUBSUB_EMBEDDING_TOPIC,
+        subscription=EMBEDDER_SUBSCRIPTION,
+        callback=handle_chunk_message,
+        settings=EMBEDDER_SUBSCRIBER,
+    )
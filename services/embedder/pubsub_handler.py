@@ -0,0 +1,224 @@
+import collections
+import hashlib
+import logging
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+from batcher import MicroBatcher
+from cache import EmbeddingCache
+from embedders import Embedder, load_embedder
+
+from config import EMBED_BATCH_MAX_WAIT_MS, EMBED_BATCH_SIZE
+from shared.instrumentation import REGISTRY, stage_timer
+from shared.pubsub.quarantine import PoisonMessage
+from shared.storage.vector_segments import find_vector, write_segment
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = REGISTRY.histogram(
+    "embedder_batch_size",
+    "Chunk events per micro-batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+VECTORS = REGISTRY.counter(
+    "embedder_vectors_total", "Vectors written, by where they came from", ("source",)
+)
+VECTORS_PER_SECOND = REGISTRY.gauge(
+    "embedder_vectors_per_second", "Vectors written per second in the last batch"
+)
+CACHE_HIT_RATE = REGISTRY.gauge(
+    "embedder_cache_hit_rate", "Share of chunks served from the cache since start"
+)
+
+
+class MalformedEvent(PoisonMessage, ValueError):
+    """A chunk event without the fields its op needs; quarantined without retries."""
+
+
+def _validate(payload: dict):
+    if not isinstance(payload, dict):
+        raise MalformedEvent(f"Chunk event is a {type(payload).__name__}, not an object")
+    missing = [field for field in ("tenant_id", "chunk_id") if not payload.get(field)]
+    op = payload.get("op")
+    if op in ("alias", "promote"):
+        canonical = payload.get("canonical")
+        if not isinstance(canonical, dict) or not canonical.get("chunk_id"):
+            missing.append("canonical.chunk_id")
+        elif op == "promote" and not canonical.get("content_hash"):
+            missing.append("canonical.content_hash")
+    elif op != "delete" and not isinstance(payload.get("chunk_text", ""), str):
+        missing.append("chunk_text (as a string)")
+    if missing:
+        raise MalformedEvent(
+            f"Chunk event {payload.get('chunk_id')!r} lacks {', '.join(missing)}"
+        )
+
+
+def _content_key(payload: dict) -> str:
+    # The chunker always sends content_hash; hash the text for events from older chunkers.
+    return payload.get("content_hash") or hashlib.sha256(
+        payload["chunk_text"].encode("utf-8")
+    ).hexdigest()
+
+
+class EmbeddingWorker:
+    """Embeds chunk events in micro-batches and stores them as vector segments per tenant."""
+
+    def __init__(
+        self,
+        embedder: Optional[Embedder] = None,
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = EMBED_BATCH_SIZE,
+        max_wait: float = EMBED_BATCH_MAX_WAIT_MS / 1000,
+    ):
+        self.embedder = embedder or load_embedder()
+        if cache is None:
+            cache = EmbeddingCache(self.embedder.name, self.embedder.dim)
+        self.cache = cache
+        self.batcher = MicroBatcher(self.embed_batch, batch_size, max_wait, name="embedder")
+        self._looked_up = 0
+        self._hits = 0
+
+    def handle(self, payload: dict):
+        """Block until the batch holding ``payload`` is stored, so the caller acks after it."""
+        self.batcher.submit(payload).result()
+
+    def embed_batch(self, payloads: List[dict]) -> List[Optional[MalformedEvent]]:
+        """Stores the batch; a malformed event gets its exception as its result instead."""
+        started = time.perf_counter()
+        BATCH_SIZE.observe(len(payloads))
+        results: List[Optional[MalformedEvent]] = [None] * len(payloads)
+        upserts, promotions = [], []
+        deletes, aliases = collections.defaultdict(list), collections.defaultdict(list)
+        for position, payload in enumerate(payloads):
+            try:
+                _validate(payload)
+            except MalformedEvent as e:
+                logger.warning("Rejecting chunk event: %s", e)
+                results[position] = e
+                continue
+            if payload.get("op") == "delete":
+                deletes[payload["tenant_id"]].append(
+                    {"chunk_id": payload["chunk_id"], "document_id": payload.get("document_id")}
+                )
+            elif payload.get("op") == "alias":
+                # A near-duplicate the chunker skipped; it reuses its canonical chunk's vector.
+                aliases[payload["tenant_id"]].append(
+                    {
+                        "chunk_id": payload["chunk_id"],
+                        "document_id": payload.get("document_id"),
+                        "canonical_chunk_id": payload["canonical"]["chunk_id"],
+                        "similarity": payload["canonical"].get("similarity"),
+                    }
+                )
+            elif payload.get("op") == "promote":
+                # An alias whose canonical chunk was deleted; it takes over that chunk's vector.
+                promotions.append(payload)
+            elif payload.get("chunk_text"):
+                upserts.append(payload)
+            else:
+                logger.warning("Skipping chunk event without text: %s", payload.get("chunk_id"))
+
+        keys = [_content_key(payload) for payload in upserts]
+        vectors = self.cache.get_many(keys)
+        cached = sum(1 for key in keys if key in vectors)
+        texts = {}
+        for key, payload in zip(keys, upserts):
+            if key not in vectors:
+                texts.setdefault(key, payload["chunk_text"])
+        if texts:
+            with stage_timer("embed"):
+                computed = self.embedder.embed(list(texts.values()))
+            fresh = list(zip(texts, computed))
+            self.cache.put_many(fresh)
+            vectors.update(fresh)
+
+        by_tenant = collections.defaultdict(list)
+        for key, payload in zip(keys, upserts):
+            by_tenant[payload["tenant_id"]].append((key, payload))
+        promoted = 0
+        for payload in promotions:
+            key = payload["canonical"]["content_hash"]
+            vector = self._canonical_vector(payload) if key not in vectors else vectors[key]
+            if vector is None:
+                logger.warning(
+                    "No vector of %s to promote %s with",
+                    payload["canonical"]["chunk_id"],
+                    payload["chunk_id"],
+                )
+                continue
+            vectors[key] = vector
+            by_tenant[payload["tenant_id"]].append((key, payload))
+            promoted += 1
+        with stage_timer("store_vectors"):
+            for tenant_id in set(by_tenant) | set(deletes) | set(aliases):
+                rows = [
+                    {
+                        "chunk_id": payload["chunk_id"],
+                        "document_id": payload.get("document_id"),
+                        "content_hash": key,
+                    }
+                    for key, payload in by_tenant[tenant_id]
+                ]
+                matrix = (
+                    np.stack([vectors[key] for key, _ in by_tenant[tenant_id]])
+                    if rows
+                    else np.zeros((0, self.embedder.dim), dtype=np.float32)
+                )
+                write_segment(
+                    tenant_id,
+                    self.embedder.name,
+                    rows,
+                    matrix,
+                    deletes[tenant_id],
+                    aliases=aliases[tenant_id],
+                )
+
+        elapsed = time.perf_counter() - started
+        VECTORS.inc(cached, source="cache")
+        VECTORS.inc(len(upserts) - cached, source="embedded")
+        VECTORS.inc(promoted, source="promoted")
+        VECTORS_PER_SECOND.set(len(upserts) / elapsed if elapsed else 0.0)
+        self._looked_up += len(upserts)
+        self._hits += cached
+        CACHE_HIT_RATE.set(self._hits / self._looked_up if self._looked_up else 0.0)
+        logger.info(
+            "Stored %d vectors (%d cached, %d embedded, %d deletes, %d aliases) in %.1f ms, "
+            "%.0f vectors/s",
+            len(upserts),
+            cached,
+            len(texts),
+            sum(len(items) for items in deletes.values()),
+            sum(len(items) for items in aliases.values()),
+            elapsed * 1000,
+            len(upserts) / elapsed if elapsed else 0.0,
+        )
+        return results
+
+    def _canonical_vector(self, payload: dict) -> Optional[np.ndarray]:
+        canonical = payload["canonical"]
+        vector = self.cache.get_many([canonical["content_hash"]]).get(canonical["content_hash"])
+        if vector is None:
+            with stage_timer("find_vector"):
+                vector = find_vector(payload["tenant_id"], canonical["chunk_id"])
+        return vector
+
+
+_worker: Optional[EmbeddingWorker] = None
+_worker_lock = threading.Lock()
+
+
+def get_worker() -> EmbeddingWorker:
+    """The process-wide worker, so every callback thread feeds the same batches."""
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = EmbeddingWorker()
+    return _worker
+
+
+def handle_chunk_message(payload: dict):
+    get_worker().handle(payload)
@@ -1,40 +1,199 @@
 import logging
-import tempfile
+import math
+from typing import Optional, Tuple
 
-from config import PUBSUB_TOPIC
-from services.extractor.utils.text_extractors import (smart_pdf_parser,
+import fanout
+
+from config import (EXTRACTOR_BYTES_PER_PAGE, EXTRACTOR_FANOUT_MIN_PAGES, EXTRACTOR_LARGE_JOB_BYTES,
+                    EXTRACTOR_LARGE_JOB_PAGES, GCS_BUCKET, PUBSUB_EXTRACTION_TOPIC, PUBSUB_TOPIC)
+from services.extractor.utils.fetcher import (ConditionalCache, FetchResult, fetch_url,
+                                              normalize_url)
+from services.extractor.utils.parallel import PAGE_PARALLEL_STRATEGIES
+from services.extractor.utils.pdf_source import PdfSource, download_pdf
+from services.extractor.utils.text_extractors import (parse_pdf, parse_pdf_range, plan_pdf,
                                                       smart_url_parser)
-from shared.pubsub.publisher import publish_event
-from shared.storage.gcs_client import (download_file_from_gcs,
-                                       upload_extracted_text_to_gcs)
+from shared.instrumentation import (DOCUMENTS, REGISTRY, STAGE_SECONDS, document_context,
+                                    stage_timer)
+from shared.profiling import profiled
+from shared.pubsub.publisher import publish_event, publish_events
+from shared.storage.blob_store import BlobNotFound
+from shared.storage.claim_check import attach_structured_text
+from shared.storage.gcs_client import read_extracted_document, upload_extracted_text_to_gcs
 
 # Configure logging
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s [%(levelname)s] [%(document_id)s] %(message)s"
+)
 logger = logging.getLogger(__name__)
 
+OCR_PAGES = REGISTRY.counter("extractor_ocr_pages_total", "Pages sent through OCR")
+
+
+class RetryableError(Exception):
+    """A failure expected to clear up on redelivery (e.g. an object not written yet)."""
+
+
+def estimate_job(message_dict: dict) -> Tuple[str, str, float]:
+    """Tenant, scheduler lane and cost (in pages) of an ingestion event."""
+    tenant_id = message_dict.get("tenant_id") or ""
+    if message_dict.get("type") == fanout.PART_TYPE:
+        part = message_dict.get("fanout") or {}
+        pages = part.get("last_page", 0) - part.get("first_page", 0) + 1
+        return tenant_id, "large" if pages >= EXTRACTOR_LARGE_JOB_PAGES else "small", float(pages)
+    if message_dict.get("type") != "file":
+        return tenant_id, "small", 1.0
+    size = message_dict.get("size_bytes") or 0
+    pages = message_dict.get("page_estimate") or math.ceil(size / EXTRACTOR_BYTES_PER_PAGE) or 1
+    large = pages >= EXTRACTOR_LARGE_JOB_PAGES or size >= EXTRACTOR_LARGE_JOB_BYTES
+    return tenant_id, "large" if large else "small", float(pages)
+
+
+def _record_attempt(attempt: dict):
+    """Record a strategy run as a ``parse:<strategy>`` stage."""
+    outcome = "error" if attempt.get("error") else "ok"
+    STAGE_SECONDS.observe(
+        attempt["ms"] / 1000, stage=f"parse:{attempt['strategy']}", outcome=outcome
+    )
+    OCR_PAGES.inc(len(attempt.get("ocr_pages") or []))
+
+
+def _timed_parse(source: PdfSource) -> Tuple[list, dict]:
+    """Run the parser and record each strategy it tried."""
+    with stage_timer("parse"):
+        blocks, parse_info = parse_pdf(source)
+    for attempt in parse_info.get("attempts", []):
+        _record_attempt(attempt)
+    return blocks, parse_info
 
-def extract_text_from_pdf(path: str, from_gcs: bool = True) -> list:
+
+def _download_source(path: str) -> PdfSource:
     try:
-        if from_gcs:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-                download_file_from_gcs(path, tmp_file.name)
-                return smart_pdf_parser(tmp_file.name)
-        else:
-            return smart_pdf_parser(path)
+        with stage_timer("download"):
+            return download_pdf(GCS_BUCKET, path)
+    except BlobNotFound:
+        raise RetryableError(f"Source PDF not found: gs://{GCS_BUCKET}/{path}")
     except Exception as e:
-        logger.error("PDF extraction failed: %s", e, exc_info=True)
-        return [{"type": "error", "text": f"PDF extraction failed: {str(e)}"}]
+        raise RetryableError(f"Source PDF download failed: {e}") from e
+
+
+def _parse_source(source: PdfSource) -> Tuple[list, dict]:
+    """
+    Parse, raising if the parser crashed or every strategy did, so the message is retried and
+    eventually quarantined instead of published as an empty extraction.
+    """
+    blocks, parse_info = _timed_parse(source)
+    attempts = parse_info.get("attempts") or []
+    if attempts and all(attempt.get("error") for attempt in attempts):
+        errors = "; ".join(f"{attempt['strategy']}: {attempt['error']}" for attempt in attempts)
+        raise RuntimeError(f"Every PDF strategy failed: {errors}")
+    return blocks, parse_info
 
 
-def extract_text_from_url(url: str) -> dict:
+def extract_text_from_pdf(path: str, from_gcs: bool = True) -> Tuple[list, dict]:
+    """Return the structured blocks and the parser's routing/timing info."""
+    source = _download_source(path) if from_gcs else PdfSource(path, path=path)
+    with source:
+        return _parse_source(source)
+
+
+def _fan_out(message_dict: dict, source: PdfSource) -> bool:
+    """
+    Publish page-range subtasks for a long document instead of parsing it here. False (parse
+    locally) for short documents and for strategies that cannot be split by page.
+    """
+    if not EXTRACTOR_FANOUT_MIN_PAGES:
+        return False
     try:
-        return smart_url_parser(url)
+        plan = plan_pdf(source, EXTRACTOR_FANOUT_MIN_PAGES)
+    except Exception as e:
+        logger.warning("Could not profile PDF for fan-out, parsing it here: %s", e)
+        return False
+    if plan is None:
+        return False
+    page_count, strategy, profile = plan
+    if strategy not in PAGE_PARALLEL_STRATEGIES:
+        return False
+    parts = fanout.part_messages(message_dict, strategy, page_count, profile)
+    with stage_timer("publish"):
+        publish_events(PUBSUB_TOPIC, parts)
+    logger.info(
+        "Fanned out %d pages as %d %s parts (job %s)",
+        page_count,
+        len(parts),
+        strategy,
+        parts[0]["fanout"]["job"],
+    )
+    return True
+
+
+def _extract_part(message_dict: dict) -> Tuple[list, dict]:
+    part = message_dict["fanout"]
+    first, last = part["first_page"], part["last_page"]
+    # A crash propagates: a part must not be merged as an error block.
+    with _download_source(message_dict["gcs_path"]) as source:
+        with stage_timer("parse"):
+            blocks, attempt = parse_pdf_range(source, part["strategy"], first, last)
+    _record_attempt(attempt)
+    return blocks, attempt
+
+
+def extract_text_from_url(url: str, fetched: Optional[FetchResult] = None) -> dict:
+    try:
+        return smart_url_parser(url, fetched)
     except Exception as e:
         logger.error("URL extraction failed: %s", e, exc_info=True)
         return {"error": f"URL extraction failed: {str(e)}"}
 
 
+def _upload_extracted(blob_name: str, content: dict) -> str:
+    with stage_timer("upload_extracted"):
+        return upload_extracted_text_to_gcs(blob_name, content)
+
+
+def _publish_extracted(event: dict):
+    with stage_timer("publish"):
+        publish_event(PUBSUB_EXTRACTION_TOPIC, event)
+
+
+def _store_file_result(message_dict: dict, structured_data: list, parse_info: dict):
+    file_id = message_dict["file_id"]
+    gcs_blob_name = f"file/{file_id}.json"
+    public_url = _upload_extracted(
+        gcs_blob_name,
+        {
+            "tenant_id": message_dict["tenant_id"],
+            "document_id": file_id,
+            "source": "file",
+            "gcs_path": message_dict["gcs_path"],
+            "parse_info": parse_info,
+            "structured_text": structured_data,
+        },
+    )
+
+    _publish_extracted(
+        attach_structured_text(
+            {
+                "document_id": file_id,
+                "tenant_id": message_dict["tenant_id"],
+                "filename": message_dict.get("filename"),
+                "extracted_gcs_url": public_url,
+                "extracted_blob": gcs_blob_name,
+                "parse_info": parse_info,
+            },
+            structured_data,
+            gcs_blob_name,
+        ),
+    )
+
+
 def handle_ingestion_event(message_dict: dict):
+    document_id = message_dict.get("file_id") or message_dict.get("url_id")
+    with document_context(document_id):
+        _handle_ingestion_event(message_dict)
+
+
+@profiled("extract")
+def _handle_ingestion_event(message_dict: dict):
     try:
         logger.info("Received message: %s", message_dict)
         msg_type = message_dict.get("type")
@@ -53,7 +212,32 @@ def handle_ingestion_event(message_dict: dict):
                 return
 
             logger.info("Processing URL: %s for tenant %s with ID %s", url, tenant_id, url_id)
-            structured_data = extract_text_from_url(url)
+            url_cache = ConditionalCache()
+            cached = url_cache.lookup(url)
+            with stage_timer("fetch_url"):
+                fetched = fetch_url(normalize_url(url), cached)
+
+            structured_data = None
+            if fetched.not_modified:
+                if cached["document_id"] == url_id:
+                    logger.info("URL unchanged since last extraction (HTTP 304), skipping")
+                    DOCUMENTS.inc(kind=msg_type, outcome="unchanged")
+                    return
+                # Same page submitted under a new id: reuse the earlier extraction.
+                try:
+                    previous = read_extracted_document(cached["extracted_blob"])
+                except BlobNotFound:
+                    previous = None
+                if previous is not None:
+                    logger.info("URL unchanged, reusing %s", cached["extracted_blob"])
+                    structured_data = previous.get("structured_text")
+                else:
+                    with stage_timer("fetch_url"):
+                        fetched = fetch_url(normalize_url(url))
+
+            if structured_data is None:
+                with stage_timer("parse_url"):
+                    structured_data = extract_text_from_url(url, fetched)
             logger.info(
                 "Extracted content keys: %s",
                 (
@@ -64,7 +248,7 @@ def handle_ingestion_event(message_dict: dict):
             )
 
             gcs_blob_name = f"url/{url_id}.json"
-            public_url = upload_extracted_text_to_gcs(
+            public_url = _upload_extracted(
                 gcs_blob_name,
                 {
                     "tenant_id": tenant_id,
@@ -75,18 +259,24 @@ def handle_ingestion_event(message_dict: dict):
                 },
             )
 
-            publish_event(
-                PUBSUB_TOPIC,
-                {
-                    "document_id": url_id,
-                    "structured_text": structured_data,
-                    "tenant_id": tenant_id,
-                    "filename": url,
-                    "extracted_gcs_url": public_url,
-                },
+            _publish_extracted(
+                attach_structured_text(
+                    {
+                        "document_id": url_id,
+                        "tenant_id": tenant_id,
+                        "filename": url,
+                        "extracted_gcs_url": public_url,
+                        "extracted_blob": gcs_blob_name,
+                    },
+                    structured_data,
+                    gcs_blob_name,
+                ),
             )
 
+            if "error" not in structured_data:
+                url_cache.store(url, fetched, url_id, gcs_blob_name)
             logger.info("URL extraction completed and event published.")
+            DOCUMENTS.inc(kind=msg_type, outcome="extracted")
 
         elif msg_type == "file":
             tenant_id = message_dict.get("tenant_id")
@@ -98,39 +288,112 @@ def handle_ingestion_event(message_dict: dict):
                 return
 
             logger.info("Processing file %s for tenant %s with ID %s", gcs_path, tenant_id, file_id)
-            structured_data = extract_text_from_pdf(gcs_path)
+            with _download_source(gcs_path) as source:
+                if _fan_out(message_dict, source):
+                    DOCUMENTS.inc(kind=msg_type, outcome="fanned_out")
+                    return
+                structured_data, parse_info = _parse_source(source)
             logger.info(
-                "Extracted %d blocks from PDF",
+                "Extracted %d blocks from PDF via %s",
                 len(structured_data) if isinstance(structured_data, list) else 0,
+                parse_info.get("strategy"),
             )
 
+            _store_file_result(message_dict, structured_data, parse_info)
+            logger.info("File extraction completed and event published.")
+            DOCUMENTS.inc(kind=msg_type, outcome="extracted")
+
+        elif msg_type == fanout.PART_TYPE:
+            tenant_id = message_dict.get("tenant_id")
+            file_id = message_dict.get("file_id")
+            gcs_path = message_dict.get("gcs_path")
+            part = message_dict.get("fanout")
+
+            if not all([tenant_id, file_id, gcs_path, part]):
+                logger.error("Missing required fields in file part message: %s", message_dict)
+                return
+
+            if fanout.is_merged(message_dict):
+                logger.info("Job %s already merged, dropping redelivered part", part["job"])
+                DOCUMENTS.inc(kind=msg_type, outcome="duplicate")
+                return
+
+            logger.info(
+                "Processing part %d/%d (pages %d-%d) of file %s",
+                part["part"] + 1,
+                part["parts"],
+                part["first_page"],
+                part["last_page"],
+                file_id,
+            )
+            blocks, attempt = _extract_part(message_dict)
+            # From here on the part's result is durable; any failure must redeliver the
+            # message, or the merge it may owe would never happen.
+            try:
+                fanout.write_part(message_dict, blocks, attempt)
+                DOCUMENTS.inc(kind=msg_type, outcome="extracted")
+                if not fanout.claim_merge(message_dict):
+                    return
+                with stage_timer("merge"):
+                    structured_data, parse_info = fanout.merge_parts(message_dict)
+                logger.info("Merged %d parts into %d blocks", part["parts"], len(structured_data))
+                _store_file_result(message_dict, structured_data, parse_info)
+                fanout.mark_merged(message_dict)
+            except Exception as e:
+                raise RetryableError(f"Fan-in of job {part['job']} failed: {e}") from e
+            logger.info("File extraction completed and event published.")
+            DOCUMENTS.inc(kind="file", outcome="extracted")
+
+        elif msg_type == "alias":
+            tenant_id = message_dict.get("tenant_id")
+            file_id = message_dict.get("file_id")
+            canonical_id = message_dict.get("canonical_document_id")
+
+            if not all([tenant_id, file_id, canonical_id]):
+                logger.error("Missing required fields in alias message: %s", message_dict)
+                return
+
+            logger.info("Aliasing file %s to already-ingested document %s", file_id, canonical_id)
+            try:
+                canonical = read_extracted_document(f"file/{canonical_id}.json")
+            except BlobNotFound:
+                raise RetryableError(f"Canonical document {canonical_id} is not extracted yet")
+            structured_data = canonical.get("structured_text", [])
+
             gcs_blob_name = f"file/{file_id}.json"
-            public_url = upload_extracted_text_to_gcs(
+            public_url = _upload_extracted(
                 gcs_blob_name,
                 {
                     "tenant_id": tenant_id,
                     "document_id": file_id,
                     "source": "file",
-                    "gcs_path": gcs_path,
+                    "alias_of": canonical_id,
+                    "sha256": message_dict.get("sha256"),
                     "structured_text": structured_data,
                 },
             )
 
-            publish_event(
-                PUBSUB_TOPIC,
-                {
-                    "document_id": file_id,
-                    "structured_text": structured_data,
-                    "tenant_id": tenant_id,
-                    "filename": message_dict.get("filename"),
-                    "extracted_gcs_url": public_url,
-                },
+            _publish_extracted(
+                attach_structured_text(
+                    {
+                        "document_id": file_id,
+                        "tenant_id": tenant_id,
+                        "filename": message_dict.get("filename"),
+                        "extracted_gcs_url": public_url,
+                        "extracted_blob": gcs_blob_name,
+                    },
+                    structured_data,
+                    gcs_blob_name,
+                ),
             )
 
-            logger.info("File extraction completed and event published.")
+            logger.info("Alias of %s published as %s.", canonical_id, file_id)
+            DOCUMENTS.inc(kind=msg_type, outcome="extracted")
 
         else:
             logger.error("Unknown message type: '%s'. Full message: %s", msg_type, message_dict)
 
-    except Exception as e:
-        logger.error("Extraction failed: %s", e, exc_info=True)
+    except Exception:
+        # Propagate so the subscriber retries and, after MAX_RETRIES, quarantines it.
+        DOCUMENTS.inc(kind=message_dict.get("type") or "unknown", outcome="failed")
+        raise
@@ -0,0 +1,161 @@
+"""
+Fan-out of very long PDFs into page-range subtasks, and the fan-in that reassembles them.
+
+A document of at least ``EXTRACTOR_FANOUT_MIN_PAGES`` pages is profiled and routed once, then
+republished on the ingestion topic as ``file_part`` messages of
+``EXTRACTOR_FANOUT_PAGES_PER_PART`` pages each, so any extractor replica can take a part. Each
+part writes its blocks to ``file/<id>.parts/<job>/<part>.json`` in the pipeline-state
+bucket. Whichever part finds every part present claims the merge with a create-only marker,
+concatenates the parts in page order and publishes the final event. Part objects are simply
+overwritten on redelivery and only one delivery at a time holds the marker, so duplicate and
+out-of-order parts still yield one final event. A claim left unfinished for
+``EXTRACTOR_MERGE_CLAIM_SECONDS`` (its holder crashed or was quarantined) is taken over by the
+next delivery of any part of the job; merging twice only republishes the same result.
+"""
+import hashlib
+import json
+import time
+from typing import List, Tuple
+
+from config import (EXTRACTOR_FANOUT_PAGES_PER_PART, EXTRACTOR_MERGE_CLAIM_SECONDS,
+                    PIPELINE_STATE_BUCKET)
+from shared.storage.blob_store import get_blob_store
+from shared.storage.gcs_client import load_state_json, save_state_json
+
+PART_TYPE = "file_part"
+MARKER = "_merge.json"
+# Fields of the original file event every part carries, for the final event.
+PARENT_FIELDS = ("tenant_id", "file_id", "gcs_path", "filename", "sha256", "size_bytes")
+
+
+def plan_parts(
+    page_count: int, pages_per_part: int = EXTRACTOR_FANOUT_PAGES_PER_PART
+) -> List[Tuple[int, int]]:
+    """Contiguous 1-based page ranges of ``pages_per_part`` pages (the last may be shorter)."""
+    size = max(pages_per_part, 1)
+    return [(first, min(first + size - 1, page_count)) for first in range(1, page_count + 1, size)]
+
+
+def job_id(message: dict, strategy: str, ranges: List[Tuple[int, int]]) -> str:
+    """
+    Deterministic, so a redelivered file event republishes the same job instead of starting
+    a second one next to it. The content digest is part of the key: a new version uploaded
+    under the same ``document_id`` must get a new job, not the finished one of its predecessor.
+    """
+    key = json.dumps(
+        [message.get("file_id"), message.get("gcs_path"), message.get("sha256"), strategy, ranges]
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def parts_prefix(file_id: str, job: str) -> str:
+    return f"file/{file_id}.parts/{job}"
+
+
+def part_messages(message: dict, strategy: str, page_count: int, profile: dict) -> List[dict]:
+    """The ``file_part`` events that together cover the document."""
+    ranges = plan_parts(page_count)
+    job = job_id(message, strategy, ranges)
+    parent = {key: message[key] for key in PARENT_FIELDS if key in message}
+    return [
+        {
+            **parent,
+            "type": PART_TYPE,
+            "fanout": {
+                "job": job,
+                "part": index,
+                "parts": len(ranges),
+                "first_page": first,
+                "last_page": last,
+                "page_count": page_count,
+                "strategy": strategy,
+                "profile": profile,
+            },
+        }
+        for index, (first, last) in enumerate(ranges)
+    ]
+
+
+def _part_blob(prefix: str, part: int) -> str:
+    return f"{prefix}/{part:05d}.json"
+
+
+def write_part(message: dict, blocks: list, attempt: dict):
+    fanout = message["fanout"]
+    save_state_json(
+        _part_blob(parts_prefix(message["file_id"], fanout["job"]), fanout["part"]),
+        {"part": fanout["part"], "attempt": attempt, "blocks": blocks},
+    )
+
+
+def _present_parts(prefix: str) -> int:
+    return sum(
+        1
+        for name in get_blob_store().list(PIPELINE_STATE_BUCKET, prefix + "/")
+        if not name.endswith("/" + MARKER)
+    )
+
+
+def claim_merge(message: dict) -> bool:
+    """
+    True if this delivery should merge: every part is written and nobody else holds the
+    marker. The part that created the marker may claim again (a redelivery after a crash)
+    until the merge is marked done, and any part may take over a claim that went stale.
+    """
+    fanout = message["fanout"]
+    prefix = parts_prefix(message["file_id"], fanout["job"])
+    if _present_parts(prefix) < fanout["parts"]:
+        return False
+    marker = f"{prefix}/{MARKER}"
+    claim = {"part": fanout["part"], "claimed_at": time.time(), "done": False}
+    if get_blob_store().create(
+        PIPELINE_STATE_BUCKET, marker, json.dumps(claim).encode("utf-8"), "application/json"
+    ):
+        return True
+    existing = load_state_json(marker) or {}
+    if existing.get("done"):
+        return False
+    if existing.get("part") == fanout["part"]:
+        return True
+    if time.time() - existing.get("claimed_at", 0) < EXTRACTOR_MERGE_CLAIM_SECONDS:
+        return False
+    save_state_json(marker, claim)
+    return True
+
+
+def merge_parts(message: dict) -> Tuple[list, dict]:
+    """All parts' blocks in page order, plus a ``parse_info`` for the whole document."""
+    fanout = message["fanout"]
+    prefix = parts_prefix(message["file_id"], fanout["job"])
+    blocks, attempts = [], []
+    for part in range(fanout["parts"]):
+        stored = load_state_json(_part_blob(prefix, part))
+        if stored is None:
+            raise RuntimeError(f"Part {part} of {prefix} disappeared before the merge")
+        blocks.extend(stored["blocks"])
+        attempts.append(stored["attempt"])
+    parse_info = {
+        "strategy": fanout["strategy"],
+        "routed_to": fanout["strategy"],
+        "profile": fanout["profile"],
+        "attempts": attempts,
+        "fanout": {"job": fanout["job"], "parts": fanout["parts"]},
+        # Summed worker time; wall time depends on how many replicas took parts.
+        "total_ms": round(sum(attempt["ms"] for attempt in attempts), 2),
+    }
+    return blocks, parse_info
+
+
+def mark_merged(message: dict):
+    fanout = message["fanout"]
+    save_state_json(
+        f"{parts_prefix(message['file_id'], fanout['job'])}/{MARKER}",
+        {"part": fanout["part"], "merged_at": time.time(), "done": True},
+    )
+
+
+def is_merged(message: dict) -> bool:
+    fanout = message["fanout"]
+    marker = load_state_json(f"{parts_prefix(message['file_id'], fanout['job'])}/{MARKER}")
+    return bool(marker and marker.get("done"))
+
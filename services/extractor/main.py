@@ -2,15 +2,21 @@ import logging
 import signal
 import sys
 
-from extractor import handle_ingestion_event
+from extractor import estimate_job, handle_ingestion_event
 
-from config import PUBSUB_TOPIC, SUBSCRIPTION_NAME
+from config import (EXTRACTOR_FAIR_SCHEDULING, EXTRACTOR_LARGE_LANE_MAX_QUEUED,
+                    EXTRACTOR_LARGE_LANE_WORKERS, EXTRACTOR_MAX_QUEUE_SECONDS,
+                    EXTRACTOR_SUBSCRIBER, METRICS_PORT, PUBSUB_TOPIC, SUBSCRIPTION_NAME,
+                    TENANT_DEFAULT_MAX_CONCURRENCY, TENANT_MAX_CONCURRENCY, TENANT_WEIGHTS)
+from services.extractor.utils.pdf_source import cleanup_stale_temp_dirs
+from shared.instrumentation import configure, start_metrics_server
+from shared.pubsub.fair_scheduler import FairScheduler
 from shared.pubsub.subscriber import subscribe_to_topic
 
 # Configure structured logging
 logging.basicConfig(
     level=logging.INFO,
-    format="[%(levelname)s] %(asctime)s - %(name)s - %(message)s",
+    format="[%(levelname)s] %(asctime)s - %(name)s - [%(document_id)s] %(message)s",
     handlers=[logging.StreamHandler(sys.stdout)],
 )
 logger = logging.getLogger(__name__)
@@ -29,12 +35,35 @@ if __name__ == "__main__":
     signal.signal(signal.SIGTERM, shutdown_handler)
 
     logger.info("Starting extractor service...")
+    configure("extractor")
+    # Nothing older than the longest lease can still belong to a message in flight.
+    cleanup_stale_temp_dirs(older_than=EXTRACTOR_SUBSCRIBER["max_lease_seconds"])
+    start_metrics_server(METRICS_PORT)
     logger.info(f"Subscribing to topic '{PUBSUB_TOPIC}' with subscription '{SUBSCRIPTION_NAME}'")
 
+    scheduler = None
+    if EXTRACTOR_FAIR_SCHEDULING:
+        # The handlers run on the scheduler's lanes; callback_workers is their total.
+        large = min(EXTRACTOR_LARGE_LANE_WORKERS, EXTRACTOR_SUBSCRIBER["callback_workers"] - 1)
+        scheduler = FairScheduler(
+            workers={"small": EXTRACTOR_SUBSCRIBER["callback_workers"] - large, "large": large},
+            weights=TENANT_WEIGHTS,
+            max_concurrency=TENANT_MAX_CONCURRENCY,
+            default_max_concurrency=TENANT_DEFAULT_MAX_CONCURRENCY,
+            max_queued={"large": EXTRACTOR_LARGE_LANE_MAX_QUEUED},
+            # Leave at least half of the lease for running the job.
+            max_wait=min(
+                EXTRACTOR_MAX_QUEUE_SECONDS, EXTRACTOR_SUBSCRIBER["max_lease_seconds"] / 2
+            ),
+        )
+
     # Begin subscription loop
     subscribe_to_topic(
         topic=PUBSUB_TOPIC,
         subscription=SUBSCRIPTION_NAME,
         callback=handle_ingestion_event,
         raw_message=False,
+        settings=EXTRACTOR_SUBSCRIBER,
+        scheduler=scheduler,
+        classify=estimate_job,
     )
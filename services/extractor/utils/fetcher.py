@@ -0,0 +1,223 @@
+"""
+Shared HTTP fetch layer for URL extraction.
+
+One pooled ``httpx.AsyncClient`` runs on a background event loop and is shared by every
+handler thread, so connections are reused across documents. Each host gets a concurrency cap
+(``FETCH_PER_HOST_LIMIT``) and a minimum gap between request starts
+(``FETCH_HOST_DELAY_SECONDS``). Pages are downloaded once and the body is handed to every
+parsing fallback.
+
+``ConditionalCache`` remembers the ETag/Last-Modified of each URL we extracted, so a
+re-submitted URL is fetched conditionally and a 304 skips extraction.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from config import (FETCH_CACHE_ENABLED, FETCH_HOST_DELAY_SECONDS, FETCH_MAX_CONNECTIONS,
+                    FETCH_MAX_RESPONSE_BYTES, FETCH_PER_HOST_LIMIT, FETCH_TIMEOUT_SECONDS,
+                    FETCH_USER_AGENT)
+from shared.storage.gcs_client import load_state_json, save_state_json
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "_fetch_cache"
+
+
+@dataclass
+class FetchResult:
+    url: str
+    final_url: str = ""
+    status: int = 0
+    text: str = ""
+    content_type: str = ""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and 200 <= self.status < 300
+
+
+def normalize_url(url: str) -> str:
+    return url if urlparse(url).scheme else "https://" + url
+
+
+class _HostGate:
+    """Caps concurrent requests to one host and spaces out their start times."""
+
+    def __init__(self, limit: int, delay: float):
+        self._semaphore = asyncio.Semaphore(limit)
+        self._lock = asyncio.Lock()
+        self._delay = delay
+        self._next_start = 0.0
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        if self._delay:
+            loop = asyncio.get_running_loop()
+            async with self._lock:
+                wait = self._next_start - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._next_start = loop.time() + self._delay
+
+    async def __aexit__(self, *exc):
+        self._semaphore.release()
+
+
+def _decode(body: bytes, charset: Optional[str]) -> str:
+    try:
+        return body.decode(charset or "utf-8", errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+
+class AsyncFetcher:
+    def __init__(
+        self,
+        timeout: float = FETCH_TIMEOUT_SECONDS,
+        max_connections: int = FETCH_MAX_CONNECTIONS,
+        per_host_limit: int = FETCH_PER_HOST_LIMIT,
+        host_delay: float = FETCH_HOST_DELAY_SECONDS,
+        max_bytes: int = FETCH_MAX_RESPONSE_BYTES,
+    ):
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            follow_redirects=True,
+            headers={"User-Agent": FETCH_USER_AGENT},
+            limits=httpx.Limits(
+                max_connections=max_connections, max_keepalive_connections=max_connections
+            ),
+        )
+        self._per_host_limit = per_host_limit
+        self._host_delay = host_delay
+        self._max_bytes = max_bytes
+        self._gates: Dict[str, _HostGate] = {}
+
+    def _gate(self, url: str) -> _HostGate:
+        host = urlparse(url).netloc.lower()
+        if host not in self._gates:
+            self._gates[host] = _HostGate(self._per_host_limit, self._host_delay)
+        return self._gates[host]
+
+    async def fetch(self, url: str, validators: Optional[dict] = None) -> FetchResult:
+        headers = {}
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+        started = time.perf_counter()
+        result = FetchResult(url=url)
+        try:
+            async with self._gate(url):
+                async with self._client.stream("GET", url, headers=headers) as response:
+                    body = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        body += chunk
+                        if len(body) > self._max_bytes:
+                            raise ValueError(f"Response larger than {self._max_bytes} bytes")
+                    result.status = response.status_code
+                    result.final_url = str(response.url)
+                    result.content_type = response.headers.get("content-type", "")
+                    result.etag = response.headers.get("etag")
+                    result.last_modified = response.headers.get("last-modified")
+                    if result.status != 304:
+                        result.text = _decode(bytes(body), response.charset_encoding)
+            if result.status >= 400:
+                result.error = f"HTTP {result.status} while fetching URL: {url}"
+        except httpx.TimeoutException:
+            result.error = f"Timeout while fetching URL: {url}"
+        except (httpx.HTTPError, ValueError) as e:
+            result.error = f"Network error while fetching URL: {e}"
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+class _LoopThread:
+    """A private event loop on a daemon thread, so synchronous handlers can share one client."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="url-fetcher", daemon=True).start()
+        self.fetcher = asyncio.run_coroutine_threadsafe(self._create(), self.loop).result()
+
+    @staticmethod
+    async def _create() -> AsyncFetcher:
+        # httpx binds its pool to the loop it is first used on, so build it there.
+        return AsyncFetcher()
+
+
+_loop_thread: Optional[_LoopThread] = None
+_loop_lock = threading.Lock()
+
+
+def fetch_url(url: str, validators: Optional[dict] = None) -> FetchResult:
+    """Fetch ``url`` through the shared pooled client from any thread."""
+    global _loop_thread
+    if _loop_thread is None:
+        with _loop_lock:
+            if _loop_thread is None:
+                _loop_thread = _LoopThread()
+    future = asyncio.run_coroutine_threadsafe(
+        _loop_thread.fetcher.fetch(url, validators), _loop_thread.loop
+    )
+    return future.result()
+
+
+class ConditionalCache:
+    """
+    Validators and output location of the last extraction of each URL, kept as small JSON
+    objects in the pipeline-state bucket so every extractor replica sees them.
+    """
+
+    def __init__(self, enabled: bool = FETCH_CACHE_ENABLED):
+        self.enabled = enabled
+
+    @staticmethod
+    def _blob_name(url: str) -> str:
+        return f"{CACHE_PREFIX}/{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json"
+
+    def lookup(self, url: str) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        try:
+            return load_state_json(self._blob_name(url))
+        except Exception:
+            logger.warning("Fetch cache lookup failed for %s", url, exc_info=True)
+            return None
+
+    def store(self, url: str, result: FetchResult, document_id: str, extracted_blob: str):
+        if not self.enabled or not (result.etag or result.last_modified):
+            return
+        try:
+            save_state_json(
+                self._blob_name(url),
+                {
+                    "url": url,
+                    "etag": result.etag,
+                    "last_modified": result.last_modified,
+                    "document_id": document_id,
+                    "extracted_blob": extracted_blob,
+                },
+            )
+        except Exception:
+            logger.warning("Fetch cache update failed for %s", url, exc_info=True)
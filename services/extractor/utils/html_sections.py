@@ -0,0 +1,232 @@
+"""
+Typed sections from trafilatura's XML output or from raw HTML, in one walk over the lxml tree.
+
+The outermost block element (paragraph, heading, list, table, ...) becomes one section and its
+subtree is not visited again, so sections never overlap: a list is emitted once with its items
+as lines rather than once per ``li`` as well. Text outside any block (``<div>text</div>`` in
+raw HTML) becomes ``text`` sections in document order. Every section carries the titles of the
+headings it sits under, outermost first.
+"""
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from lxml import etree
+from lxml import html as lxml_html
+
+HEADING_LEVELS = {f"h{level}": level for level in range(1, 7)}
+# Section type per block tag; trafilatura's vocabulary (head, list, item, quote) and HTML's.
+BLOCK_TYPES = {
+    "p": "p",
+    "list": "ul",
+    "ul": "ul",
+    "ol": "ol",
+    "dl": "ul",
+    "item": "li",
+    "li": "li",
+    "table": "table",
+    "quote": "quote",
+    "blockquote": "quote",
+    "pre": "code",
+    "code": "code",
+}
+LIST_TAGS = {"list", "ul", "ol", "dl"}
+ITEM_TAGS = {"item", "li", "dt", "dd"}
+ROW_TAGS = {"row", "tr"}
+CELL_TAGS = {"cell", "td", "th"}
+BREAK_TAGS = {"br", "lb"}
+# Elements whose edges separate words, unlike inline markup (a, span, em, code, hi, ref...).
+BOUNDARY_TAGS = (
+    (set(BLOCK_TYPES) - {"code"})
+    | ITEM_TAGS
+    | ROW_TAGS
+    | CELL_TAGS
+    | BREAK_TAGS
+    | set(HEADING_LEVELS)
+    | {
+        "head",
+        "div",
+        "section",
+        "article",
+        "header",
+        "main",
+        "address",
+        "figure",
+        "figcaption",
+        "details",
+        "summary",
+        "caption",
+        "hr",
+        "center",
+    }
+)
+# Never part of the page text. nav/footer/aside only occur in raw HTML (trafilatura has
+# already dropped boilerplate), and the HTML <head> is excluded by starting from <body>.
+SKIPPED_TAGS = {
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "svg",
+    "nav",
+    "footer",
+    "aside",
+    "form",
+    "comments",
+}
+# Below h6, so a heading of unknown level never closes a known one.
+UNKNOWN_LEVEL = 7
+_WHITESPACE = re.compile(r"\s+")
+
+_XML_PARSER = etree.XMLParser(remove_comments=True, remove_pis=True, recover=True)
+# The page was already decoded by the fetcher; don't let a <meta charset> re-decode it.
+_HTML_PARSER = lxml_html.HTMLParser(remove_comments=True, remove_pis=True, encoding="utf-8")
+
+
+def _name(element) -> str:
+    return element.tag.lower() if isinstance(element.tag, str) else ""
+
+
+def _clean(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def _text(element) -> str:
+    """
+    All text under ``element``, whitespace collapsed: inline tags are joined as they are,
+    nested blocks (``<p>``, ``<div>``, ``<li>``, cells, ``<br>``) are separated by a space.
+    """
+    parts = []
+    walker = etree.iterwalk(element, events=("start", "end"))
+    for event, node in walker:
+        boundary = node is not element and _name(node) in BOUNDARY_TAGS
+        if event == "start":
+            if boundary:
+                parts.append(" ")
+            if _name(node) in SKIPPED_TAGS and node is not element:
+                walker.skip_subtree()
+            elif node.text:
+                parts.append(node.text)
+        elif node is not element:
+            if boundary:
+                parts.append(" ")
+            if node.tail:
+                parts.append(node.tail)
+    return _clean("".join(parts))
+
+
+def _table_text(element) -> str:
+    rows = []
+    for row in element.iter(*ROW_TAGS):
+        cells = [_text(cell) for cell in row if _name(cell) in CELL_TAGS]
+        if any(cells):
+            rows.append(" | ".join(cells))
+    return "\n".join(rows) if rows else _text(element)
+
+
+def _list_text(element) -> str:
+    items = [_text(item) for item in element if _name(item) in ITEM_TAGS]
+    items = [item for item in items if item]
+    return "\n".join(items) if items else _text(element)
+
+
+def _heading_level(element, name: str) -> Optional[int]:
+    if name in HEADING_LEVELS:
+        return HEADING_LEVELS[name]
+    if name == "head":
+        # trafilatura keeps the original level as rend="h2" when it knows it.
+        return HEADING_LEVELS.get(element.get("rend", ""), UNKNOWN_LEVEL)
+    return None
+
+
+class _HeadingTrail:
+    def __init__(self):
+        self._stack: List[Tuple[int, str]] = []
+
+    @property
+    def titles(self) -> List[str]:
+        return [title for _, title in self._stack]
+
+    def enter(self, level: int, title: str):
+        while self._stack and self._stack[-1][0] >= level:
+            self._stack.pop()
+        self._stack.append((level, title))
+
+
+def iter_sections(root) -> Iterator[Dict]:
+    """Yield ``{"type", "text", "headings"}`` for each top-level block under ``root``."""
+    headings = _HeadingTrail()
+    loose: List[str] = []
+
+    def flush_loose() -> Iterator[Dict]:
+        text = _clean("".join(loose))
+        loose.clear()
+        if text:
+            yield {"type": "text", "text": text, "headings": headings.titles}
+
+    walker = etree.iterwalk(root, events=("start", "end"))
+    for event, node in walker:
+        name = _name(node)
+        if event == "end":
+            if name in BOUNDARY_TAGS:
+                loose.append(" ")
+            # The tail is text that follows this element inside a non-block parent.
+            if node is not root and node.tail:
+                loose.append(node.tail)
+            continue
+
+        if name in SKIPPED_TAGS and node is not root:
+            walker.skip_subtree()
+            continue
+        if name in BREAK_TAGS:
+            loose.append(" ")
+            continue
+
+        level = _heading_level(node, name)
+        if level is None and name not in BLOCK_TYPES:
+            # A container: its own text is loose text, its children are visited.
+            if name in BOUNDARY_TAGS:
+                loose.append(" ")
+            if node.text:
+                loose.append(node.text)
+            continue
+
+        walker.skip_subtree()
+        yield from flush_loose()
+        if level is not None:
+            text = _text(node)
+            if text:
+                headings.enter(level, text)
+                heading_type = "head" if level == UNKNOWN_LEVEL else f"h{level}"
+                yield {"type": heading_type, "text": text, "headings": headings.titles[:-1]}
+            continue
+
+        if name in LIST_TAGS:
+            text = _list_text(node)
+            section_type = node.get("rend") if name == "list" else BLOCK_TYPES[name]
+            section_type = section_type if section_type in ("ul", "ol") else "ul"
+        elif name == "table":
+            text, section_type = _table_text(node), "table"
+        else:
+            text, section_type = _text(node), BLOCK_TYPES[name]
+        if text:
+            yield {"type": section_type, "text": text, "headings": headings.titles}
+
+    yield from flush_loose()
+
+
+def sections_from_xml(xml: str) -> List[Dict]:
+    """Sections from trafilatura's ``output_format="xml"`` document."""
+    root = etree.fromstring(xml.encode("utf-8"), _XML_PARSER)
+    if root is None:
+        return []
+    body = root.find("main")
+    return list(iter_sections(body if body is not None else root))
+
+
+def sections_from_html(html: str) -> List[Dict]:
+    """Sections from a raw HTML page, skipping scripts, styles and navigation chrome."""
+    if not html.strip():
+        return []
+    root = lxml_html.document_fromstring(html.encode("utf-8"), parser=_HTML_PARSER)
+    body = root.find("body")
+    return list(iter_sections(body if body is not None else root))
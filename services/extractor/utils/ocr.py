@@ -1,16 +1,63 @@
+from typing import Iterable, List, Optional
+
 import fitz  # PyMuPDF
 import pytesseract
 from pdf2image import convert_from_path
 
+from config import OCR_DPI, OCR_MIN_PAGE_CHARS
+from services.extractor.utils.pdf_profiler import choose_strategy, profile_pdf
+
 
 def ocr_required(file_path: str) -> bool:
-    doc = fitz.open(file_path)
-    for page in doc:
-        if len(page.get_text("text").strip()) > 50:
-            return False
-    return True
+    with fitz.open(file_path) as doc:
+        return choose_strategy(profile_pdf(doc)) == "ocr"
+
+
+def textless_pages(
+    doc: fitz.Document, min_chars: int = OCR_MIN_PAGE_CHARS, pages: Optional[Iterable[int]] = None
+) -> List[int]:
+    """1-based numbers of pages (all, or those in ``pages``) with images but no text layer."""
+    numbers = range(1, doc.page_count + 1) if pages is None else pages
+    found = []
+    for number in numbers:
+        page = doc[number - 1]
+        if len(page.get_text("text").strip()) < min_chars and page.get_images():
+            found.append(number)
+    return found
+
+
+def ocr_page(file_path: str, page_number: int, dpi: int = OCR_DPI) -> Optional[dict]:
+    """Rasterize and OCR a single page, so only one page image is ever held in memory."""
+    images = convert_from_path(
+        file_path, dpi=dpi, first_page=page_number, last_page=page_number, thread_count=1
+    )
+    try:
+        text = "\n".join(pytesseract.image_to_string(image) for image in images).strip()
+    finally:
+        for image in images:
+            image.close()
+    if not text:
+        return None
+    return {"type": "Text", "text": text, "metadata": {"page_number": page_number, "ocr": True}}
+
+
+def _page_count(file_path: str) -> int:
+    with fitz.open(file_path) as doc:
+        return doc.page_count
+
+
+def blocks_with_ocr(
+    file_path: str, first_page: Optional[int] = None, last_page: Optional[int] = None
+) -> list:
+    first = first_page or 1
+    last = last_page or _page_count(file_path)
+    blocks = []
+    for page_number in range(first, last + 1):
+        block = ocr_page(file_path, page_number)
+        if block:
+            blocks.append(block)
+    return blocks
 
 
 def run_ocr(file_path: str) -> str:
-    images = convert_from_path(file_path)
-    return "\n".join(pytesseract.image_to_string(img) for img in images)
+    return "\n".join(block["text"] for block in blocks_with_ocr(file_path))
@@ -0,0 +1,119 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import fitz
+
+from config import EXTRACTOR_POOL_SIZE, PDF_MIN_PAGES_PER_TASK
+from services.extractor.utils.ocr import blocks_with_ocr, ocr_page
+from services.extractor.utils.pdf_extractors import blocks_with_pdfplumber, blocks_with_pymupdf
+from shared.profiling import submit_to_pool
+
+logger = logging.getLogger(__name__)
+
+# Strategies whose work can be split by page range.
+PAGE_PARALLEL_STRATEGIES = ("pymupdf", "pdfplumber", "ocr")
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def container_cpu_count() -> int:
+    """CPUs available to this container: cgroup quota, then affinity mask, then host count."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, int(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def pool_size() -> int:
+    return EXTRACTOR_POOL_SIZE or container_cpu_count()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """The extractor's shared worker pool, created on first use and reused for every document."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # forkserver avoids forking the Pub/Sub client's threads into workers.
+                _pool = ProcessPoolExecutor(
+                    max_workers=pool_size(), mp_context=multiprocessing.get_context("forkserver")
+                )
+                logger.info("Started extraction process pool with %d workers", pool_size())
+    return _pool
+
+
+def shutdown_process_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+
+
+def page_ranges(page_count: int, workers: int, min_pages: int) -> List[Tuple[int, int]]:
+    """Split 1..page_count into at most ``workers`` contiguous ranges of at least ``min_pages``."""
+    tasks = max(1, min(workers, page_count // max(min_pages, 1)))
+    size, extra = divmod(page_count, tasks)
+    ranges, first = [], 1
+    for i in range(tasks):
+        last = first + size - 1 + (1 if i < extra else 0)
+        ranges.append((first, last))
+        first = last + 1
+    return ranges
+
+
+def extract_page_range(strategy: str, file_path: str, first_page: int, last_page: int) -> list:
+    """Worker entry point: extract one page range with the given strategy."""
+    if strategy == "pymupdf":
+        with fitz.open(file_path) as doc:
+            return blocks_with_pymupdf(doc, first_page, last_page)
+    if strategy == "pdfplumber":
+        return blocks_with_pdfplumber(file_path, first_page, last_page)
+    if strategy == "ocr":
+        return blocks_with_ocr(file_path, first_page, last_page)
+    raise ValueError(f"Strategy {strategy!r} cannot be split by page range")
+
+
+def extract_pages_parallel(strategy: str, file_path: str, page_count: int) -> list:
+    """Fan page ranges out to the pool and concatenate the results back in page order."""
+    ranges = page_ranges(page_count, pool_size(), PDF_MIN_PAGES_PER_TASK)
+    pool = get_process_pool()
+    futures = [
+        submit_to_pool(pool, extract_page_range, strategy, file_path, first, last)
+        for first, last in ranges
+    ]
+    blocks = []
+    for future in futures:
+        blocks.extend(future.result())
+    return blocks
+
+
+def ocr_pages(file_path: str, pages: List[int]) -> list:
+    """
+    OCR the given pages, one page per task so each worker rasterizes a single page at a time
+    and peak memory stays flat regardless of document length. Results keep page order.
+    """
+    pages = list(pages)
+    if len(pages) > 1 and pool_size() > 1:
+        pool = get_process_pool()
+        futures = [submit_to_pool(pool, ocr_page, file_path, page_number) for page_number in pages]
+        results = (future.result() for future in futures)
+    else:
+        results = (ocr_page(file_path, page_number) for page_number in pages)
+    return [block for block in results if block]
+
+
+atexit.register(shutdown_process_pool)
@@ -1,6 +1,15 @@
+from collections import Counter
+from typing import Optional
+
 import fitz
 import pdfplumber
 
+from config import PDF_HEADING_MAX_CHARS, PDF_HEADING_SIZE_RATIO, PDF_TABLE_LINE_RATIO
+
+BOLD_FLAG = 16  # bit of a PyMuPDF span's "flags" set for bold fonts
+# Text only: the default "dict" flags would also decode every image on the page.
+DICT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
 
 def extract_with_pymupdf(file_path: str) -> str:
     doc = fitz.open(file_path)
@@ -17,6 +26,101 @@ def extract_with_pdfplumber(file_path: str) -> str:
     return text
 
 
-def is_table_heavy(text: str) -> bool:
+def table_line_ratio(text: str) -> float:
     lines = text.splitlines()
-    return sum(1 for line in lines if "\t" in line or "  " in line) / max(len(lines), 1) > 0.4
+    return sum(1 for line in lines if "\t" in line or "  " in line) / max(len(lines), 1)
+
+
+def is_table_heavy(text: str) -> bool:
+    return table_line_ratio(text) > PDF_TABLE_LINE_RATIO
+
+
+def _spans(block: dict) -> list:
+    return [span for line in block["lines"] for span in line["spans"] if span["text"].strip()]
+
+
+def _body_size(blocks: list) -> float:
+    """The font size most of the page's characters are set in."""
+    sizes = Counter()
+    for block in blocks:
+        for span in _spans(block):
+            sizes[round(span["size"], 1)] += len(span["text"])
+    return sizes.most_common(1)[0][0] if sizes else 0.0
+
+
+def _is_heading(block: dict, text: str, body_size: float) -> bool:
+    """
+    A short block set larger than the page's body text, or a single bold line no smaller
+    than it. Only a heuristic: PDFs carry no heading markup, and pdfplumber/OCR output has
+    no font information at all, so those blocks always stay ``Text``.
+    """
+    spans = _spans(block)
+    if not spans or not body_size or len(text) > PDF_HEADING_MAX_CHARS:
+        return False
+    size = min(span["size"] for span in spans)
+    if size >= body_size * PDF_HEADING_SIZE_RATIO:
+        return True
+    bold = all(span["flags"] & BOLD_FLAG for span in spans)
+    return bold and len(block["lines"]) == 1 and size >= body_size
+
+
+def blocks_with_pymupdf(
+    doc: fitz.Document, first_page: Optional[int] = None, last_page: Optional[int] = None
+) -> list:
+    """
+    Text blocks with page numbers and coordinates from an already-open document, optionally
+    limited to the 1-based inclusive page range ``first_page``..``last_page``. Blocks that
+    look like headings by font size or weight are typed ``Title``, the rest ``Text``.
+    """
+    first = (first_page or 1) - 1
+    last = (last_page or doc.page_count) - 1
+    blocks = []
+    for page in doc.pages(first, last + 1):
+        page_blocks = [
+            block
+            for block in page.get_text("dict", flags=DICT_FLAGS)["blocks"]
+            if block["type"] == 0
+        ]
+        body_size = _body_size(page_blocks)
+        for block in page_blocks:
+            text = "\n".join(
+                "".join(span["text"] for span in line["spans"]) for line in block["lines"]
+            ).strip()
+            if not text:
+                continue
+            blocks.append(
+                {
+                    "type": "Title" if _is_heading(block, text, body_size) else "Text",
+                    "text": text,
+                    "metadata": {
+                        "page_number": page.number + 1,
+                        "coordinates": list(block["bbox"]),
+                    },
+                }
+            )
+    return blocks
+
+
+def blocks_with_pdfplumber(
+    file_path: str, first_page: Optional[int] = None, last_page: Optional[int] = None
+) -> list:
+    """Page text plus detected tables (rows tab-joined) for table-heavy documents."""
+    pages = list(range(first_page, last_page + 1)) if first_page and last_page else None
+    blocks = []
+    with pdfplumber.open(file_path, pages=pages) as pdf:
+        for page in pdf.pages:
+            text = (page.extract_text() or "").strip()
+            if text:
+                blocks.append(
+                    {"type": "Text", "text": text, "metadata": {"page_number": page.page_number}}
+                )
+            for table in page.extract_tables():
+                rows = ["\t".join(cell or "" for cell in row) for row in table]
+                blocks.append(
+                    {
+                        "type": "Table",
+                        "text": "\n".join(rows),
+                        "metadata": {"page_number": page.page_number},
+                    }
+                )
+    return blocks
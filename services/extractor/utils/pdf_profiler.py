@@ -0,0 +1,82 @@
+import time
+from dataclasses import asdict, dataclass, field
+from typing import List
+
+import fitz
+
+from config import (PDF_FORCE_STRATEGY, PDF_IMAGE_COVERAGE_THRESHOLD, PDF_MIN_TEXT_CHARS_PER_PAGE,
+                    PDF_OCR_PAGE_RATIO, PDF_PROFILE_SAMPLE_PAGES, PDF_TABLE_PAGE_RATIO)
+from services.extractor.utils.pdf_extractors import is_table_heavy
+
+STRATEGIES = ("pymupdf", "pdfplumber", "ocr", "unstructured")
+
+
+@dataclass
+class PdfProfile:
+    page_count: int
+    sampled_pages: List[int] = field(default_factory=list)
+    avg_text_chars: float = 0.0
+    textless_page_ratio: float = 0.0
+    image_coverage: float = 0.0
+    table_page_ratio: float = 0.0
+    profile_ms: float = 0.0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _sample_indices(page_count: int, sample_size: int) -> List[int]:
+    if page_count <= sample_size:
+        return list(range(page_count))
+    step = page_count / sample_size
+    return sorted({int(i * step) for i in range(sample_size)})
+
+
+def _image_coverage(page: fitz.Page) -> float:
+    page_area = abs(page.rect) or 1.0
+    covered = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+    return min(covered / page_area, 1.0)
+
+
+def profile_pdf(doc: fitz.Document, sample_size: int = PDF_PROFILE_SAMPLE_PAGES) -> PdfProfile:
+    """
+    Sample pages of an open document for text-layer density, image coverage and table
+    likelihood. Only PyMuPDF is used, so this costs milliseconds even for large files.
+    """
+    started = time.perf_counter()
+    profile = PdfProfile(page_count=doc.page_count)
+    profile.sampled_pages = [i + 1 for i in _sample_indices(doc.page_count, sample_size)]
+    if not profile.sampled_pages:
+        return profile
+
+    chars, textless, coverage, tables = 0, 0, 0.0, 0
+    for page_number in profile.sampled_pages:
+        page = doc[page_number - 1]
+        text = page.get_text("text")
+        stripped = len(text.strip())
+        chars += stripped
+        textless += stripped < PDF_MIN_TEXT_CHARS_PER_PAGE
+        coverage += _image_coverage(page)
+        tables += is_table_heavy(text)
+
+    sampled = len(profile.sampled_pages)
+    profile.avg_text_chars = chars / sampled
+    profile.textless_page_ratio = textless / sampled
+    profile.image_coverage = coverage / sampled
+    profile.table_page_ratio = tables / sampled
+    profile.profile_ms = round((time.perf_counter() - started) * 1000, 2)
+    return profile
+
+
+def choose_strategy(profile: PdfProfile) -> str:
+    """Pick the cheapest strategy that should still produce adequate text."""
+    if PDF_FORCE_STRATEGY in STRATEGIES:
+        return PDF_FORCE_STRATEGY
+    if (
+        profile.textless_page_ratio >= PDF_OCR_PAGE_RATIO
+        and profile.image_coverage >= PDF_IMAGE_COVERAGE_THRESHOLD
+    ):
+        return "ocr"
+    if profile.table_page_ratio >= PDF_TABLE_PAGE_RATIO:
+        return "pdfplumber"
+    return "pymupdf"
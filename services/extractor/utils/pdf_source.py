@@ -0,0 +1,145 @@
+"""
+Where a PDF being parsed lives: in memory, or in a per-document temp directory.
+
+Documents up to ``PDF_IN_MEMORY_MAX_BYTES`` are read straight into memory and opened with
+``fitz.open(stream=...)``, so the PyMuPDF path never touches disk. Strategies that need a file
+name (pdfplumber, OCR, unstructured, the page-range process pool) ask for ``source.path``,
+which writes the bytes out the first time. Larger documents are downloaded to disk, in
+byte ranges after the head that was already read, in parallel from
+``PDF_RANGED_DOWNLOAD_MIN_BYTES`` on. Everything written is removed when the source is closed.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import fitz
+
+from config import (EXTRACTOR_TMP_DIR, PDF_DOWNLOAD_CHUNK_BYTES, PDF_DOWNLOAD_WORKERS,
+                    PDF_IN_MEMORY_MAX_BYTES, PDF_RANGED_DOWNLOAD_MIN_BYTES)
+from shared.storage.blob_store import get_blob_store
+
+logger = logging.getLogger(__name__)
+
+TEMP_PREFIX = "extractor-"
+
+
+class PdfSource:
+    def __init__(self, name: str, data: Optional[bytes] = None, path: Optional[str] = None):
+        self.name = name
+        self.data = data
+        self._path = path
+        self._temp_dir: Optional[str] = None
+
+    @property
+    def in_memory(self) -> bool:
+        return self.data is not None
+
+    def temp_dir(self) -> str:
+        if self._temp_dir is None:
+            root = EXTRACTOR_TMP_DIR or None
+            if root:
+                os.makedirs(root, exist_ok=True)
+            self._temp_dir = tempfile.mkdtemp(prefix=TEMP_PREFIX, dir=root)
+        return self._temp_dir
+
+    @property
+    def path(self) -> str:
+        """A file holding the document, written from memory on first use."""
+        if self._path is None:
+            path = os.path.join(self.temp_dir(), "document.pdf")
+            with open(path, "wb") as f:
+                f.write(self.data)
+            self._path = path
+        return self._path
+
+    def attach(self, path: str):
+        """Use a file already written into ``temp_dir()`` as the document."""
+        self._path = path
+
+    def open(self) -> fitz.Document:
+        if self.data is not None:
+            return fitz.open(stream=self.data, filetype="pdf")
+        return fitz.open(self._path)
+
+    def close(self):
+        self.data = None
+        if self._temp_dir is not None:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None
+
+    def __enter__(self) -> "PdfSource":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _download_ranges(bucket: str, name: str, path: str, size: int, head: bytes, workers: int):
+    """Write ``head``, then fetch the rest of the object in byte ranges, each at its offset."""
+    store = get_blob_store()
+    chunk = PDF_DOWNLOAD_CHUNK_BYTES
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.pwrite(fd, head, 0)
+
+        def fetch(start: int):
+            data = store.read_range(bucket, name, start, min(chunk, size - start))
+            os.pwrite(fd, data, start)
+
+        with ThreadPoolExecutor(workers, thread_name_prefix="pdf-range") as pool:
+            # list() so the first failed range raises here.
+            list(pool.map(fetch, range(len(head), size, chunk)))
+    finally:
+        os.close(fd)
+
+
+def download_pdf(bucket: str, name: str) -> PdfSource:
+    """
+    Fetch ``name`` from the blob store; raises BlobNotFound. The first request asks for at
+    most ``PDF_IN_MEMORY_MAX_BYTES``, so a small document costs one round trip; for a larger
+    one those bytes become the start of the file and only the rest is downloaded.
+    """
+    store = get_blob_store()
+    head = store.read_range(bucket, name, 0, PDF_IN_MEMORY_MAX_BYTES)
+    if len(head) < PDF_IN_MEMORY_MAX_BYTES:
+        return PdfSource(name, data=head)
+
+    size = store.size(bucket, name)
+    if size == len(head):
+        return PdfSource(name, data=head)
+
+    source = PdfSource(name)
+    try:
+        path = os.path.join(source.temp_dir(), "document.pdf")
+        # Below the ranged threshold the rest comes one chunk at a time.
+        workers = PDF_DOWNLOAD_WORKERS if size >= PDF_RANGED_DOWNLOAD_MIN_BYTES else 1
+        _download_ranges(bucket, name, path, size, head, workers)
+        source.attach(path)
+    except BaseException:
+        source.close()
+        raise
+    logger.info("Spilled %s (%.1f MB) to %s", name, size / 1e6, path)
+    return source
+
+
+def cleanup_stale_temp_dirs(older_than: float):
+    """
+    Remove temp directories left behind by a process that was killed mid-document. Only those
+    older than ``older_than`` seconds go, so another extractor sharing the directory keeps its
+    in-flight files.
+    """
+    root = Path(EXTRACTOR_TMP_DIR or tempfile.gettempdir())
+    cutoff = time.time() - older_than
+    for path in root.glob(f"{TEMP_PREFIX}*"):
+        try:
+            stale = path.is_dir() and path.stat().st_mtime < cutoff
+        except FileNotFoundError:
+            continue
+        if stale:
+            logger.info("Removing stale temp directory %s", path)
+            shutil.rmtree(path, ignore_errors=True)
@@ -1,108 +1,264 @@
 import collections
 import collections.abc
-from urllib.parse import urlparse
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
 import fitz
-import pdfplumber
-import pytesseract
-import requests
 import trafilatura
-from bs4 import BeautifulSoup
-from pdf2image import convert_from_path
 from unstructured.partition.pdf import partition_pdf
 
+from config import OCR_SELECTIVE, PDF_MIN_DOCUMENT_CHARS, PDF_PARALLEL_MIN_PAGES
+from services.extractor.utils.fetcher import FetchResult, fetch_url, normalize_url
+from services.extractor.utils.html_sections import sections_from_html, sections_from_xml
+from services.extractor.utils.ocr import blocks_with_ocr, textless_pages
+from services.extractor.utils.parallel import (PAGE_PARALLEL_STRATEGIES, extract_page_range,
+                                               extract_pages_parallel, ocr_pages, pool_size)
+from services.extractor.utils.pdf_extractors import blocks_with_pdfplumber, blocks_with_pymupdf
+from services.extractor.utils.pdf_profiler import choose_strategy, profile_pdf
+from services.extractor.utils.pdf_source import PdfSource
+
 collections.Callable = collections.abc.Callable
 
+logger = logging.getLogger(__name__)
 
-def smart_pdf_parser(file_path: str) -> list:
+# Cheapest first; unstructured is by far the most expensive.
+FALLBACK_ORDER = ("pymupdf", "pdfplumber", "ocr", "unstructured")
+TEXT_LAYER_STRATEGIES = ("pymupdf", "pdfplumber")
+
+
+def blocks_with_unstructured(file_path: str) -> list:
+    elements = partition_pdf(filename=file_path)
+    return [
+        {
+            "type": el.category,
+            "text": el.text,
+            "metadata": {
+                "page_number": el.metadata.page_number,
+                "coordinates": el.metadata.coordinates,
+            },
+        }
+        for el in elements
+    ]
+
+
+def _should_parallelise(strategy: str, doc: Optional[fitz.Document]) -> bool:
+    if strategy not in PAGE_PARALLEL_STRATEGIES or doc is None or pool_size() <= 1:
+        return False
+    # OCR costs seconds per page, so it is worth the pool from the second page on.
+    min_pages = 2 if strategy == "ocr" else PDF_PARALLEL_MIN_PAGES
+    return doc.page_count >= min_pages
+
+
+class PageOcr:
+    """
+    One document's OCR results by page, shared by the strategies ``parse_pdf`` tries, so the
+    fallback chain finds the text-less pages once and never OCRs a page twice.
+    """
+
+    def __init__(self, source: PdfSource, doc: fitz.Document, pages: Optional[range] = None):
+        self.source = source
+        self.doc = doc
+        self.pages = pages if pages is not None else range(1, doc.page_count + 1)
+        self._textless: Optional[List[int]] = None
+        self._blocks: Dict[int, Optional[dict]] = {}
+
+    def textless(self) -> List[int]:
+        if self._textless is None:
+            self._textless = textless_pages(self.doc, pages=self.pages)
+        return self._textless
+
+    def blocks(self, pages: Iterable[int]) -> list:
+        pages = list(pages)
+        todo = [number for number in pages if number not in self._blocks]
+        if todo:
+            self._blocks.update(dict.fromkeys(todo))
+            for block in ocr_pages(self.source.path, todo):
+                self._blocks[block["metadata"]["page_number"]] = block
+        return [self._blocks[number] for number in pages if self._blocks[number]]
+
+
+def _run_strategy(
+    strategy: str,
+    source: PdfSource,
+    doc: Optional[fitz.Document],
+    ocr: Optional[PageOcr] = None,
+) -> list:
+    # Only PyMuPDF reads the in-memory document; the others need a file, which source.path
+    # writes out on first use.
+    if strategy == "ocr" and doc is not None:
+        ocr = ocr or PageOcr(source, doc)
+        return ocr.blocks(ocr.pages)
+    # Large documents are split into page ranges across the process pool; small ones stay
+    # in-process so they don't pay the pool round trip.
+    if _should_parallelise(strategy, doc):
+        return extract_pages_parallel(strategy, source.path, doc.page_count)
+    if strategy == "pymupdf":
+        if doc is not None:
+            return blocks_with_pymupdf(doc)
+        with source.open() as fresh_doc:
+            return blocks_with_pymupdf(fresh_doc)
+    if strategy == "pdfplumber":
+        return blocks_with_pdfplumber(source.path)
+    if strategy == "ocr":
+        return blocks_with_ocr(source.path)
+    return blocks_with_unstructured(source.path)
+
+
+def _ocr_missing_pages(blocks: list, ocr: PageOcr) -> Tuple[list, list]:
+    """Mixed documents: OCR only the scanned pages the text layer missed."""
+    if not OCR_SELECTIVE:
+        return blocks, []
+    missing_pages = ocr.textless()
+    if not missing_pages:
+        return blocks, []
+    ocr_blocks = ocr.blocks(missing_pages)
+    blocks = sorted(blocks + ocr_blocks, key=lambda block: block["metadata"]["page_number"])
+    return blocks, missing_pages
+
+
+def plan_pdf(source: PdfSource, min_pages: int = 0) -> Optional[Tuple[int, str, dict]]:
+    """
+    Page count, routed strategy and profile, without parsing anything; None for documents
+    under ``min_pages`` pages, which are not even profiled.
+    """
+    with source.open() as doc:
+        if doc.page_count < min_pages:
+            return None
+        profile = profile_pdf(doc)
+        return doc.page_count, choose_strategy(profile), profile.to_dict()
+
+
+def parse_pdf_range(
+    source: PdfSource, strategy: str, first_page: int, last_page: int
+) -> Tuple[list, dict]:
+    """
+    Extract pages ``first_page``..``last_page`` with a strategy chosen for the whole document
+    (see ``plan_pdf``). There is no fallback chain here: the document was already routed.
+    """
+    started = time.perf_counter()
+    pages = range(first_page, last_page + 1)
+    with source.open() as doc:
+        if strategy == "ocr":
+            blocks = ocr_pages(source.path, pages)
+        elif strategy == "pymupdf":
+            blocks = blocks_with_pymupdf(doc, first_page, last_page)
+        else:
+            blocks = extract_page_range(strategy, source.path, first_page, last_page)
+        missing_pages = []
+        if strategy in TEXT_LAYER_STRATEGIES:
+            blocks, missing_pages = _ocr_missing_pages(blocks, PageOcr(source, doc, pages))
+    attempt = {
+        "strategy": strategy,
+        "ms": round((time.perf_counter() - started) * 1000, 2),
+        "chars": sum(len(block.get("text") or "") for block in blocks),
+        "pages": [first_page, last_page],
+    }
+    if missing_pages:
+        attempt["ocr_pages"] = missing_pages
+    return blocks, attempt
+
+
+def parse_pdf(source: Union[PdfSource, str]) -> Tuple[list, dict]:
+    """
+    Profile the document once with PyMuPDF, run the cheapest adequate strategy and fall
+    back through the remaining ones (cheapest first) only if too little text comes out.
+
+    ``source`` is a ``PdfSource`` (possibly in memory) or a local file path. Returns the
+    blocks and a ``parse_info`` dict with the profile, the chosen strategy and per-attempt
+    timings.
+    """
+    if isinstance(source, str):
+        source = PdfSource(source, path=source)
+    started = time.perf_counter()
+    parse_info = {"strategy": None, "attempts": [], "in_memory": source.in_memory}
+    doc = None
     try:
-        elements = partition_pdf(filename=file_path)
-        structured_output = []
-        for el in elements:
-            structured_output.append(
-                {
-                    "type": el.category,
-                    "text": el.text,
-                    "metadata": {
-                        "page_number": el.metadata.page_number,
-                        "coordinates": el.metadata.coordinates,
-                    },
-                }
-            )
-
-        if structured_output:
-            return structured_output
-
-    except Exception:
-        pass  # Try fallback methods
+        doc = source.open()
+        profile = profile_pdf(doc)
+        parse_info["profile"] = profile.to_dict()
+        chosen = choose_strategy(profile)
+    except Exception as e:
+        logger.warning("PDF profiling failed, falling back to unstructured: %s", e)
+        chosen = "unstructured"
+    parse_info["routed_to"] = chosen
 
+    blocks, best_chars = [], -1
+    ocr = PageOcr(source, doc) if doc is not None else None
     try:
-        text = ""
-        with fitz.open(file_path) as doc:
-            for page in doc:
-                text += page.get_text()
-
-        if len(text.strip()) < 100:
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    text += page.extract_text() or ""
-
-        if len(text.strip()) < 100:
-            images = convert_from_path(file_path)
-            for img in images:
-                text += pytesseract.image_to_string(img)
-
-        return [{"type": "Text", "text": text.strip()}]
+        for strategy in [chosen] + [s for s in FALLBACK_ORDER if s != chosen]:
+            attempt_started = time.perf_counter()
+            missing_pages = []
+            try:
+                attempt_blocks = _run_strategy(strategy, source, doc, ocr)
+                if strategy in TEXT_LAYER_STRATEGIES and ocr is not None:
+                    attempt_blocks, missing_pages = _ocr_missing_pages(attempt_blocks, ocr)
+                error = None
+            except Exception as e:
+                attempt_blocks, error = [], str(e)
+            chars = sum(len(block.get("text") or "") for block in attempt_blocks)
+            attempt = {
+                "strategy": strategy,
+                "ms": round((time.perf_counter() - attempt_started) * 1000, 2),
+                "chars": chars,
+                "parallel": _should_parallelise(strategy, doc),
+            }
+            if missing_pages:
+                attempt["ocr_pages"] = missing_pages
+            if error:
+                attempt["error"] = error
+            parse_info["attempts"].append(attempt)
+            if chars > best_chars:
+                blocks, best_chars, parse_info["strategy"] = attempt_blocks, chars, strategy
+            if chars >= PDF_MIN_DOCUMENT_CHARS:
+                break
+    finally:
+        if doc is not None:
+            doc.close()
+
+    parse_info["total_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    logger.info(
+        "Parsed %s with %s in %.1f ms", source.name, parse_info["strategy"], parse_info["total_ms"]
+    )
+    return blocks, parse_info
+
+
+def smart_pdf_parser(file_path: str) -> list:
+    try:
+        blocks, _ = parse_pdf(file_path)
+        return blocks
     except Exception as e:
         return [{"type": "error", "text": f"PDF extraction failed: {str(e)}"}]
 
 
-def smart_url_parser(url: str) -> dict:
-    try:
-        # Normalize URL
-        parsed = urlparse(url)
-        if not parsed.scheme:
-            url = "https://" + url
-
-        # Try with trafilatura
-        downloaded = trafilatura.fetch_url(url)
-        if downloaded:
-            extracted = trafilatura.extract(
-                downloaded,
-                output_format="xml",
-                include_comments=False,
-                include_tables=True,
-                favor_precision=True,
-            )
-            if extracted:
-                soup = BeautifulSoup(extracted, "xml")
-                structured_sections = []
-
-                for section in soup.find_all(
-                    ["head", "p", "h1", "h2", "h3", "ul", "ol", "li", "table"]
-                ):
-                    text = section.get_text(strip=True)
-                    if text:
-                        structured_sections.append({"type": section.name, "text": text})
-
-                return {"url": url, "sections": structured_sections}
-
-        # Fallback: raw HTML parsing with requests
-        response = requests.get(
-            url, timeout=60, allow_redirects=True, headers={"User-Agent": "Mozilla/5.0"}
-        )
-        soup = BeautifulSoup(response.text, "html.parser")
-        for tag in soup(["script", "style"]):
-            tag.decompose()
-
-        return {
-            "url": url,
-            "sections": [{"type": "text", "text": soup.get_text(separator="\n", strip=True)}],
-        }
+def parse_html(url: str, html: str) -> dict:
+    """Sections of an already-downloaded page: trafilatura's main content, else the raw page."""
+    extracted = trafilatura.extract(
+        html,
+        url=url,
+        output_format="xml",
+        include_comments=False,
+        include_tables=True,
+        favor_precision=True,
+    )
+    if extracted:
+        return {"url": url, "sections": sections_from_xml(extracted)}
+
+    # Fallback: every block of the raw page, minus scripts and navigation
+    return {"url": url, "sections": sections_from_html(html)}
 
-    except requests.exceptions.Timeout:
-        return {"error": f"Timeout while fetching URL: {url}"}
-    except requests.exceptions.RequestException as e:
-        return {"error": f"Network error while fetching URL: {str(e)}"}
+
+def smart_url_parser(url: str, fetched: Optional[FetchResult] = None) -> dict:
+    """
+    Parse a URL's content. Pass ``fetched`` when the page has already been downloaded (the
+    extractor fetches conditionally first); otherwise it is fetched here, once.
+    """
+    try:
+        url = normalize_url(url)
+        if fetched is None:
+            fetched = fetch_url(url)
+        if fetched.error:
+            return {"error": fetched.error}
+        return parse_html(url, fetched.text)
     except Exception as e:
         return {"error": f"URL extraction failed: {str(e)}"}
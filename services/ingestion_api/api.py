@@ -1,59 +1,68 @@
 # services/ingestion_api/api.py
-import uuid
+from typing import Optional
 
 from fastapi import APIRouter, File, Form, HTTPException, UploadFile
 from fastapi.responses import JSONResponse
-from utils import publish_ingestion_event, save_file_to_gcs
+from utils import (DocumentIdTaken, InvalidDocumentId, claim_document_id, extracted_url,
+                   get_dedup_index, ingest_file, publish_ingestion_event)
 
-from config import EXTRACTED_TEXT_BUCKET
+from shared.instrumentation import DOCUMENTS, document_context, stage_timer
 
 router = APIRouter()
 
 
 @router.post("/upload")
-async def upload_file(tenant_id: str = Form(...), file: UploadFile = File(...)):
+async def upload_file(
+    tenant_id: str = Form(...),
+    file: UploadFile = File(...),
+    document_id: Optional[str] = Form(None),
+):
+    """
+    ``document_id`` is optional; passing the same id for a new version of a document lets
+    the chunker re-chunk it incrementally instead of treating it as a new document. It must
+    match ``[A-Za-z0-9_-]{1,64}`` and may not be an id another tenant already uses.
+    """
     try:
-        file_id = str(uuid.uuid4())
-        gcs_path = await save_file_to_gcs(file, tenant_id, file_id)
-
-        # Construct future public URL for extracted output
-        extracted_blob_name = f"file/{file_id}.json"
-        public_url = f"https://storage.googleapis.com/{EXTRACTED_TEXT_BUCKET}/{extracted_blob_name}"
-
-        # Publish event to extractor
-        await publish_ingestion_event(
-            {
-                "type": "file",
-                "tenant_id": tenant_id,
-                "file_id": file_id,
-                "filename": file.filename,
-                "gcs_path": gcs_path,
-            }
-        )
-
-        return JSONResponse(
-            {"status": "success", "file_id": file_id, "expected_extracted_url": public_url}
-        )
+        return JSONResponse(await ingest_file(file, tenant_id, document_id))
+    except InvalidDocumentId as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DocumentIdTaken as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/dedup/stats")
+async def dedup_stats():
+    dedup_index = get_dedup_index()
+    if dedup_index is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **dedup_index.stats()})
+
+
 @router.post("/url")
-async def submit_url(tenant_id: str = Form(...), url: str = Form(...)):
+async def submit_url(
+    tenant_id: str = Form(...), url: str = Form(...), document_id: Optional[str] = Form(None)
+):
     try:
-        url_id = str(uuid.uuid4())
+        url_id = await claim_document_id(tenant_id, "url", document_id)
 
         # Construct future public URL for extracted output
-        extracted_blob_name = f"url/{url_id}.json"
-        public_url = f"https://storage.googleapis.com/{EXTRACTED_TEXT_BUCKET}/{extracted_blob_name}"
+        public_url = extracted_url("url", url_id)
 
         # Publish event to extractor
-        await publish_ingestion_event(
-            {"type": "url", "tenant_id": tenant_id, "url_id": url_id, "url": url}
-        )
+        with document_context(url_id), stage_timer("publish"):
+            await publish_ingestion_event(
+                {"type": "url", "tenant_id": tenant_id, "url_id": url_id, "url": url}
+            )
+        DOCUMENTS.inc(kind="url", outcome="accepted")
 
         return JSONResponse(
             {"status": "success", "url_id": url_id, "expected_extracted_url": public_url}
         )
+    except InvalidDocumentId as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DocumentIdTaken as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
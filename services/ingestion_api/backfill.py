@@ -0,0 +1,266 @@
+"""
+Bulk backfill: push existing documents through the same path as ``/api/upload`` without HTTP.
+
+Sources are a local directory, a ``gs://bucket/prefix`` or a manifest file (one path or
+``gs://`` URI per line, or JSON lines with ``source`` and optional ``document_id``). Files are
+ingested with bounded parallelism by ``utils.ingest_file``; each finished file is appended to
+a state file, so a re-run after a crash skips everything already sent.
+
+    cd services/ingestion_api
+    python backfill.py --tenant acme --source /mnt/export/acme
+    python backfill.py --tenant acme --source gs://legacy-bucket/acme/ --concurrency 32
+    python backfill.py --tenant acme --manifest files.jsonl --state acme.state.jsonl
+"""
+import argparse
+import asyncio
+import json
+import logging
+import mimetypes
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator, Optional, Set
+
+from utils import _get_storage_client, close_clients, ingest_file, init_clients, run_blocking
+
+from config import BACKFILL_CONCURRENCY, BACKFILL_STATE_FILE
+
+logger = logging.getLogger("backfill")
+
+DOCUMENT_NAMESPACE = uuid.UUID("3d0c9a36-5a0b-4f3e-9a57-0b1d6c2e8f14")
+
+
+@dataclass
+class SourceItem:
+    source: str
+    filename: str
+    size_bytes: int
+    opener: Callable
+    document_id: Optional[str] = None
+
+
+class SourceFile:
+    """The async file interface ``ingest_file`` expects, over a blocking file object."""
+
+    def __init__(self, item: SourceItem):
+        self.filename = item.filename
+        self.content_type = mimetypes.guess_type(item.filename)[0] or "application/octet-stream"
+        self._opener = item.opener
+        self._file = None
+
+    async def __aenter__(self):
+        self._file = await run_blocking(self._opener)
+        return self
+
+    async def __aexit__(self, *exc):
+        await run_blocking(self._file.close)
+
+    async def read(self, size: int = -1) -> bytes:
+        return await run_blocking(self._file.read, size)
+
+    async def seek(self, offset: int):
+        return await run_blocking(self._file.seek, offset)
+
+
+def _local_item(path: Path, source: Optional[str] = None, **extra) -> SourceItem:
+    return SourceItem(
+        source=source or str(path),
+        filename=path.name,
+        size_bytes=path.stat().st_size,
+        opener=lambda: open(path, "rb"),
+        **extra,
+    )
+
+
+def _gcs_items(uri: str) -> Iterator[SourceItem]:
+    bucket_name, _, prefix = uri[len("gs://"):].partition("/")
+    bucket = _get_storage_client().bucket(bucket_name)
+    for blob in bucket.list_blobs(prefix=prefix):
+        if blob.name.endswith("/"):
+            continue
+        yield _gcs_item(blob)
+
+
+def _gcs_item(blob, **extra) -> SourceItem:
+    return SourceItem(
+        source=f"gs://{blob.bucket.name}/{blob.name}",
+        filename=os.path.basename(blob.name),
+        size_bytes=blob.size or 0,
+        opener=lambda: blob.open("rb"),
+        **extra,
+    )
+
+
+def _manifest_items(manifest: Path) -> Iterator[SourceItem]:
+    with manifest.open() as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line) if line.startswith("{") else {"source": line}
+            source, document_id = entry["source"], entry.get("document_id")
+            if source.startswith("gs://"):
+                bucket_name, _, name = source[len("gs://"):].partition("/")
+                blob = _get_storage_client().bucket(bucket_name).get_blob(name)
+                if blob is None:
+                    logger.error("Manifest entry not found: %s", source)
+                    continue
+                yield _gcs_item(blob, document_id=document_id)
+            else:
+                yield _local_item(Path(source), document_id=document_id)
+
+
+def _local_files(root: Path) -> Iterator[Path]:
+    # One directory's entries at a time, sorted so re-runs visit files in the same order.
+    with os.scandir(root) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from _local_files(Path(entry.path))
+        elif entry.is_file():
+            yield Path(entry.path)
+
+
+def iter_sources(source: Optional[str], manifest: Optional[Path]) -> Iterator[SourceItem]:
+    """
+    Items to ingest, produced lazily. Every step may block (GCS list pages, ``get_blob``,
+    ``stat``), so async callers pull from it with ``run_blocking``.
+    """
+    if manifest:
+        yield from _manifest_items(manifest)
+    elif source.startswith("gs://"):
+        yield from _gcs_items(source)
+    else:
+        for path in _local_files(Path(source)):
+            yield _local_item(path)
+
+
+class Checkpoint:
+    """Append-only JSONL of finished sources; loading it gives the set to skip."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.done: Set[str] = set()
+        if path.exists():
+            with path.open() as f:
+                for line in f:
+                    if line.strip():
+                        self.done.add(json.loads(line)["source"])
+        self._file = path.open("a")
+
+    def record(self, source: str, result: dict):
+        self._file.write(json.dumps({"source": source, **result}) + "\n")
+        # Flushed per record: a crash loses at most the files still in flight.
+        self._file.flush()
+        self.done.add(source)
+
+    def close(self):
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+class Progress:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.documents = self.bytes = self.skipped = self.failed = self.duplicates = 0
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        logger.info(
+            "%d sent (%d duplicate), %d skipped, %d failed | %.1f docs/s, %.1f MB/s",
+            self.documents,
+            self.duplicates,
+            self.skipped,
+            self.failed,
+            self.documents / elapsed,
+            self.bytes / elapsed / 1e6,
+        )
+
+
+async def _ingest(item: SourceItem, tenant_id: str, checkpoint: Checkpoint, progress: Progress):
+    # Deterministic ids: if a crash loses the checkpoint line, the resend is an update of the
+    # same document rather than a new one.
+    document_id = item.document_id or str(
+        uuid.uuid5(DOCUMENT_NAMESPACE, f"{tenant_id}:{item.source}")
+    )
+    try:
+        async with SourceFile(item) as file:
+            result = await ingest_file(file, tenant_id, document_id)
+    except Exception:
+        progress.failed += 1
+        logger.error("Failed to ingest %s", item.source, exc_info=True)
+        return
+    checkpoint.record(item.source, result)
+    progress.documents += 1
+    progress.bytes += item.size_bytes
+    progress.duplicates += result["status"] == "duplicate"
+
+
+async def backfill(args) -> Progress:
+    checkpoint = Checkpoint(args.state)
+    progress = Progress()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    pending: Set[asyncio.Task] = set()
+
+    async def run(item: SourceItem):
+        try:
+            await _ingest(item, args.tenant, checkpoint, progress)
+        finally:
+            semaphore.release()
+
+    async def report():
+        while True:
+            await asyncio.sleep(args.report_every)
+            progress.report()
+
+    reporter = asyncio.create_task(report())
+    items = iter_sources(args.source, args.manifest)
+    try:
+        while True:
+            # Each step of the listing runs on the I/O executor, never on the event loop.
+            item = await run_blocking(next, items, None)
+            if item is None:
+                break
+            if item.source in checkpoint.done:
+                progress.skipped += 1
+                continue
+            # Listing is lazy and tasks are only created when a slot is free, so memory stays
+            # flat however many files the source holds.
+            await semaphore.acquire()
+            task = asyncio.create_task(run(item))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+    finally:
+        reporter.cancel()
+        checkpoint.close()
+    progress.report()
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill existing documents for a tenant.")
+    parser.add_argument("--tenant", required=True)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--source", help="local directory or gs://bucket/prefix")
+    group.add_argument("--manifest", type=Path, help="file listing paths or gs:// URIs")
+    parser.add_argument("--concurrency", type=int, default=BACKFILL_CONCURRENCY)
+    parser.add_argument("--state", type=Path, default=Path(BACKFILL_STATE_FILE))
+    parser.add_argument("--report-every", type=float, default=10.0, help="seconds")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    init_clients()
+    try:
+        progress = asyncio.run(backfill(args))
+    finally:
+        close_clients()
+    if progress.failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
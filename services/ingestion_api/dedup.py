@@ -0,0 +1,211 @@
+# services/ingestion_api/dedup.py
+import json
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from config import (DEDUP_BACKEND, DEDUP_CROSS_TENANT, DEDUP_GCS_PREFIX, DEDUP_SQLITE_PATH,
+                    GCS_BUCKET)
+from shared.storage.blob_store import BlobNotFound, BlobStore, get_blob_store
+
+logger = logging.getLogger(__name__)
+
+
+class DigestIndex(ABC):
+    """Maps a content digest key to the record of the first document stored with it."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    def put_if_absent(self, key: str, record: dict) -> bool:
+        """Store ``record`` unless the key exists already; return True if it was stored."""
+
+    @abstractmethod
+    def put(self, key: str, record: dict):
+        """Store ``record``, replacing whatever the key held."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Remove the key if present."""
+
+
+class SQLiteDigestIndex(DigestIndex):
+    """Single-file index for local runs and tests."""
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS digests (key TEXT PRIMARY KEY, record TEXT NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT record FROM digests WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_if_absent(self, key: str, record: dict) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO digests (key, record) VALUES (?, ?)",
+                (key, json.dumps(record)),
+            )
+        return cursor.rowcount == 1
+
+    def put(self, key: str, record: dict):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO digests (key, record) VALUES (?, ?)",
+                (key, json.dumps(record)),
+            )
+
+    def delete(self, key: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM digests WHERE key = ?", (key,))
+
+
+class BlobDigestIndex(DigestIndex):
+    """
+    One small JSON object per digest under a prefix of the blob store (GCS, or the local and
+    memory stores); ``BlobStore.create`` makes the first writer of a key win.
+    """
+
+    def __init__(self, store: BlobStore, bucket: str, prefix: str):
+        self._store = store
+        self._bucket = bucket
+        self._prefix = prefix.rstrip("/")
+
+    def _name(self, key: str) -> str:
+        return f"{self._prefix}/{key}.json"
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            return json.loads(self._store.read(self._bucket, self._name(key)))
+        except BlobNotFound:
+            return None
+
+    def put_if_absent(self, key: str, record: dict) -> bool:
+        data = json.dumps(record).encode("utf-8")
+        return self._store.create(self._bucket, self._name(key), data, "application/json")
+
+    def put(self, key: str, record: dict):
+        data = json.dumps(record).encode("utf-8")
+        self._store.write(self._bucket, self._name(key), data, "application/json")
+
+    def delete(self, key: str):
+        self._store.delete(self._bucket, self._name(key))
+
+
+class DedupIndex:
+    """Scopes digests per tenant (or globally) and counts hits and misses."""
+
+    def __init__(self, backend: DigestIndex, cross_tenant: bool = DEDUP_CROSS_TENANT):
+        self.backend = backend
+        self.cross_tenant = cross_tenant
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _key(self, tenant_id: str, sha256: str) -> str:
+        scope = "_global" if self.cross_tenant else tenant_id
+        return f"{scope}/{sha256}"
+
+    def claim(self, tenant_id: str, sha256: str, record: dict) -> Optional[dict]:
+        """
+        Index ``record`` for the digest unless another document has it; returns that other
+        document's record, or None if ``record`` is now canonical. Done before the upload, so
+        of two concurrent identical uploads exactly one is stored.
+        """
+        key = self._key(tenant_id, sha256)
+        existing = None
+        if not self.backend.put_if_absent(key, record):
+            # None if the holder released it in between; then this upload goes ahead unindexed.
+            existing = self.backend.get(key)
+        with self._lock:
+            if existing:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return existing
+
+    def release(self, tenant_id: str, sha256: str, document_id: str):
+        """
+        Drop the digest's record if it belongs to ``document_id``: its upload failed, or the
+        document now holds other content, so the next copy of the file is stored afresh.
+        """
+        key = self._key(tenant_id, sha256)
+        record = self.backend.get(key)
+        if record and record.get("document_id") == document_id:
+            self.backend.delete(key)
+            logger.info("Released digest %s of document %s", sha256, document_id)
+
+    def set_version(self, tenant_id: str, sha256: str, document_id: str):
+        """
+        Record that ``document_id`` now holds the content with digest ``sha256``. A re-ingest
+        under the same id replaces its output, so the digest of the version it replaces is
+        released; otherwise an upload of the old bytes would be answered with an id whose
+        output no longer matches them.
+        """
+        key = f"_versions/file/{document_id}"
+        previous = self.backend.get(key)
+        if previous and previous.get("sha256") != sha256:
+            self.release(previous["tenant_id"], previous["sha256"], document_id)
+        self.backend.put(key, {"tenant_id": tenant_id, "sha256": sha256})
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "cross_tenant": self.cross_tenant,
+            "backend": type(self.backend).__name__,
+        }
+
+
+class DocumentOwners:
+    """
+    The tenant each document id belongs to. Extracted output is stored by id alone
+    (``file/<id>.json``), so an id a client picks must not be one another tenant owns.
+    """
+
+    def __init__(self, backend: DigestIndex):
+        self.backend = backend
+
+    def claim(self, tenant_id: str, source: str, document_id: str) -> bool:
+        """True if ``tenant_id`` owns ``document_id``, either already or from now on."""
+        key = f"_owners/{source}/{document_id}"
+        if self.backend.put_if_absent(key, {"tenant_id": tenant_id}):
+            return True
+        record = self.backend.get(key) or {}
+        return record.get("tenant_id") == tenant_id
+
+    def release(self, tenant_id: str, source: str, document_id: str):
+        """Give up an id that was claimed but never stored under."""
+        key = f"_owners/{source}/{document_id}"
+        record = self.backend.get(key)
+        if record and record.get("tenant_id") == tenant_id:
+            self.backend.delete(key)
+
+
+def _create_backend(store: Optional[BlobStore] = None) -> DigestIndex:
+    if DEDUP_BACKEND == "gcs":
+        return BlobDigestIndex(store or get_blob_store(), GCS_BUCKET, DEDUP_GCS_PREFIX)
+    if DEDUP_BACKEND == "sqlite":
+        return SQLiteDigestIndex(DEDUP_SQLITE_PATH)
+    raise ValueError(f"Unknown DEDUP_BACKEND: {DEDUP_BACKEND}")
+
+
+def create_dedup_index(store: Optional[BlobStore] = None) -> DedupIndex:
+    return DedupIndex(_create_backend(store))
+
+
+def create_document_owners(store: Optional[BlobStore] = None) -> DocumentOwners:
+    # Owner records share the digest index's store; their three-part keys never collide with
+    # ``<scope>/<sha>``, nor with the ``_versions/file/<id>`` records of ``DedupIndex``.
+    return DocumentOwners(_create_backend(store))
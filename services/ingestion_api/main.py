@@ -1,7 +1,27 @@
 # services/ingestion_api/main.py
+from contextlib import asynccontextmanager
+
 from api import router
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from utils import close_clients, init_clients
+
+from shared.instrumentation import REGISTRY, configure
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure("ingestion_api")
+    init_clients()
+    yield
+    close_clients()
 
-app = FastAPI(title="Ingestion API")
+
+app = FastAPI(title="Ingestion API", lifespan=lifespan)
 
 app.include_router(router, prefix="/api")
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -1,32 +1,266 @@
 # services/ingestion_api/utils.py
-import json
+import asyncio
+import hashlib
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
 
-import aiofiles
-from google.cloud import pubsub_v1, storage
+from dedup import DedupIndex, DocumentOwners, create_dedup_index, create_document_owners
+from google.cloud import storage
 
-from config import GCP_PROJECT, GCS_BUCKET, PUBSUB_TOPIC
+from config import (DEDUP_ALIAS_EVENTS, DEDUP_ENABLED, EXTRACTED_TEXT_BUCKET, GCS_BUCKET,
+                    INGESTION_IO_WORKERS, PUBSUB_TOPIC, UPLOAD_CHUNK_SIZE)
+from shared.instrumentation import DOCUMENTS, STAGE_BYTES, document_context, stage_timer
+from shared.pubsub.publisher import flush, get_publisher, publish_event_async
 
+# Clients are created once by the FastAPI lifespan (see main.py) and shared by all requests.
+_storage_client: Optional[storage.Client] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_dedup_index: Optional[DedupIndex] = None
+_document_owners: Optional[DocumentOwners] = None
 
-async def save_file_to_gcs(file, tenant_id, file_id):
-    path = f"{tenant_id}/{file_id}_{file.filename}"
-    local_path = f"/tmp/{file_id}_{file.filename}"
+# Document ids end up in object names; UUIDs and backfill ids both fit.
+DOCUMENT_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
 
-    async with aiofiles.open(local_path, "wb") as out_file:
-        content = await file.read()
-        await out_file.write(content)
 
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(GCS_BUCKET)
-    blob = bucket.blob(path)
-    blob.upload_from_filename(local_path)
+class InvalidDocumentId(ValueError):
+    pass
 
-    return path
 
+class DocumentIdTaken(PermissionError):
+    pass
 
-async def publish_ingestion_event(payload: dict):
-    publisher = pubsub_v1.PublisherClient()
-    topic_path = publisher.topic_path(GCP_PROJECT, PUBSUB_TOPIC)
-    future = publisher.publish(
-        topic_path, data=json.dumps(payload).encode("utf-8"), **{"content-type": "application/json"}
+
+def init_clients():
+    global _storage_client, _executor, _dedup_index, _document_owners
+    _storage_client = storage.Client()
+    _executor = ThreadPoolExecutor(max_workers=INGESTION_IO_WORKERS, thread_name_prefix="ingest-io")
+    if DEDUP_ENABLED:
+        _dedup_index = create_dedup_index()
+    _document_owners = create_document_owners()
+    get_publisher()
+
+
+def close_clients():
+    global _storage_client, _executor, _dedup_index, _document_owners
+    flush()
+    _dedup_index = None
+    _document_owners = None
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    if _storage_client is not None:
+        _storage_client.close()
+        _storage_client = None
+
+
+def _get_storage_client() -> storage.Client:
+    if _storage_client is None:
+        raise RuntimeError("Ingestion clients are not initialised; call init_clients() first")
+    return _storage_client
+
+
+async def run_blocking(func, *args):
+    """Run a blocking GCS/Pub/Sub call on the I/O executor instead of the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+
+def get_dedup_index() -> Optional[DedupIndex]:
+    """The digest index, or None when deduplication is disabled."""
+    return _dedup_index
+
+
+async def claim_document_id(tenant_id: str, source: str, document_id: Optional[str]) -> str:
+    """
+    The id to store a document under: ``document_id`` if it is well-formed and not owned by
+    another tenant, or a new UUID. The tenant owns the id from then on, so later versions
+    sent under it are accepted and nobody else's are.
+    """
+    if document_id is None:
+        document_id = str(uuid.uuid4())
+    elif not DOCUMENT_ID.fullmatch(document_id):
+        raise InvalidDocumentId("document_id must be 1-64 characters of A-Z, a-z, 0-9, _ and -")
+    if _document_owners is None:
+        raise RuntimeError("Ingestion clients are not initialised; call init_clients() first")
+    if not await run_blocking(_document_owners.claim, tenant_id, source, document_id):
+        raise DocumentIdTaken(f"document_id {document_id} belongs to another tenant")
+    return document_id
+
+
+async def hash_upload(file) -> dict:
+    """Hash the spooled upload in fixed-size reads, then rewind it for the real upload."""
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        await run_blocking(digest.update, chunk)
+    await file.seek(0)
+    return {"sha256": digest.hexdigest(), "size_bytes": size}
+
+
+# Page objects outside compressed object streams; enough for the extractor's scheduler to tell
+# a 2-page invoice from a 900-page scan. 0 means unknown and it falls back to the byte size.
+_PAGE_OBJECT = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+
+
+def _write_chunk(writer, digest, chunk: bytes) -> int:
+    if digest is not None:
+        digest.update(chunk)
+    writer.write(chunk)
+    return len(_PAGE_OBJECT.findall(chunk))
+
+
+def upload_path(tenant_id: str, file_id: str, filename: str) -> str:
+    return f"{tenant_id}/{file_id}_{filename}"
+
+
+async def save_file_to_gcs(file, tenant_id, file_id, sha256: Optional[str] = None) -> dict:
+    """
+    Stream an upload into a resumable GCS upload without buffering it in memory or on disk.
+
+    The body is read in ``UPLOAD_CHUNK_SIZE`` pieces; each piece is hashed (unless ``sha256``
+    is already known) and handed to the blob writer on the I/O executor. Returns the object
+    path with its SHA-256, byte count and a rough page count for the extractor's scheduler.
+    """
+    path = upload_path(tenant_id, file_id, file.filename)
+    bucket = _get_storage_client().bucket(GCS_BUCKET)
+    blob = bucket.blob(path, chunk_size=UPLOAD_CHUNK_SIZE)
+
+    digest = hashlib.sha256() if sha256 is None else None
+    size = pages = 0
+    writer = await run_blocking(
+        partial(blob.open, "wb", content_type=file.content_type or "application/octet-stream")
     )
-    return future.result()
+    # Closing finalises the resumable session, so only do it once the whole body is written;
+    # an abandoned session never becomes a visible object.
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        pages += await run_blocking(_write_chunk, writer, digest, chunk)
+    await run_blocking(writer.close)
+
+    return {
+        "gcs_path": path,
+        "sha256": sha256 if digest is None else digest.hexdigest(),
+        "size_bytes": size,
+        "page_estimate": pages,
+    }
+
+
+async def publish_ingestion_event(payload: dict):
+    future = publish_event_async(PUBSUB_TOPIC, payload, **{"content-type": "application/json"})
+    return await asyncio.wrap_future(future)
+
+
+def extracted_url(source: str, document_id: str) -> str:
+    return f"https://storage.googleapis.com/{EXTRACTED_TEXT_BUCKET}/{source}/{document_id}.json"
+
+
+async def _register_duplicate(
+    file, tenant_id: str, digest: dict, existing: dict, file_id: str, new_id: bool
+) -> dict:
+    canonical_id = existing["document_id"]
+    DOCUMENTS.inc(kind="file", outcome="duplicate")
+    if not DEDUP_ALIAS_EVENTS or canonical_id == file_id:
+        if new_id and canonical_id != file_id:
+            # Nothing is ever stored under the id this upload claimed.
+            await run_blocking(_document_owners.release, tenant_id, "file", file_id)
+        return {
+            "status": "duplicate",
+            "file_id": canonical_id,
+            "expected_extracted_url": existing["expected_extracted_url"],
+        }
+
+    # Give the tenant its own document id and let the extractor copy the canonical output.
+    with stage_timer("publish"):
+        await publish_ingestion_event(
+            {
+                "type": "alias",
+                "tenant_id": tenant_id,
+                "file_id": file_id,
+                "filename": file.filename,
+                "canonical_document_id": canonical_id,
+                "sha256": digest["sha256"],
+                "size_bytes": digest["size_bytes"],
+            }
+        )
+    # The alias replaces whatever an earlier version of ``file_id`` held.
+    await run_blocking(get_dedup_index().set_version, tenant_id, digest["sha256"], file_id)
+    return {
+        "status": "duplicate",
+        "file_id": file_id,
+        "canonical_file_id": canonical_id,
+        "expected_extracted_url": extracted_url("file", file_id),
+    }
+
+
+async def ingest_file(file, tenant_id: str, document_id: Optional[str] = None) -> dict:
+    """
+    Deduplicate, upload and announce one file; shared by ``/upload`` and the backfill CLI.
+
+    ``file`` is anything with ``filename``, ``content_type`` and async ``read``/``seek``
+    (a Starlette ``UploadFile`` or ``backfill.SourceFile``).
+    """
+    file_id = await claim_document_id(tenant_id, "file", document_id)
+    # Construct future public URL for extracted output
+    public_url = extracted_url("file", file_id)
+    dedup_index = get_dedup_index()
+    sha256 = None
+    if dedup_index is not None:
+        with stage_timer("hash"):
+            digest = await hash_upload(file)
+        sha256 = digest["sha256"]
+        existing = await run_blocking(
+            dedup_index.claim,
+            tenant_id,
+            sha256,
+            {
+                "document_id": file_id,
+                "tenant_id": tenant_id,
+                "gcs_path": upload_path(tenant_id, file_id, file.filename),
+                "expected_extracted_url": public_url,
+            },
+        )
+        if existing:
+            return await _register_duplicate(
+                file, tenant_id, digest, existing, file_id, new_id=document_id is None
+            )
+
+    try:
+        result = await _store_file(file, tenant_id, file_id, sha256, public_url)
+    except Exception:
+        if sha256 is not None:
+            await run_blocking(dedup_index.release, tenant_id, sha256, file_id)
+        raise
+    if sha256 is not None:
+        await run_blocking(dedup_index.set_version, tenant_id, sha256, file_id)
+    return result
+
+
+async def _store_file(
+    file, tenant_id: str, file_id: str, sha256: Optional[str], public_url: str
+) -> dict:
+    with document_context(file_id):
+        with stage_timer("upload"):
+            upload = await save_file_to_gcs(file, tenant_id, file_id, sha256)
+        STAGE_BYTES.inc(upload["size_bytes"], stage="upload")
+
+        # Publish event to extractor
+        with stage_timer("publish"):
+            await publish_ingestion_event(
+                {
+                    "type": "file",
+                    "tenant_id": tenant_id,
+                    "file_id": file_id,
+                    "filename": file.filename,
+                    "gcs_path": upload["gcs_path"],
+                    "sha256": upload["sha256"],
+                    "size_bytes": upload["size_bytes"],
+                    "page_estimate": upload["page_estimate"],
+                }
+            )
+        DOCUMENTS.inc(kind="file", outcome="accepted")
+
+    return {"status": "success", "file_id": file_id, "expected_extracted_url": public_url}
@@ -0,0 +1,211 @@
+"""
+Run extraction and chunking in one process, without Pub/Sub or GCS.
+
+Ingestion events, extraction events and chunk events travel through a ``MemoryBroker`` (one
+asyncio queue per topic) straight into the extractor and chunker handlers, which run on thread
+pools; blobs live in a local directory or in memory. The ingestion queue is unbounded because
+extractors publish fan-out parts onto it; the input is throttled by the pipeline instead. Chunk
+events that would go to the embedding topic are written as NDJSON.
+
+    cd services/pipeline
+    python main.py --input /data/tenant-a --tenant tenant-a --output chunks.ndjson
+    python main.py --input /data/tenant-a --urls urls.txt --blob-store memory
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterator, Optional, TextIO
+
+ROOT = Path(__file__).resolve().parents[2]
+# The extractor and chunker import their siblings as top-level modules.
+for path in (ROOT, ROOT / "services" / "extractor", ROOT / "services" / "chunker"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from extractor import handle_ingestion_event  # noqa: E402
+from pubsub_handler import handle_extracted_text_message  # noqa: E402
+
+from config import (GCS_BUCKET, LOCAL_BLOB_ROOT, PIPELINE_CHUNK_WORKERS,  # noqa: E402
+                    PIPELINE_EXTRACT_WORKERS, PIPELINE_QUEUE_SIZE, PUBSUB_EMBEDDING_TOPIC,
+                    PUBSUB_EXTRACTION_TOPIC, PUBSUB_TOPIC)
+from shared.pubsub.broker import MemoryBroker, set_broker  # noqa: E402
+from shared.storage.blob_store import (LocalBlobStore, MemoryBlobStore,  # noqa: E402
+                                       set_blob_store)
+
+logger = logging.getLogger("pipeline")
+
+DOCUMENT_NAMESPACE = uuid.UUID("0b6f8a52-9d0e-4f57-8a8e-2f6f3b1c7d40")
+# Attributes of the events the pipeline queues from its input, as opposed to fan-out parts.
+INPUT_ATTRIBUTES = {"origin": "input"}
+
+
+def document_id_for(tenant_id: str, source: str) -> str:
+    """Stable per tenant and source, so a re-run re-chunks incrementally instead of duplicating."""
+    return str(uuid.uuid5(DOCUMENT_NAMESPACE, f"{tenant_id}:{source}"))
+
+
+def ingestion_events(input_dir: Optional[Path], urls: Optional[Path], tenant_id: str) -> Iterator:
+    if input_dir:
+        for path in sorted(p for p in input_dir.rglob("*.pdf") if p.is_file()):
+            name = path.relative_to(input_dir).as_posix()
+            yield {
+                "type": "file",
+                "tenant_id": tenant_id,
+                "file_id": document_id_for(tenant_id, name),
+                "filename": path.name,
+                "gcs_path": name,
+            }
+    if urls:
+        for url in (line.strip() for line in urls.read_text().splitlines()):
+            if url and not url.startswith("#"):
+                yield {
+                    "type": "url",
+                    "tenant_id": tenant_id,
+                    "url_id": document_id_for(tenant_id, url),
+                    "url": url,
+                }
+
+
+class Pipeline:
+    def __init__(
+        self,
+        broker: MemoryBroker,
+        executor: ThreadPoolExecutor,
+        sink: Optional[TextIO],
+        max_pending_input: int = 0,
+    ):
+        self.broker = broker
+        self.executor = executor
+        self.sink = sink
+        self._input_slots = asyncio.Semaphore(max_pending_input) if max_pending_input else None
+        self.counts = {"documents": 0, "extracted": 0, "chunked": 0, "chunks": 0, "failed": 0}
+
+    async def _stage(self, topic: str, handler: Callable[[dict], None], counter: str):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, payload, attributes = await self.broker.get(topic)
+            if self._input_slots is not None and attributes == INPUT_ATTRIBUTES:
+                self._input_slots.release()
+            try:
+                await loop.run_in_executor(self.executor, handler, payload)
+                self.counts[counter] += 1
+            except Exception:
+                self.counts["failed"] += 1
+                logger.error("%s handler failed", topic, exc_info=True)
+            finally:
+                self.broker.task_done(topic)
+
+    async def _sink(self):
+        while True:
+            _, payload, _ = await self.broker.get(PUBSUB_EMBEDDING_TOPIC)
+            self.counts["chunks"] += 1
+            if self.sink is not None:
+                self.sink.write(json.dumps(payload) + "\n")
+            self.broker.task_done(PUBSUB_EMBEDDING_TOPIC)
+
+    async def _report(self, started: float, interval: float = 10.0):
+        while True:
+            await asyncio.sleep(interval)
+            elapsed = time.perf_counter() - started
+            logger.info(
+                "%d/%d documents chunked, %d chunks, %.2f docs/s",
+                self.counts["chunked"],
+                self.counts["documents"],
+                self.counts["chunks"],
+                self.counts["chunked"] / elapsed,
+            )
+
+    async def run(self, events: Iterator[dict], extract_workers: int, chunk_workers: int):
+        started = time.perf_counter()
+        tasks = [
+            *(
+                asyncio.create_task(self._stage(PUBSUB_TOPIC, handle_ingestion_event, "extracted"))
+                for _ in range(extract_workers)
+            ),
+            *(
+                asyncio.create_task(
+                    self._stage(PUBSUB_EXTRACTION_TOPIC, handle_extracted_text_message, "chunked")
+                )
+                for _ in range(chunk_workers)
+            ),
+            asyncio.create_task(self._sink()),
+            asyncio.create_task(self._report(started)),
+        ]
+        try:
+            # The producer waits whenever the extractors fall behind. Parts that extractors fan
+            # out go onto the same queue but never wait, so a worker is never stuck publishing.
+            for event in events:
+                if self._input_slots is not None:
+                    await self._input_slots.acquire()
+                await self.broker.queue(PUBSUB_TOPIC).put(("0", event, dict(INPUT_ATTRIBUTES)))
+                self.counts["documents"] += 1
+            # Each stage only publishes from inside a handler, so draining in order is enough.
+            for topic in (PUBSUB_TOPIC, PUBSUB_EXTRACTION_TOPIC, PUBSUB_EMBEDDING_TOPIC):
+                await self.broker.join(topic)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return time.perf_counter() - started
+
+
+async def run_pipeline(args) -> dict:
+    loop = asyncio.get_running_loop()
+    broker = MemoryBroker(loop, maxsize=args.queue_size, unbounded=(PUBSUB_TOPIC,))
+    set_broker(broker)
+    if args.blob_store == "memory":
+        store = MemoryBlobStore()
+        for event in ingestion_events(args.input, None, args.tenant):
+            data = (args.input / event["gcs_path"]).read_bytes()
+            store.write(GCS_BUCKET, event["gcs_path"], data)
+    else:
+        buckets = {GCS_BUCKET: str(args.input)} if args.input else {}
+        store = LocalBlobStore(args.workdir, buckets=buckets)
+    set_blob_store(store)
+
+    sink = args.output.open("w") if args.output else None
+    executor = ThreadPoolExecutor(
+        max_workers=args.extract_workers + args.chunk_workers, thread_name_prefix="pipeline"
+    )
+    try:
+        pipeline = Pipeline(broker, executor, sink, max_pending_input=args.queue_size)
+        elapsed = await pipeline.run(
+            ingestion_events(args.input, args.urls, args.tenant),
+            args.extract_workers,
+            args.chunk_workers,
+        )
+    finally:
+        executor.shutdown(wait=True)
+        if sink is not None:
+            sink.close()
+    return {**pipeline.counts, "elapsed_s": round(elapsed, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run extraction and chunking in one process.")
+    parser.add_argument("--input", type=Path, help="directory of PDFs (searched recursively)")
+    parser.add_argument("--urls", type=Path, help="file with one URL per line")
+    parser.add_argument("--tenant", default="default")
+    parser.add_argument("--output", type=Path, help="write chunk events here as NDJSON")
+    parser.add_argument("--blob-store", choices=["local", "memory"], default="local")
+    parser.add_argument("--workdir", default=LOCAL_BLOB_ROOT, help="local blob-store root")
+    parser.add_argument("--extract-workers", type=int, default=PIPELINE_EXTRACT_WORKERS)
+    parser.add_argument("--chunk-workers", type=int, default=PIPELINE_CHUNK_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=PIPELINE_QUEUE_SIZE)
+    args = parser.parse_args()
+    if not args.input and not args.urls:
+        parser.error("pass --input and/or --urls")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    summary = asyncio.run(run_pipeline(args))
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,35 @@
-from chunking import chunk_text
+from chunking import chunk_text, iter_blocks, iter_chunks
 
 from config import CHUNK_OVERLAP, CHUNK_SIZE
-from shared.pubsub.publisher import publish_event
+from shared.pubsub.publisher import publish_events
+from shared.storage.claim_check import has_structured_text, resolve_structured_text
 
 
 def process_text_message(payload: dict, output_topic: str):
     try:
         document_id = payload["document_id"]
         tenant_id = payload["tenant_id"]
-        text = payload["text"]
         chunk_size = payload.get("chunk_size", CHUNK_SIZE)
         chunk_overlap = payload.get("chunk_overlap", CHUNK_OVERLAP)
 
-        chunks = chunk_text(
-            text=text,
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            tenant_id=tenant_id,
-            document_id=document_id,
-        )
+        if has_structured_text(payload):
+            chunks = iter_chunks(
+                iter_blocks(resolve_structured_text(payload)),
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                tenant_id=tenant_id,
+                document_id=document_id,
+            )
+        else:
+            chunks = chunk_text(
+                text=payload["text"],
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                tenant_id=tenant_id,
+                document_id=document_id,
+            )
 
-        for chunk in chunks:
-            publish_event(output_topic, chunk)
+        publish_events(output_topic, chunks)
 
     except Exception as e:
         # In production, log or send to a DLQ
@@ -0,0 +1,241 @@
+"""
+Pipeline-wide metrics and document context.
+
+Counters, gauges and histograms are kept in-process and rendered in the Prometheus text
+format, either by ``start_metrics_server`` (worker services) or by a ``/metrics`` route
+(ingestion API). ``document_context`` tags log records (``%(document_id)s``) with the
+document being processed, and the id travels between services as a Pub/Sub attribute, so
+one document can be followed through every stage.
+"""
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+logger = logging.getLogger(__name__)
+
+_document_id: contextvars.ContextVar = contextvars.ContextVar("document_id", default="-")
+_service_name = "unknown"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Optional[Dict[str, str]] = None) -> str:
+        pairs = [("service", _service_name), *zip(self.label_names, key), *(extra or {}).items()]
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.kind}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        yield from super().render()
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{self._format_labels(key)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class _HistogramSeries:
+    __slots__ = ("bucket_counts", "total", "count")
+
+    def __init__(self, size: int):
+        self.bucket_counts = [0] * size
+        self.total = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Iterable[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], _HistogramSeries] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _HistogramSeries(len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series.bucket_counts[i] += 1
+            series.total += value
+            series.count += 1
+
+    def render(self):
+        yield from super().render()
+        with self._lock:
+            items = [
+                (key, list(s.bucket_counts), s.total, s.count) for key, s in self._series.items()
+            ]
+        for key, counts, total, count in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = self._format_labels(key, {"le": repr(float(bound))})
+                yield f"{self.name}_bucket{labels} {bucket_count}"
+            yield f"{self.name}_bucket{self._format_labels(key, {'le': '+Inf'})} {count}"
+            yield f"{self.name}_sum{self._format_labels(key)} {total}"
+            yield f"{self.name}_count{self._format_labels(key)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, description, label_names, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, description, label_names, **kwargs)
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name, description, label_names=()) -> Counter:
+        return self._get_or_create(Counter, name, description, label_names)
+
+    def gauge(self, name, description, label_names=()) -> Gauge:
+        return self._get_or_create(Gauge, name, description, label_names)
+
+    def histogram(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, description, label_names, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = [line for metric in metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "pipeline_stage_seconds", "Wall time per pipeline stage", ("stage", "outcome")
+)
+STAGE_BYTES = REGISTRY.counter("pipeline_stage_bytes_total", "Bytes moved per stage", ("stage",))
+DOCUMENTS = REGISTRY.counter("pipeline_documents_total", "Documents handled", ("kind", "outcome"))
+
+
+def configure(service_name: str):
+    """Set the ``service`` label reported on every metric."""
+    global _service_name
+    _service_name = service_name
+
+
+def _install_log_record_factory():
+    factory = logging.getLogRecordFactory()
+    if getattr(factory, "_adds_document_id", False):
+        return
+
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        record.document_id = _document_id.get()
+        return record
+
+    record_factory._adds_document_id = True
+    logging.setLogRecordFactory(record_factory)
+
+
+# Installed at import so log formats may reference %(document_id)s unconditionally.
+_install_log_record_factory()
+
+
+def current_document_id() -> str:
+    return _document_id.get()
+
+
+@contextmanager
+def document_context(document_id: Optional[str]):
+    token = _document_id.set(document_id or "-")
+    try:
+        yield
+    finally:
+        _document_id.reset(token)
+
+
+@contextmanager
+def stage_timer(stage: str, nbytes: Optional[int] = None):
+    """Time a stage into ``pipeline_stage_seconds`` with outcome ok/error."""
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage, outcome=outcome)
+        if nbytes:
+            STAGE_BYTES.inc(nbytes, stage=stage)
+        logger.info("stage=%s outcome=%s seconds=%.3f", stage, outcome, elapsed)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """Serve ``/metrics`` on a daemon thread for services that have no HTTP server of their own."""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,350 @@
+"""
+Opt-in profiling for message handlers.
+
+With ``PROFILE_ENABLED`` unset, ``profiled`` returns the handler unchanged, so there is no
+cost at all. When enabled, each call is either
+
+* sampled (probability ``PROFILE_SAMPLE_RATE``) and run under cProfile, dumping a ``.pstats``
+  file, or
+* watched by a low-rate stack sampler; if it runs longer than ``PROFILE_SLOW_SECONDS`` the
+  collected stacks are dumped as a ``.collapsed`` file (flamegraph.pl / speedscope format).
+
+Dumps are named ``<document_id>_<stage>_<timestamp>`` and go to ``PROFILE_OUTPUT``, a local
+directory or a ``gs://bucket/prefix``. The ``PROFILE_TOP_N`` slowest documents are kept with
+their per-function breakdown in ``slowest.json`` next to the dumps.
+
+Both profilers watch the thread that runs the handler. Tasks that thread hands to a process
+pool through ``submit_to_pool`` (the extractor's page ranges and OCR pages) are profiled in the
+worker the same way, and their stats are merged into the handler's dump and breakdown: pstats
+are added up, sampled stacks are filed under a ``<worker process>`` root frame. Worker time is
+CPU time summed over workers, so it can exceed the handler's wall time.
+"""
+import collections
+import cProfile
+import functools
+import heapq
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from concurrent.futures import Executor, Future
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from config import (PROFILE_ENABLED, PROFILE_OUTPUT, PROFILE_SAMPLE_INTERVAL_MS,
+                    PROFILE_SAMPLE_RATE, PROFILE_SLOW_SECONDS, PROFILE_TOP_N)
+from shared.instrumentation import current_document_id
+
+logger = logging.getLogger(__name__)
+
+BREAKDOWN_SIZE = 15
+WORKER_FRAME = "<worker process>"
+SCOPE = (
+    "handler thread plus the process-pool tasks it submitted (summed CPU time across workers); "
+    "other threads are not included"
+)
+
+# The profiler ("cprofile" or "stacks") of the handler running on this thread, and the stats
+# its pool tasks sent back.
+_active = threading.local()
+
+
+class _StackSampler:
+    """
+    One daemon thread that periodically snapshots the stacks of registered threads. It only
+    walks threads that are inside a profiled handler, so idle cost is a sleep loop.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._watched: Dict[int, collections.Counter] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, thread_id: int) -> collections.Counter:
+        stacks = collections.Counter()
+        with self._lock:
+            self._watched[thread_id] = stacks
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="profile-sampler", daemon=True
+                )
+                self._thread.start()
+        return stacks
+
+    def unwatch(self, thread_id: int):
+        with self._lock:
+            self._watched.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                watched = dict(self._watched)
+            if not watched:
+                continue
+            frames = sys._current_frames()
+            for thread_id, stacks in watched.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks[_collapse(frame)] += 1
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _WorkerStats:
+    """A worker's raw stats dict in the shape ``pstats.Stats.add`` loads."""
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def _pstats_breakdown(stats: pstats.Stats) -> List[dict]:
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+    return [
+        {
+            "function": f"{os.path.basename(filename)}:{line}({name})",
+            "calls": calls,
+            "self_seconds": round(tottime, 4),
+            "cumulative_seconds": round(cumtime, 4),
+        }
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in rows[:BREAKDOWN_SIZE]
+    ]
+
+
+def _stack_breakdown(stacks: collections.Counter, interval: float) -> List[dict]:
+    inclusive = collections.Counter()
+    exclusive = collections.Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        exclusive[frames[-1]] += count
+        for name in set(frames):
+            inclusive[name] += count
+    return [
+        {
+            "function": name,
+            "self_seconds": round(exclusive[name] * interval, 4),
+            "cumulative_seconds": round(count * interval, 4),
+        }
+        for name, count in inclusive.most_common(BREAKDOWN_SIZE)
+    ]
+
+
+class _Sink:
+    """Writes dumps to a local directory or a ``gs://bucket/prefix``."""
+
+    def __init__(self, output: str):
+        self.output = output.rstrip("/")
+
+    def write(self, name: str, data: bytes):
+        if self.output.startswith("gs://"):
+            from shared.storage.gcs_client import get_storage_client
+
+            bucket, _, prefix = self.output[len("gs://"):].partition("/")
+            blob_name = f"{prefix}/{name}" if prefix else name
+            get_storage_client().bucket(bucket).blob(blob_name).upload_from_string(data)
+        else:
+            os.makedirs(self.output, exist_ok=True)
+            with open(os.path.join(self.output, name), "wb") as f:
+                f.write(data)
+        return f"{self.output}/{name}"
+
+
+class _SlowestDocuments:
+    """Bounded min-heap of the slowest handler calls seen by this process."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._heap: list = []
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def offer(self, seconds: float, entry: dict) -> bool:
+        with self._lock:
+            self._counter += 1
+            item = (seconds, self._counter, entry)
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, item)
+            elif seconds > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+            else:
+                return False
+            return True
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            return [entry for _, _, entry in sorted(self._heap, reverse=True)]
+
+
+_sampler = _StackSampler(PROFILE_SAMPLE_INTERVAL_MS / 1000)
+_sink = _Sink(PROFILE_OUTPUT)
+_slowest = _SlowestDocuments(PROFILE_TOP_N)
+
+
+def slowest_documents() -> List[dict]:
+    """The slowest profiled calls so far, slowest first."""
+    return _slowest.snapshot()
+
+
+def _record(stage: str, seconds: float, kind: str, data: bytes, breakdown: List[dict]):
+    document_id = current_document_id()
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    try:
+        location = _sink.write(f"{document_id}_{stage}_{timestamp}.{kind}", data)
+        logger.info("Profiled %s in %.3fs -> %s", stage, seconds, location)
+        entry = {
+            "document_id": document_id,
+            "stage": stage,
+            "seconds": round(seconds, 3),
+            "profile": location,
+            "scope": SCOPE,
+            "breakdown": breakdown,
+        }
+        if _slowest.offer(seconds, entry):
+            _sink.write("slowest.json", json.dumps(slowest_documents(), indent=2).encode("utf-8"))
+    except Exception:
+        logger.error("Could not write profile for %s", stage, exc_info=True)
+
+
+def _profile_call(mode: str, func: Callable, *args):
+    """
+    Process-pool entry point for ``submit_to_pool``: run ``func(*args)`` under the profiler
+    the submitting handler uses and return ``(result, stats)``, stats being a pstats dict for
+    ``"cprofile"`` and sampled stack counts for ``"stacks"``.
+    """
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return func(*args), None
+        try:
+            result = func(*args)
+        finally:
+            profiler.disable()
+        profiler.create_stats()
+        return result, profiler.stats
+    thread_id = threading.get_ident()
+    stacks = _sampler.watch(thread_id)
+    try:
+        result = func(*args)
+    finally:
+        _sampler.unwatch(thread_id)
+    return result, dict(stacks)
+
+
+def submit_to_pool(pool: Executor, func: Callable, *args) -> Future:
+    """
+    ``pool.submit(func, *args)``; if the calling thread is running a profiled handler, the task
+    is profiled inside the worker and its stats are merged into that handler's profile. The
+    handler must wait for the returned future before it returns.
+    """
+    mode = getattr(_active, "mode", None)
+    if mode is None:
+        return pool.submit(func, *args)
+    collected = _active.worker_stats
+    outer: Future = Future()
+
+    def done(inner: Future):
+        try:
+            result, stats = inner.result()
+        except BaseException as error:
+            outer.set_exception(error)
+            return
+        if stats:
+            collected.append(stats)
+        outer.set_result(result)
+
+    pool.submit(_profile_call, mode, func, *args).add_done_callback(done)
+    return outer
+
+
+def _start_collecting(mode: str) -> list:
+    _active.mode = mode
+    _active.worker_stats = []
+    return _active.worker_stats
+
+
+def _stop_collecting():
+    _active.mode = _active.worker_stats = None
+
+
+def _run_with_cprofile(func: Callable, stage: str, args, kwargs):
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active in this interpreter (one at a time on 3.12+).
+        return func(*args, **kwargs)
+    worker_stats = _start_collecting("cprofile")
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        seconds = time.perf_counter() - started
+        _stop_collecting()
+        stats = pstats.Stats(profiler, stream=io.StringIO())
+        for worker in worker_stats:
+            stats.add(_WorkerStats(worker))
+        breakdown = _pstats_breakdown(stats)
+        _record(stage, seconds, "pstats", marshal.dumps(stats.stats), breakdown)
+
+
+def _run_with_sampler(func: Callable, stage: str, args, kwargs):
+    thread_id = threading.get_ident()
+    stacks = _sampler.watch(thread_id)
+    worker_stats = _start_collecting("stacks")
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - started
+        _sampler.unwatch(thread_id)
+        _stop_collecting()
+        for worker in worker_stats:
+            for stack, count in worker.items():
+                stacks[f"{WORKER_FRAME};{stack}"] += count
+        if PROFILE_SLOW_SECONDS and seconds >= PROFILE_SLOW_SECONDS and stacks:
+            collapsed = "\n".join(f"{stack} {count}" for stack, count in stacks.items())
+            breakdown = _stack_breakdown(stacks, _sampler.interval)
+            _record(stage, seconds, "collapsed", collapsed.encode("utf-8"), breakdown)
+
+
+def profiled(stage: str):
+    """
+    Decorate a message handler so it can be profiled. Returns the function untouched when
+    ``PROFILE_ENABLED`` is off.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        if not PROFILE_ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+                return _run_with_cprofile(func, stage, args, kwargs)
+            if PROFILE_SLOW_SECONDS:
+                return _run_with_sampler(func, stage, args, kwargs)
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
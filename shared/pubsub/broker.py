@@ -0,0 +1,110 @@
+"""
+Message-broker backends behind ``publisher.publish_event*``.
+
+Services publish through ``get_broker()``, which is Pub/Sub unless something else has been
+installed with ``set_broker``. ``MemoryBroker`` keeps one bounded asyncio queue per topic; the
+in-process pipeline uses it to pass payload dicts between stages without serialising them.
+"""
+import asyncio
+import itertools
+import threading
+from abc import ABC, abstractmethod
+from concurrent import futures
+from typing import Dict, Iterable, Optional
+
+
+class Broker(ABC):
+    @abstractmethod
+    def publish(self, topic: str, payload: dict, **attributes) -> futures.Future:
+        """Queue ``payload`` on ``topic``; the future resolves to a message id."""
+
+    def flush(self):
+        """Send anything buffered and release resources."""
+
+
+class MemoryBroker(Broker):
+    """
+    One bounded ``asyncio.Queue`` per topic, owned by ``loop``. ``publish`` may be called from
+    any thread (handlers run on executors); when a queue is full the returned future stays
+    pending, so a synchronous publisher waiting on it is held back until consumers catch up.
+    Topics in ``unbounded`` never hold a publisher back; use them where a topic's own consumers
+    publish onto it, which a full queue would deadlock.
+    """
+
+    def __init__(
+        self, loop: asyncio.AbstractEventLoop, maxsize: int = 0, unbounded: Iterable[str] = ()
+    ):
+        self.loop = loop
+        self.maxsize = maxsize
+        self.unbounded = frozenset(unbounded)
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._ids = itertools.count(1)
+
+    def queue(self, topic: str) -> asyncio.Queue:
+        """The topic's queue; only touch it from the event loop thread."""
+        if topic not in self._queues:
+            maxsize = 0 if topic in self.unbounded else self.maxsize
+            self._queues[topic] = asyncio.Queue(maxsize=maxsize)
+        return self._queues[topic]
+
+    async def _put(self, topic: str, message: tuple) -> str:
+        await self.queue(topic).put(message)
+        return message[0]
+
+    def publish(self, topic, payload, **attributes):
+        message = (str(next(self._ids)), payload, attributes)
+        coroutine = self._put(topic, message)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            # Called on the loop itself: schedule the put and bridge its result.
+            return _chain(asyncio.ensure_future(coroutine))
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def get(self, topic: str) -> tuple:
+        """Next ``(message_id, payload, attributes)``; call ``task_done(topic)`` when handled."""
+        return await self.queue(topic).get()
+
+    def task_done(self, topic: str):
+        self.queue(topic).task_done()
+
+    async def join(self, topic: str):
+        await self.queue(topic).join()
+
+
+def _chain(task: asyncio.Future) -> futures.Future:
+    future = futures.Future()
+
+    def done(t: asyncio.Future):
+        if t.cancelled():
+            future.cancel()
+        elif t.exception() is not None:
+            future.set_exception(t.exception())
+        else:
+            future.set_result(t.result())
+
+    task.add_done_callback(done)
+    return future
+
+
+_broker: Optional[Broker] = None
+_broker_lock = threading.Lock()
+
+
+def get_broker() -> Broker:
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                from shared.pubsub.publisher import PubSubBroker
+
+                _broker = PubSubBroker()
+    return _broker
+
+
+def set_broker(broker: Optional[Broker]):
+    """Install a broker for this process (None goes back to Pub/Sub)."""
+    global _broker
+    _broker = broker
@@ -0,0 +1,280 @@
+"""
+Local scheduling between message receipt and the handler.
+
+Leased messages are queued per tenant and per lane (``small`` / ``large``) and handed to
+worker threads in start-time fair queuing order: every job gets a virtual start tag
+``max(lane clock, tenant's last finish tag)`` and a finish tag ``start + cost / weight``, and
+the job with the lowest start tag among tenants below their concurrency cap runs next. A
+tenant with 5,000 queued documents therefore advances its own clock, not everyone's, and a
+tenant that just arrived is served next. Small jobs have their own workers, so a short
+invoice never waits behind a long OCR job; large-lane workers take small jobs when idle.
+
+Every queued job holds a leased message, and flow control caps how many are leased. The
+queues are therefore bounded: ``submit`` refuses a job when its lane already has
+``max_queued[lane]`` waiting, or when a capped tenant already has as many jobs waiting as it
+may run, and the caller holds the message outside the lease window and offers it again later
+(``shared.pubsub.holding``). Large jobs and jobs of a throttled tenant can then never take up
+the whole window. A job that waited longer than ``max_wait`` is not run either: ``expire`` is
+called instead, while its lease is still held, rather than running it after Pub/Sub has
+given up on the lease and redelivered it.
+"""
+import collections
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional
+
+from shared.instrumentation import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LANES = ("small", "large")
+WAIT_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400)
+
+QUEUE_DEPTH = REGISTRY.gauge(
+    "scheduler_queue_depth", "Jobs waiting per tenant and lane", ("tenant", "lane")
+)
+IN_FLIGHT = REGISTRY.gauge("scheduler_in_flight", "Jobs running per tenant", ("tenant",))
+REJECTED = REGISTRY.counter(
+    "scheduler_rejected_total", "Jobs refused a queue slot or expired", ("tenant", "reason")
+)
+WAIT_SECONDS = REGISTRY.histogram(
+    "scheduler_wait_seconds",
+    "Time from receipt to start per tenant and lane",
+    ("tenant", "lane"),
+    buckets=WAIT_BUCKETS,
+)
+
+
+@dataclass
+class Job:
+    tenant: str
+    lane: str
+    cost: float
+    run: Callable[[], None]
+    expire: Optional[Callable[[], None]] = None
+    enqueued: float = field(default_factory=time.monotonic)
+    start_tag: float = 0.0
+
+
+class _Lane:
+    def __init__(self):
+        self.queues: Dict[str, Deque[Job]] = collections.defaultdict(collections.deque)
+        self.finish_tags: Dict[str, float] = {}
+        self.clock = 0.0
+
+    def push(self, job: Job, weight: float):
+        job.start_tag = max(self.clock, self.finish_tags.get(job.tenant, 0.0))
+        self.finish_tags[job.tenant] = job.start_tag + job.cost / weight
+        self.queues[job.tenant].append(job)
+
+    def pop(self, eligible: Callable[[str], bool]) -> Optional[Job]:
+        best: Optional[Job] = None
+        for tenant, queue in self.queues.items():
+            if queue and eligible(tenant) and (best is None or queue[0].start_tag < best.start_tag):
+                best = queue[0]
+        if best is None:
+            return None
+        queue = self.queues[best.tenant]
+        queue.popleft()
+        if not queue:
+            del self.queues[best.tenant]
+        self.clock = best.start_tag
+        self._forget_if_idle()
+        return best
+
+    def _forget_if_idle(self):
+        if not self.queues:
+            # Idle lane: forget history so a tenant is not penalised for earlier bursts.
+            self.finish_tags.clear()
+
+    def take_expired(self, enqueued_before: float) -> List[Job]:
+        """Remove and return jobs queued before ``enqueued_before`` (queues are FIFO per tenant)."""
+        expired = []
+        for tenant in list(self.queues):
+            queue = self.queues[tenant]
+            while queue and queue[0].enqueued < enqueued_before:
+                expired.append(queue.popleft())
+            if not queue:
+                del self.queues[tenant]
+        self._forget_if_idle()
+        return expired
+
+
+class FairScheduler:
+    """
+    ``workers`` maps each lane to its thread count. ``weights`` and ``max_concurrency`` are
+    per-tenant overrides of ``default_weight`` and ``default_max_concurrency`` (0 = no cap).
+    ``max_queued`` bounds the jobs waiting per lane and ``max_wait`` how long one may wait,
+    in seconds (0 = unbounded for both).
+    """
+
+    def __init__(
+        self,
+        workers: Dict[str, int],
+        weights: Optional[Dict[str, float]] = None,
+        max_concurrency: Optional[Dict[str, int]] = None,
+        default_weight: float = 1.0,
+        default_max_concurrency: int = 0,
+        max_queued: Optional[Dict[str, int]] = None,
+        max_wait: float = 0,
+    ):
+        self.workers = workers
+        self.weights = weights or {}
+        self.max_concurrency = max_concurrency or {}
+        self.default_weight = default_weight
+        self.default_max_concurrency = default_max_concurrency
+        self.max_queued = max_queued or {}
+        self.max_wait = max_wait
+        self._lanes = {lane: _Lane() for lane in LANES}
+        self._in_flight: Dict[str, int] = collections.defaultdict(int)
+        self._queued: Dict[str, int] = collections.defaultdict(int)  # per tenant, all lanes
+        self._lane_depth: Dict[str, int] = collections.defaultdict(int)
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._threads: List[threading.Thread] = []
+        for lane in LANES:
+            for index in range(workers.get(lane, 0)):
+                thread = threading.Thread(
+                    target=self._work, args=(lane,), name=f"sched-{lane}-{index}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        if max_wait:
+            # Jobs of a tenant at its cap are not popped, so they are swept for expiry here.
+            thread = threading.Thread(target=self._sweep, name="sched-sweep", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _weight(self, tenant: str) -> float:
+        return self.weights.get(tenant, self.default_weight) or self.default_weight
+
+    def _cap(self, tenant: str) -> int:
+        return self.max_concurrency.get(tenant, self.default_max_concurrency)
+
+    def _eligible(self, tenant: str) -> bool:
+        cap = self._cap(tenant)
+        return not cap or self._in_flight[tenant] < cap
+
+    def _overflow(self, tenant: str, lane: str) -> Optional[str]:
+        limit = self.max_queued.get(lane, 0)
+        if limit and self._lane_depth[lane] >= limit:
+            return "lane_full"
+        cap = self._cap(tenant)
+        if cap and self._queued[tenant] >= cap:
+            return "tenant_full"
+        return None
+
+    def submit(
+        self,
+        tenant: str,
+        lane: str,
+        cost: float,
+        run: Callable[[], None],
+        expire: Optional[Callable[[], None]] = None,
+    ) -> bool:
+        """
+        Queue ``run``; False if the queue for it is full and the job was not taken. ``expire``
+        is called instead of ``run`` if the job is still waiting after ``max_wait``.
+        """
+        # Without workers of its own (e.g. a single-worker setup) a job runs on the small lane.
+        lane = lane if self.workers.get(lane) else "small"
+        job = Job(tenant=tenant, lane=lane, cost=max(cost, 1.0), run=run, expire=expire)
+        with self._condition:
+            reason = self._overflow(tenant, lane)
+            if reason is not None:
+                REJECTED.inc(tenant=tenant, reason=reason)
+                return False
+            self._lanes[lane].push(job, self._weight(tenant))
+            self._queued[tenant] += 1
+            self._lane_depth[lane] += 1
+            QUEUE_DEPTH.inc(tenant=tenant, lane=lane)
+            self._condition.notify_all()
+        return True
+
+    def _dequeued(self, job: Job):
+        self._queued[job.tenant] -= 1
+        if not self._queued[job.tenant]:
+            del self._queued[job.tenant]
+        self._lane_depth[job.lane] -= 1
+
+    def _next(self, lane: str) -> Optional[Job]:
+        job = self._lanes[lane].pop(self._eligible)
+        if job is None and lane == "large":
+            job = self._lanes["small"].pop(self._eligible)
+        if job is not None:
+            self._dequeued(job)
+        return job
+
+    def _sweep(self):
+        interval = min(self.max_wait / 4, 30.0)
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+                self._condition.wait(interval)
+                cutoff = time.monotonic() - self.max_wait
+                expired = []
+                for state in self._lanes.values():
+                    expired.extend(state.take_expired(cutoff))
+                for job in expired:
+                    self._dequeued(job)
+            for job in expired:
+                QUEUE_DEPTH.dec(tenant=job.tenant, lane=job.lane)
+                self._expire(job)
+
+    def _expire(self, job: Job):
+        REJECTED.inc(tenant=job.tenant, reason="expired")
+        logger.warning(
+            "Job for tenant %s waited over %ss; expiring it", job.tenant, self.max_wait
+        )
+        if job.expire is not None:
+            try:
+                job.expire()
+            except Exception:
+                logger.error("Expiring job for tenant %s failed", job.tenant, exc_info=True)
+
+    def _work(self, lane: str):
+        while True:
+            with self._condition:
+                job = self._next(lane)
+                while job is None and not self._stopped:
+                    self._condition.wait()
+                    job = self._next(lane)
+                if job is None:
+                    return
+                waited = time.monotonic() - job.enqueued
+                expired = bool(self.max_wait) and waited > self.max_wait
+                if not expired:
+                    self._in_flight[job.tenant] += 1
+            QUEUE_DEPTH.dec(tenant=job.tenant, lane=job.lane)
+            if expired:
+                self._expire(job)
+                continue
+            IN_FLIGHT.inc(tenant=job.tenant)
+            WAIT_SECONDS.observe(waited, tenant=job.tenant, lane=job.lane)
+            try:
+                job.run()
+            except Exception:
+                logger.error("Scheduled job for tenant %s failed", job.tenant, exc_info=True)
+            finally:
+                IN_FLIGHT.dec(tenant=job.tenant)
+                with self._condition:
+                    self._in_flight[job.tenant] -= 1
+                    # A tenant at its cap may have become eligible again.
+                    self._condition.notify_all()
+
+    def depth(self) -> Dict[str, Dict[str, int]]:
+        """Queued jobs per lane and tenant."""
+        with self._condition:
+            return {
+                lane: {tenant: len(queue) for tenant, queue in state.queues.items()}
+                for lane, state in self._lanes.items()
+            }
+
+    def stop(self):
+        """Let workers exit once their current job is done; queued jobs are dropped."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
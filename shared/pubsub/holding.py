@@ -0,0 +1,96 @@
+"""
+Messages the scheduler could not queue yet, held on this replica instead of nacked.
+
+Pub/Sub counts every nack (and every lapsed lease) as a delivery attempt, so handing a
+throttled tenant's message back would move it towards the dead-letter topic without it ever
+having run. Instead, up to ``max_held`` messages are dropped from the client's lease
+management, which frees their flow-control slots for other work, and their ack deadlines are
+extended here until ``release``. Beyond that a held message keeps its slot, so intake slows
+down until the scheduler catches up. Held messages are offered to the scheduler again every
+``retry_seconds``, oldest first.
+"""
+import collections
+import logging
+import threading
+import time
+from typing import Callable, Deque, Dict, Tuple
+
+from google.cloud.pubsub_v1.subscriber.message import Message
+
+from shared.instrumentation import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+HELD = REGISTRY.gauge(
+    "pubsub_held_messages", "Messages waiting on this replica for a queue slot", ("subscription",)
+)
+
+
+class HeldMessages:
+    def __init__(
+        self,
+        subscription: str,
+        max_held: int,
+        retry_seconds: float = 5.0,
+        ack_deadline: int = 60,
+    ):
+        self.subscription = subscription
+        self.max_held = max_held
+        self.retry_seconds = retry_seconds
+        self.ack_deadline = ack_deadline
+        self._waiting: Deque[Tuple[Message, Callable[[], bool]]] = collections.deque()
+        self._leased: Dict[str, Message] = {}
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="pubsub-held", daemon=True)
+        self._thread.start()
+
+    def hold(self, message: Message, offer: Callable[[], bool]):
+        """Keep ``message`` leased until ``offer()`` gets it a queue slot (returns True)."""
+        with self._condition:
+            if message.message_id not in self._leased and len(self._leased) < self.max_held:
+                message.modify_ack_deadline(self.ack_deadline)
+                message.drop()
+                self._leased[message.message_id] = message
+            self._waiting.append((message, offer))
+            HELD.set(len(self._waiting), subscription=self.subscription)
+
+    def release(self, message: Message):
+        """Stop extending the lease of a message that has been acked or nacked."""
+        with self._condition:
+            self._leased.pop(message.message_id, None)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def _run(self):
+        extended = time.monotonic()
+        while True:
+            with self._condition:
+                self._condition.wait(self.retry_seconds)
+                if self._stopped:
+                    return
+                waiting = list(self._waiting)
+                self._waiting.clear()
+            refused = [(message, offer) for message, offer in waiting if not self._offer(offer)]
+            with self._condition:
+                self._waiting.extendleft(reversed(refused))
+                HELD.set(len(self._waiting), subscription=self.subscription)
+                leased = list(self._leased.values())
+            # Dropped messages (waiting, queued or running) are only kept alive from here.
+            if time.monotonic() - extended >= self.ack_deadline / 3:
+                extended = time.monotonic()
+                for message in leased:
+                    try:
+                        message.modify_ack_deadline(self.ack_deadline)
+                    except Exception:
+                        logger.error("Could not extend lease of %s", message.message_id)
+
+    def _offer(self, offer: Callable[[], bool]) -> bool:
+        try:
+            return offer()
+        except Exception:
+            logger.error("Re-offering a held message failed", exc_info=True)
+            return False
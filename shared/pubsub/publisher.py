@@ -1,13 +1,122 @@
+import atexit
 import json
+import logging
+import threading
+import time
+from concurrent import futures
+from typing import Iterable, List, Optional
 
 from google.cloud import pubsub_v1
 
-from config import GCP_PROJECT
+from config import (GCP_PROJECT, PUBSUB_BATCH_MAX_BYTES, PUBSUB_BATCH_MAX_LATENCY,
+                    PUBSUB_BATCH_MAX_MESSAGES, PUBSUB_PUBLISH_TIMEOUT)
+from shared.instrumentation import REGISTRY, current_document_id
+from shared.pubsub.broker import Broker, get_broker
 
+logger = logging.getLogger(__name__)
 
-def publish_event(topic: str, payload: dict):
-    print(f"[DEBUG] Publishing message to {topic}: {payload}")
-    publisher = pubsub_v1.PublisherClient()
-    topic_path = publisher.topic_path(GCP_PROJECT, topic)
-    future = publisher.publish(topic_path, data=json.dumps(payload).encode("utf-8"))
-    return future.result()
+PUBLISHED = REGISTRY.counter("pubsub_published_total", "Messages published", ("topic", "outcome"))
+PUBLISH_SECONDS = REGISTRY.histogram(
+    "pubsub_publish_seconds", "Time from publish() to server ack", ("topic",)
+)
+
+_publisher: Optional[pubsub_v1.PublisherClient] = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher() -> pubsub_v1.PublisherClient:
+    """Return the process-wide publisher, creating it on first use."""
+    global _publisher
+    if _publisher is None:
+        with _publisher_lock:
+            if _publisher is None:
+                batch_settings = pubsub_v1.types.BatchSettings(
+                    max_messages=PUBSUB_BATCH_MAX_MESSAGES,
+                    max_bytes=PUBSUB_BATCH_MAX_BYTES,
+                    max_latency=PUBSUB_BATCH_MAX_LATENCY,
+                )
+                _publisher = pubsub_v1.PublisherClient(batch_settings=batch_settings)
+    return _publisher
+
+
+def _encode(payload: dict) -> bytes:
+    return json.dumps(payload).encode("utf-8")
+
+
+class PubSubBroker(Broker):
+    """The default broker: JSON over the shared batching Pub/Sub publisher."""
+
+    def publish(self, topic, payload, **attributes):
+        publisher = get_publisher()
+        topic_path = publisher.topic_path(GCP_PROJECT, topic)
+        return publisher.publish(topic_path, data=_encode(payload), **attributes)
+
+    def flush(self):
+        flush()
+
+
+def _observe_publish(topic: str, started: float):
+    def done(future: futures.Future):
+        outcome = "error" if future.exception() else "ok"
+        PUBLISHED.inc(topic=topic, outcome=outcome)
+        PUBLISH_SECONDS.observe(time.perf_counter() - started, topic=topic)
+
+    return done
+
+
+def publish_event_async(topic: str, payload: dict, **attributes) -> futures.Future:
+    """Queue a message on the process's broker and return its future without waiting."""
+    # Carry the document id as an attribute so consumers can tag their logs before decoding.
+    document_id = (
+        payload.get("document_id")
+        or payload.get("file_id")
+        or payload.get("url_id")
+        or current_document_id()
+    )
+    if document_id != "-" and "document_id" not in attributes:
+        attributes["document_id"] = str(document_id)
+    started = time.perf_counter()
+    future = get_broker().publish(topic, payload, **attributes)
+    future.add_done_callback(_observe_publish(topic, started))
+    return future
+
+
+def publish_event(topic: str, payload: dict, **attributes):
+    logger.debug("Publishing message to %s", topic)
+    future = publish_event_async(topic, payload, **attributes)
+    return future.result(timeout=PUBSUB_PUBLISH_TIMEOUT)
+
+
+def publish_events(topic: str, payloads: Iterable[dict], wait: bool = True) -> List:
+    """
+    Publish many messages through the batching publisher.
+
+    Messages are queued as the iterable is consumed, so the client library groups them
+    into batches in the background. With ``wait=True`` the call blocks until every
+    future resolves and returns the message IDs; otherwise the futures are returned.
+    """
+    pending = [publish_event_async(topic, payload) for payload in payloads]
+    logger.info("Queued %d messages for %s", len(pending), topic)
+    if not wait:
+        return pending
+
+    done, not_done = futures.wait(pending, timeout=PUBSUB_PUBLISH_TIMEOUT)
+    if not_done:
+        raise TimeoutError(f"{len(not_done)} of {len(pending)} publishes to {topic} timed out")
+    return [future.result() for future in pending]
+
+
+def flush():
+    """Send any buffered batches and release the shared publisher."""
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            return
+        try:
+            _publisher.stop()
+        except Exception:
+            logger.error("Failed to flush Pub/Sub publisher", exc_info=True)
+        _publisher = None
+
+
+atexit.register(flush)
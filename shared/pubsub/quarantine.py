@@ -0,0 +1,83 @@
+import json
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+from config import DEAD_LETTER_TOPIC, GCS_BUCKET, QUARANTINE_BACKEND, QUARANTINE_GCS_PREFIX
+from shared.pubsub.publisher import publish_event
+from shared.storage.blob_store import get_blob_store
+
+logger = logging.getLogger(__name__)
+
+
+class PoisonMessage(Exception):
+    """Raised by a handler for a message that can never succeed; it is quarantined at once."""
+
+
+class AttemptTracker:
+    """
+    Delivery attempts per message. Pub/Sub reports ``delivery_attempt`` only when the
+    subscription has a dead-letter policy; otherwise we count locally (bounded LRU), which
+    is exact as long as redeliveries come back to this replica.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self._attempts: "OrderedDict[str, int]" = OrderedDict()
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def _bump(self, counts: "OrderedDict[str, int]", message_id: str, value: int) -> int:
+        counts[message_id] = value
+        counts.move_to_end(message_id)
+        while len(counts) > self._max_entries:
+            counts.popitem(last=False)
+        return value
+
+    def record(self, message_id: str, delivery_attempt: Optional[int] = None) -> int:
+        with self._lock:
+            attempt = max(delivery_attempt or 0, self._attempts.get(message_id, 0) + 1)
+            return self._bump(self._attempts, message_id, attempt)
+
+    def forget(self, message_id: str):
+        with self._lock:
+            self._attempts.pop(message_id, None)
+
+
+def quarantine_message(
+    message_id: str,
+    subscription: str,
+    topic: str,
+    data: bytes,
+    attributes: dict,
+    reason: str,
+    attempts: int,
+    error_traceback: str = "",
+) -> str:
+    """
+    Park a message that keeps failing, with the failure reason, on the dead-letter topic or
+    under a prefix of the blob store (GCS unless ``BLOB_STORE_BACKEND`` says otherwise). Returns
+    where it went.
+    """
+    record = {
+        "message_id": message_id,
+        "subscription": subscription,
+        "original_topic": topic,
+        "data": data.decode("utf-8", errors="replace"),
+        "attributes": dict(attributes or {}),
+        "reason": reason,
+        "traceback": error_traceback,
+        "attempts": attempts,
+        "quarantined_at": datetime.now(timezone.utc).isoformat(),
+    }
+    if QUARANTINE_BACKEND == "gcs":
+        blob_name = f"{QUARANTINE_GCS_PREFIX}/{subscription}/{message_id}.json"
+        store = get_blob_store()
+        store.write(GCS_BUCKET, blob_name, json.dumps(record).encode("utf-8"), "application/json")
+        location = store.url(GCS_BUCKET, blob_name)
+    else:
+        publish_event(DEAD_LETTER_TOPIC, record, original_topic=topic)
+        location = f"topic:{DEAD_LETTER_TOPIC}"
+    logger.warning("Quarantined message %s after %d attempts to %s", message_id, attempts, location)
+    return location
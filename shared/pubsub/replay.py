@@ -0,0 +1,169 @@
+"""
+Replay quarantined messages back onto the topic they came from.
+
+The dead-letter subscription carries two kinds of message: envelopes written by
+``quarantine_message`` (with ``original_topic``, reason and traceback), and raw messages the
+subscription's own dead-letter policy forwarded, e.g. from a replica that died mid-message.
+For the latter the topic is looked up from the source subscription Pub/Sub records on them.
+
+    python -m shared.pubsub.replay                         # drain the dead-letter subscription
+    python -m shared.pubsub.replay --backend gcs --limit 10
+    python -m shared.pubsub.replay --dry-run
+"""
+import argparse
+import itertools
+import json
+import logging
+from typing import Dict, Optional
+
+from google.cloud import pubsub_v1
+
+from config import (DEAD_LETTER_SUBSCRIPTION, GCP_PROJECT, GCS_BUCKET, QUARANTINE_BACKEND,
+                    QUARANTINE_GCS_PREFIX)
+from shared.pubsub.publisher import get_publisher
+from shared.storage.blob_store import get_blob_store
+
+logger = logging.getLogger(__name__)
+
+# Set by Pub/Sub on messages forwarded by a dead-letter policy.
+DEAD_LETTER_ATTRIBUTE_PREFIX = "CloudPubSubDeadLetter"
+SOURCE_SUBSCRIPTION_ATTRIBUTE = "CloudPubSubDeadLetterSourceSubscription"
+
+
+def _envelope(data: bytes) -> Optional[dict]:
+    try:
+        record = json.loads(data)
+    except ValueError:
+        return None
+    if isinstance(record, dict) and "original_topic" in record and "data" in record:
+        return record
+    return None
+
+
+class _TopicResolver:
+    """Topic of a subscription, cached; Pub/Sub only records the source subscription."""
+
+    def __init__(self, subscriber: pubsub_v1.SubscriberClient, fallback: Optional[str]):
+        self._subscriber = subscriber
+        self._fallback = fallback
+        self._topics: Dict[str, Optional[str]] = {}
+
+    def __call__(self, subscription: Optional[str]) -> Optional[str]:
+        if not subscription:
+            return self._fallback
+        if subscription not in self._topics:
+            path = subscription
+            if not path.startswith("projects/"):
+                path = self._subscriber.subscription_path(GCP_PROJECT, subscription)
+            try:
+                topic = self._subscriber.get_subscription(request={"subscription": path}).topic
+                self._topics[subscription] = topic.rsplit("/", 1)[-1]
+            except Exception as e:
+                logger.error("Cannot resolve the topic of %s: %s", subscription, e)
+                self._topics[subscription] = self._fallback
+        return self._topics[subscription]
+
+
+def _dead_letter_record(message, resolve_topic: _TopicResolver) -> dict:
+    """The quarantine envelope, or an equivalent one around a message Pub/Sub forwarded."""
+    record = _envelope(message.data)
+    if record is not None:
+        return record
+    attributes = dict(message.attributes)
+    source = attributes.get(SOURCE_SUBSCRIPTION_ATTRIBUTE)
+    return {
+        "message_id": message.message_id,
+        "subscription": source,
+        "original_topic": resolve_topic(source),
+        "data": message.data.decode("utf-8", errors="replace"),
+        "attributes": {
+            key: value
+            for key, value in attributes.items()
+            if not key.startswith(DEAD_LETTER_ATTRIBUTE_PREFIX)
+        },
+        "reason": "forwarded by the subscription's dead-letter policy",
+    }
+
+
+def _republish(record: dict, dry_run: bool) -> bool:
+    topic = record.get("original_topic")
+    if not topic:
+        logger.error("Quarantined message %s has no original_topic", record.get("message_id"))
+        return False
+    logger.info(
+        "Replaying %s to %s (reason: %s)", record.get("message_id"), topic, record.get("reason")
+    )
+    if dry_run:
+        return True
+    publisher = get_publisher()
+    attributes = {**record.get("attributes", {}), "replayed_from": record.get("message_id", "")}
+    publisher.publish(
+        publisher.topic_path(GCP_PROJECT, topic), record["data"].encode("utf-8"), **attributes
+    ).result()
+    return True
+
+
+def replay_from_topic(
+    subscription: str, limit: int, dry_run: bool, fallback_topic: Optional[str] = None
+) -> int:
+    subscriber = pubsub_v1.SubscriberClient()
+    sub_path = subscriber.subscription_path(GCP_PROJECT, subscription)
+    resolve_topic = _TopicResolver(subscriber, fallback_topic)
+    replayed = 0
+    with subscriber:
+        while replayed < limit:
+            response = subscriber.pull(
+                request={"subscription": sub_path, "max_messages": min(100, limit - replayed)},
+                timeout=30,
+            )
+            if not response.received_messages:
+                break
+            ack_ids = []
+            for received in response.received_messages:
+                record = _dead_letter_record(received.message, resolve_topic)
+                if _republish(record, dry_run):
+                    replayed += 1
+                    ack_ids.append(received.ack_id)
+            if ack_ids and not dry_run:
+                subscriber.acknowledge(request={"subscription": sub_path, "ack_ids": ack_ids})
+            if dry_run:
+                break
+    return replayed
+
+
+def replay_from_gcs(prefix: str, limit: int, dry_run: bool, keep: bool) -> int:
+    """Replay records ``quarantine_message`` left under ``prefix`` in the blob store."""
+    store = get_blob_store()
+    replayed = 0
+    for name in itertools.islice(store.list(GCS_BUCKET, f"{prefix}/"), limit):
+        record = json.loads(store.read(GCS_BUCKET, name))
+        if _republish(record, dry_run):
+            replayed += 1
+            if not dry_run and not keep:
+                store.delete(GCS_BUCKET, name)
+    return replayed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay quarantined Pub/Sub messages.")
+    parser.add_argument("--backend", choices=["topic", "gcs"], default=QUARANTINE_BACKEND)
+    parser.add_argument("--subscription", default=DEAD_LETTER_SUBSCRIPTION)
+    parser.add_argument("--prefix", default=QUARANTINE_GCS_PREFIX)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="keep GCS records after replaying")
+    parser.add_argument(
+        "--topic", help="topic for forwarded messages whose source subscription is unknown"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    if args.backend == "gcs":
+        count = replay_from_gcs(args.prefix, args.limit, args.dry_run, args.keep)
+    else:
+        count = replay_from_topic(args.subscription, args.limit, args.dry_run, args.topic)
+    logger.info("Replayed %d message(s)%s", count, " (dry run)" if args.dry_run else "")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,23 @@
 import json
 import logging
+import multiprocessing
 import signal
 import sys
+import time
 import traceback
-from typing import Callable, Union
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional, Tuple, Union
 
 from google.cloud import pubsub_v1
 from google.cloud.pubsub_v1.subscriber.message import Message
+from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
 
-from config import GCP_PROJECT
+from config import GCP_PROJECT, MAX_RETRIES
+from shared.instrumentation import (REGISTRY, current_document_id, document_context,
+                                    stage_timer)
+from shared.pubsub.fair_scheduler import FairScheduler
+from shared.pubsub.holding import HeldMessages
+from shared.pubsub.quarantine import AttemptTracker, PoisonMessage, quarantine_message
 
 
 # === Helper to make any object JSON serializable ===
@@ -41,6 +50,7 @@ logging.basicConfig(
             "timestamp": "%(asctime)s",
             "level": "%(levelname)s",
             "component": "subscriber",
+            "document_id": "%(document_id)s",
             "message": "%(message)s",
         }
     ),
@@ -51,17 +61,140 @@ if not GCP_PROJECT:
     raise ValueError("GCP_PROJECT environment variable is not set.")
 
 
+DEFAULT_SUBSCRIBER_SETTINGS = {
+    "max_messages": 10,
+    "max_bytes": 100 * 1024 * 1024,
+    "callback_workers": 10,
+    "callback_executor": "thread",
+    "max_lease_seconds": 3600,
+}
+
+
+def _build_streaming_options(settings: dict):
+    """
+    Flow control bounds how many messages are leased at once; the client keeps extending
+    their ack deadlines in the background until ``max_lease_seconds``, so long extractions
+    are not redelivered mid-flight. Callbacks run on a thread pool of ``callback_workers``.
+    """
+    flow_control = pubsub_v1.types.FlowControl(
+        max_messages=settings["max_messages"],
+        max_bytes=settings["max_bytes"],
+        max_lease_duration=settings["max_lease_seconds"],
+    )
+    scheduler = ThreadScheduler(
+        executor=ThreadPoolExecutor(
+            max_workers=settings["callback_workers"], thread_name_prefix="pubsub-callback"
+        )
+    )
+    return flow_control, scheduler
+
+
+def _build_process_pool(settings: dict) -> Optional[ProcessPoolExecutor]:
+    """
+    With ``callback_executor="process"`` the handler itself runs in a worker process (it must
+    be a picklable module-level function); ack/nack stays on the subscriber thread.
+    """
+    if settings["callback_executor"] != "process":
+        return None
+    return ProcessPoolExecutor(
+        max_workers=settings["callback_workers"],
+        mp_context=multiprocessing.get_context("forkserver"),
+    )
+
+
+RECEIVED = REGISTRY.counter("pubsub_received_total", "Messages received", ("subscription",))
+FAILURES = REGISTRY.counter("pubsub_callback_failures_total", "Failed callbacks", ("subscription",))
+QUARANTINED = REGISTRY.counter(
+    "pubsub_quarantined_total", "Messages quarantined (poison or out of retries)", ("subscription",)
+)
+MESSAGE_AGE = REGISTRY.histogram(
+    "pubsub_message_age_seconds", "Time between publish and receipt", ("subscription",)
+)
+
+
+def _call_in_document_context(callback: Callable, document_id: str, payload: dict):
+    """Process-pool entry point that keeps the document id on the worker's log lines."""
+    with document_context(document_id):
+        return callback(payload)
+
+
+def _classify_message(message: Message, classify: Optional[Callable]) -> Tuple[str, str, float]:
+    try:
+        payload = json.loads(message.data)
+        if classify is None:
+            return payload.get("tenant_id") or "", "small", 1.0
+        return classify(payload)
+    except Exception:
+        # Unreadable messages still go through handle_message, which quarantines them.
+        return "", "small", 1.0
+
+
 # === Main Subscriber Function ===
 def subscribe_to_topic(
     topic: str,
     subscription: str,
     callback: Callable[[Union[dict, Message]], None],
     raw_message: bool = False,
+    settings: Optional[dict] = None,
+    scheduler: Optional[FairScheduler] = None,
+    classify: Optional[Callable[[dict], Tuple[str, str, float]]] = None,
 ):
+    """
+    With a ``scheduler``, received messages are queued there instead of handled on the
+    client's callback thread; ``classify(payload)`` returns their ``(tenant, lane, cost)``.
+    Messages the scheduler can't queue yet are held, not nacked (see ``HeldMessages``).
+    """
+    settings = {**DEFAULT_SUBSCRIBER_SETTINGS, **(settings or {})}
     subscriber = pubsub_v1.SubscriberClient()
     sub_path = subscriber.subscription_path(GCP_PROJECT, subscription)
+    flow_control, callback_scheduler = _build_streaming_options(settings)
+    process_pool = _build_process_pool(settings)
+    attempts = AttemptTracker()
+    held = None
+    if scheduler is not None:
+        held = HeldMessages(subscription, max_held=settings["max_messages"])
+
+    def run_callback(payload: dict):
+        with stage_timer(f"handle:{subscription}"):
+            if process_pool is None:
+                callback(payload)
+            else:
+                process_pool.submit(
+                    _call_in_document_context, callback, current_document_id(), payload
+                ).result()
 
     def wrapped_callback(message: Message):
+        attributes = message.attributes or {}
+        RECEIVED.inc(subscription=subscription)
+        if message.publish_time:
+            age = time.time() - message.publish_time.timestamp()
+            MESSAGE_AGE.observe(max(age, 0.0), subscription=subscription)
+        if scheduler is None:
+            with document_context(attributes.get("document_id")):
+                handle_message(message)
+            return
+        tenant, lane, cost = _classify_message(message, classify)
+
+        def offer() -> bool:
+            return scheduler.submit(
+                tenant,
+                lane,
+                cost,
+                lambda: run_scheduled(attributes.get("document_id"), message),
+                expire=lambda: held.hold(message, offer),
+            )
+
+        if not offer():
+            held.hold(message, offer)
+
+    def run_scheduled(document_id: Optional[str], message: Message):
+        try:
+            with document_context(document_id):
+                handle_message(message)
+        finally:
+            held.release(message)
+
+    def handle_message(message: Message):
         try:
             raw_data = message.data.decode("utf-8", errors="replace")
             attributes = message.attributes or {}
@@ -82,27 +215,81 @@ def subscribe_to_topic(
                         {
                             "event": "MessageReceived",
                             "attributes": to_serializable(attributes),
-                            "payload_preview": str(payload)[:200],
+                            "size_bytes": len(message.data),
+                            "payload_preview": raw_data[:200],
                         }
                     )
                 )
-                callback(payload)
+                run_callback(payload)
                 message.ack()
+                attempts.forget(message.message_id)
             except json.JSONDecodeError as je:
                 logger.error(
                     json.dumps({"event": "JSONDecodeError", "error": str(je), "raw_data": raw_data})
                 )
-                message.ack()  # Don't retry bad data
-        except Exception as e:
-            logger.error(
-                json.dumps(
-                    {"event": "CallbackError", "error": str(e), "traceback": traceback.format_exc()}
+                # Don't retry bad data, but keep it for inspection.
+                quarantine_message(
+                    message.message_id,
+                    subscription,
+                    topic,
+                    message.data,
+                    attributes,
+                    f"Invalid JSON: {je}",
+                    attempts=1,
                 )
+                message.ack()
+        except Exception as e:
+            handle_failure(message, e, traceback.format_exc())
+
+    def handle_failure(message: Message, error: Exception, error_traceback: str):
+        attempt = attempts.record(message.message_id, message.delivery_attempt)
+        FAILURES.inc(subscription=subscription)
+        logger.error(
+            json.dumps(
+                {
+                    "event": "CallbackError",
+                    "error": str(error),
+                    "attempt": attempt,
+                    "traceback": error_traceback,
+                }
             )
-            message.nack()  # Retry
+        )
+        # Retrying a message the handler rejected as malformed can't help.
+        if attempt >= MAX_RETRIES or isinstance(error, PoisonMessage):
+            try:
+                quarantine_message(
+                    message.message_id,
+                    subscription,
+                    topic,
+                    message.data,
+                    message.attributes,
+                    f"{type(error).__name__}: {error}",
+                    attempt,
+                    error_traceback,
+                )
+                attempts.forget(message.message_id)
+                QUARANTINED.inc(subscription=subscription)
+                message.ack()
+            except Exception:
+                logger.error(json.dumps({"event": "QuarantineFailed"}), exc_info=True)
+                message.nack()
+            return
 
-    logger.info(json.dumps({"event": "SubscriberStarted", "subscription": sub_path}))
-    streaming_pull_future = subscriber.subscribe(sub_path, callback=wrapped_callback)
+        # Release the lease right away; the subscription's retry policy spaces out redelivery.
+        logger.info(json.dumps({"event": "RetryScheduled", "attempt": attempt}))
+        message.nack()
+
+    logger.info(
+        json.dumps(
+            {"event": "SubscriberStarted", "subscription": sub_path, "settings": settings}
+        )
+    )
+    streaming_pull_future = subscriber.subscribe(
+        sub_path,
+        callback=wrapped_callback,
+        flow_control=flow_control,
+        scheduler=callback_scheduler,
+    )
 
     def shutdown_handler(signum, frame):
         logger.info(json.dumps({"event": "ShutdownSignalReceived"}))
@@ -111,6 +298,11 @@ def subscribe_to_topic(
             streaming_pull_future.result(timeout=5)
         except Exception:
             pass
+        if scheduler is not None:
+            scheduler.stop()
+            held.stop()
+        if process_pool is not None:
+            process_pool.shutdown(wait=False, cancel_futures=True)
         sys.exit(0)
 
     signal.signal(signal.SIGINT, shutdown_handler)
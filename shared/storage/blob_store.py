@@ -0,0 +1,307 @@
+"""
+Blob-store backends behind the helpers in ``gcs_client``.
+
+``BLOB_STORE_BACKEND`` selects GCS (default), a local directory tree (``LOCAL_BLOB_ROOT``,
+one sub-directory per bucket) or a process-local dict. The in-process pipeline and the
+benchmarks install their own store with ``set_blob_store``.
+"""
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, Optional
+
+from google.api_core.exceptions import NotFound, PreconditionFailed, RequestRangeNotSatisfiable
+from google.cloud import storage
+
+from config import BLOB_STORE_BACKEND, LOCAL_BLOB_ROOT
+
+
+class BlobNotFound(Exception):
+    """The requested object does not exist in the store."""
+
+
+class BlobStore(ABC):
+    @abstractmethod
+    def read(self, bucket: str, name: str) -> bytes:
+        """Return the object's bytes; raises BlobNotFound."""
+
+    @abstractmethod
+    def write(self, bucket: str, name: str, data: bytes, content_type: Optional[str] = None):
+        """Create or replace the object."""
+
+    @abstractmethod
+    def create(
+        self, bucket: str, name: str, data: bytes, content_type: Optional[str] = None
+    ) -> bool:
+        """Write the object only if it does not exist yet; False if it already did."""
+
+    @abstractmethod
+    def delete(self, bucket: str, name: str):
+        """Remove the object if it exists."""
+
+    @abstractmethod
+    def list(self, bucket: str, prefix: str = "") -> Iterator[str]:
+        """Object names under ``prefix``, in lexical order."""
+
+    def read_range(self, bucket: str, name: str, start: int, length: int) -> bytes:
+        """Up to ``length`` bytes from offset ``start`` (fewer at the end of the object)."""
+        return self.read(bucket, name)[start : start + length]
+
+    def size(self, bucket: str, name: str) -> int:
+        """Object size in bytes; raises BlobNotFound."""
+        return len(self.read(bucket, name))
+
+    def download_to_filename(self, bucket: str, name: str, path: str):
+        with open(path, "wb") as f:
+            f.write(self.read(bucket, name))
+
+    def open_write(self, bucket: str, name: str, content_type: Optional[str] = None) -> BinaryIO:
+        """A writable file object; the object only appears once it is closed."""
+        return _BufferedWriter(self, bucket, name, content_type)
+
+    @abstractmethod
+    def url(self, bucket: str, name: str) -> str:
+        """Where the object can be found, for logs and events."""
+
+
+class _BufferedWriter:
+    def __init__(self, store: BlobStore, bucket: str, name: str, content_type: Optional[str]):
+        self._store, self._bucket, self._name = store, bucket, name
+        self._content_type = content_type
+        self._chunks = []
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._store.write(self._bucket, self._name, b"".join(self._chunks), self._content_type)
+            self.closed = True
+
+
+_storage_client: Optional[storage.Client] = None
+_client_lock = threading.Lock()
+
+
+def get_storage_client() -> storage.Client:
+    """Process-wide storage client; the underlying HTTP session is pooled and thread-safe."""
+    global _storage_client
+    if _storage_client is None:
+        with _client_lock:
+            if _storage_client is None:
+                _storage_client = storage.Client()
+    return _storage_client
+
+
+class GCSBlobStore(BlobStore):
+    def _blob(self, bucket: str, name: str) -> storage.Blob:
+        return get_storage_client().bucket(bucket).blob(name)
+
+    def read(self, bucket, name):
+        try:
+            return self._blob(bucket, name).download_as_bytes()
+        except NotFound:
+            raise BlobNotFound(f"gs://{bucket}/{name}")
+
+    def read_range(self, bucket, name, start, length):
+        try:
+            return self._blob(bucket, name).download_as_bytes(start=start, end=start + length - 1)
+        except NotFound:
+            raise BlobNotFound(f"gs://{bucket}/{name}")
+        except RequestRangeNotSatisfiable:
+            # Empty object, or start at or past its end.
+            return b""
+
+    def size(self, bucket, name):
+        blob = get_storage_client().bucket(bucket).get_blob(name)
+        if blob is None:
+            raise BlobNotFound(f"gs://{bucket}/{name}")
+        return blob.size
+
+    def write(self, bucket, name, data, content_type=None):
+        self._blob(bucket, name).upload_from_string(data, content_type=content_type)
+
+    def create(self, bucket, name, data, content_type=None):
+        try:
+            self._blob(bucket, name).upload_from_string(
+                data, content_type=content_type, if_generation_match=0
+            )
+        except PreconditionFailed:
+            return False
+        return True
+
+    def delete(self, bucket, name):
+        try:
+            self._blob(bucket, name).delete()
+        except NotFound:
+            pass
+
+    def list(self, bucket, prefix=""):
+        for blob in get_storage_client().bucket(bucket).list_blobs(prefix=prefix):
+            yield blob.name
+
+    def download_to_filename(self, bucket, name, path):
+        try:
+            self._blob(bucket, name).download_to_filename(path)
+        except NotFound:
+            raise BlobNotFound(f"gs://{bucket}/{name}")
+
+    def open_write(self, bucket, name, content_type=None):
+        return self._blob(bucket, name).open("wb", content_type=content_type)
+
+    def url(self, bucket, name):
+        return f"https://storage.googleapis.com/{bucket}/{name}"
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Objects as files under ``root/<bucket>/<name>``. ``buckets`` maps individual buckets to
+    other directories, e.g. an existing folder of PDFs used as the upload bucket.
+    """
+
+    def __init__(self, root: str, buckets: Optional[Dict[str, str]] = None):
+        self.root = Path(root)
+        self.buckets = {bucket: Path(path) for bucket, path in (buckets or {}).items()}
+
+    def _path(self, bucket: str, name: str) -> Path:
+        base = self.buckets.get(bucket, self.root / bucket)
+        path = (base / name).resolve()
+        if not path.is_relative_to(base.resolve()):
+            raise ValueError(f"Object name escapes the bucket directory: {name}")
+        return path
+
+    def read(self, bucket, name):
+        try:
+            return self._path(bucket, name).read_bytes()
+        except FileNotFoundError:
+            raise BlobNotFound(self.url(bucket, name))
+
+    def read_range(self, bucket, name, start, length):
+        try:
+            with self._path(bucket, name).open("rb") as f:
+                f.seek(start)
+                return f.read(length)
+        except FileNotFoundError:
+            raise BlobNotFound(self.url(bucket, name))
+
+    def size(self, bucket, name):
+        try:
+            return self._path(bucket, name).stat().st_size
+        except FileNotFoundError:
+            raise BlobNotFound(self.url(bucket, name))
+
+    @staticmethod
+    def _tmp_path(path: Path) -> Path:
+        # Unique per process and thread, so concurrent writers never share a temp file.
+        return path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+    def write(self, bucket, name, data, content_type=None):
+        path = self._path(bucket, name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write-then-rename so readers never see a partial object.
+        tmp = self._tmp_path(path)
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def create(self, bucket, name, data, content_type=None):
+        path = self._path(bucket, name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self._tmp_path(path)
+        tmp.write_bytes(data)
+        try:
+            # link() fails if the target exists, so exactly one creator wins.
+            os.link(tmp, path)
+        except FileExistsError:
+            return False
+        finally:
+            tmp.unlink()
+        return True
+
+    def delete(self, bucket, name):
+        self._path(bucket, name).unlink(missing_ok=True)
+
+    def list(self, bucket, prefix=""):
+        base = self.buckets.get(bucket, self.root / bucket)
+        names = (
+            path.relative_to(base).as_posix()
+            for path in base.rglob("*")
+            if path.is_file() and not path.name.startswith(".")
+        )
+        return iter(sorted(name for name in names if name.startswith(prefix)))
+
+    def download_to_filename(self, bucket, name, path):
+        try:
+            shutil.copyfile(self._path(bucket, name), path)
+        except FileNotFoundError:
+            raise BlobNotFound(self.url(bucket, name))
+
+    def url(self, bucket, name):
+        return self._path(bucket, name).as_uri()
+
+
+class MemoryBlobStore(BlobStore):
+    """Objects in a dict; for tests, benchmarks and the in-process pipeline."""
+
+    def __init__(self):
+        self._objects: Dict[tuple, bytes] = {}
+        self._lock = threading.Lock()
+
+    def read(self, bucket, name):
+        try:
+            return self._objects[(bucket, name)]
+        except KeyError:
+            raise BlobNotFound(self.url(bucket, name))
+
+    def write(self, bucket, name, data, content_type=None):
+        with self._lock:
+            self._objects[(bucket, name)] = bytes(data)
+
+    def create(self, bucket, name, data, content_type=None):
+        with self._lock:
+            if (bucket, name) in self._objects:
+                return False
+            self._objects[(bucket, name)] = bytes(data)
+            return True
+
+    def delete(self, bucket, name):
+        with self._lock:
+            self._objects.pop((bucket, name), None)
+
+    def list(self, bucket, prefix=""):
+        with self._lock:
+            keys = list(self._objects)
+        return iter(sorted(n for b, n in keys if b == bucket and n.startswith(prefix)))
+
+    def url(self, bucket, name):
+        return f"memory://{bucket}/{name}"
+
+
+_blob_store: Optional[BlobStore] = None
+_store_lock = threading.Lock()
+
+
+def _from_config() -> BlobStore:
+    if BLOB_STORE_BACKEND == "local":
+        return LocalBlobStore(LOCAL_BLOB_ROOT)
+    if BLOB_STORE_BACKEND == "memory":
+        return MemoryBlobStore()
+    return GCSBlobStore()
+
+
+def get_blob_store() -> BlobStore:
+    global _blob_store
+    if _blob_store is None:
+        with _store_lock:
+            if _blob_store is None:
+                _blob_store = _from_config()
+    return _blob_store
+
+
+def set_blob_store(store: Optional[BlobStore]):
+    """Install a store for this process (None goes back to ``BLOB_STORE_BACKEND``)."""
+    global _blob_store
+    _blob_store = store
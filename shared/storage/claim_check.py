@@ -0,0 +1,69 @@
+import hashlib
+import json
+import logging
+
+from config import CLAIM_CHECK_THRESHOLD_KB, EXTRACTED_TEXT_BUCKET
+from shared.storage.extracted_output import ExtractedDocument
+
+logger = logging.getLogger(__name__)
+
+
+def _digest(structured_text) -> tuple:
+    encoded = json.dumps(structured_text, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest(), len(encoded)
+
+
+def attach_structured_text(event: dict, structured_text, blob_name: str) -> dict:
+    """
+    Put ``structured_text`` inline when it is small; above ``CLAIM_CHECK_THRESHOLD_KB`` put a
+    reference to the extracted-output object (already uploaded) plus its digest instead.
+    """
+    sha256, size = _digest(structured_text)
+    # Without a stored copy (upload failed) there is nothing to reference.
+    if size <= CLAIM_CHECK_THRESHOLD_KB * 1024 or not event.get("extracted_gcs_url"):
+        event["structured_text"] = structured_text
+        return event
+
+    event["structured_text_ref"] = {
+        "bucket": EXTRACTED_TEXT_BUCKET,
+        "blob": blob_name,
+        "field": "structured_text",
+        "sha256": sha256,
+        "size_bytes": size,
+    }
+    logger.info("Claim-check: %d bytes of structured_text referenced via %s", size, blob_name)
+    return event
+
+
+def _open_verified(bucket: str, blob: str, sha256: str) -> ExtractedDocument:
+    document = ExtractedDocument.open(blob, bucket)
+    digest = hashlib.sha256()
+    for piece in document.iter_json():
+        digest.update(piece.encode("utf-8"))
+    if digest.hexdigest() != sha256:
+        raise ValueError(f"Claim-check digest mismatch for gs://{bucket}/{blob}")
+    return document
+
+
+def resolve_structured_text(payload: dict):
+    """
+    Return inline ``structured_text``, or the referenced document's blocks as an iterator.
+    The digest is checked first, then the blocks are read again one shard at a time, so a
+    large document is never held whole; ``chunking.iter_blocks`` accepts either shape.
+    """
+    if "structured_text" in payload:
+        return payload["structured_text"]
+    ref = payload.get("structured_text_ref")
+    if not ref:
+        return None
+    field = ref.get("field", "structured_text")
+    if field != "structured_text":
+        value = ExtractedDocument.open(ref["blob"], ref["bucket"]).metadata.get(field)
+        if _digest(value)[0] != ref["sha256"]:
+            raise ValueError(f"Claim-check digest mismatch for gs://{ref['bucket']}/{ref['blob']}")
+        return value
+    return _open_verified(ref["bucket"], ref["blob"], ref["sha256"]).iter_blocks()
+
+
+def has_structured_text(payload: dict) -> bool:
+    return "structured_text" in payload or "structured_text_ref" in payload
@@ -0,0 +1,288 @@
+"""
+Extracted-output layout: a small JSON index plus gzip-compressed NDJSON shards.
+
+``file/<id>.json`` (the name events and the API already hand out) becomes an index:
+
+    {"format": "ndjson-gzip-v1", "document": {...tenant_id, source, parse_info...},
+     "container": null, "blocks": 1234,
+     "shards": [{"name": "file/<id>/3f9c....ndjson.gz", "first_page": 1, "last_page": 100,
+                 "size_bytes": 81234}, ...],
+     "pages": [[page, shard, offset, length], ...]}
+
+Each shard holds one block per line. Every run of consecutive blocks from the same page is
+its own gzip member, and ``pages`` records where each member starts. A reader can therefore
+fetch one page with a single ranged read and decompress just that slice, while the whole shard
+is still a valid ``.ndjson.gz`` file. Shards are named by content hash, so re-extracting a
+document never rewrites an object an older index points to; once the new index is written,
+the old index's shards it no longer references are deleted. A reader still streaming the old
+version then gets BlobNotFound, as it would for a deleted document.
+
+``EXTRACTED_OUTPUT_FORMAT=json`` keeps the single-JSON layout, and ``ExtractedDocument``
+reads both.
+"""
+import gzip
+import hashlib
+import json
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from config import EXTRACTED_PAGES_PER_SHARD, EXTRACTED_TEXT_BUCKET
+from shared.storage.blob_store import BlobNotFound, get_blob_store
+
+logger = logging.getLogger(__name__)
+
+FORMAT = "ndjson-gzip-v1"
+NO_PAGE = 0  # page key for blocks without a page number (URL sections)
+
+
+def _split_structured_text(structured_text) -> Tuple[Optional[dict], list]:
+    """Separate the block list from its wrapper, e.g. ``{"url": ..., "sections": [...]}``."""
+    if isinstance(structured_text, list):
+        return None, structured_text
+    if isinstance(structured_text, dict) and isinstance(structured_text.get("sections"), list):
+        return {**structured_text, "sections": None}, structured_text["sections"]
+    # Error results and other shapes carry no blocks.
+    return structured_text, []
+
+
+def _join_structured_text(container: Optional[dict], blocks: list):
+    if container is None:
+        return blocks
+    if "sections" in container and container["sections"] is None:
+        return {**container, "sections": blocks}
+    return container
+
+
+def _page_of(block, previous: int) -> int:
+    metadata = block.get("metadata") if isinstance(block, dict) else None
+    page = (metadata or {}).get("page_number")
+    # Blocks without a page stay with the page before them, so runs stay in document order.
+    return page if isinstance(page, int) else previous
+
+
+def _page_runs(blocks: list) -> Iterator[Tuple[int, list]]:
+    page, run = NO_PAGE, []
+    for block in blocks:
+        block_page = _page_of(block, page)
+        if run and block_page != page:
+            yield page, run
+            run = []
+        page = block_page
+        run.append(block)
+    if run:
+        yield page, run
+
+
+class _ShardWriter:
+    def __init__(self, prefix: str, pages_per_shard: int):
+        self.prefix = prefix
+        self.pages_per_shard = pages_per_shard
+        self.shards: List[dict] = []
+        self.pages: List[list] = []
+        self._members: List[bytes] = []
+        self._size = 0
+        self._shard_pages: set = set()
+        self._first_page: Optional[int] = None
+        self._last_page: Optional[int] = None
+
+    def add(self, page: int, run: list):
+        if page not in self._shard_pages and len(self._shard_pages) >= self.pages_per_shard:
+            self.flush()
+        lines = "".join(json.dumps(block, ensure_ascii=False) + "\n" for block in run)
+        member = gzip.compress(lines.encode("utf-8"), compresslevel=6, mtime=0)
+        self.pages.append([page, len(self.shards), self._size, len(member)])
+        self._members.append(member)
+        self._size += len(member)
+        self._shard_pages.add(page)
+        self._first_page = page if self._first_page is None else min(self._first_page, page)
+        self._last_page = page if self._last_page is None else max(self._last_page, page)
+
+    def flush(self):
+        if not self._members:
+            return
+        data = b"".join(self._members)
+        name = f"{self.prefix}/{hashlib.sha256(data).hexdigest()[:20]}.ndjson.gz"
+        get_blob_store().write(EXTRACTED_TEXT_BUCKET, name, data, content_type="application/gzip")
+        self.shards.append(
+            {
+                "name": name,
+                "first_page": self._first_page,
+                "last_page": self._last_page,
+                "size_bytes": len(data),
+            }
+        )
+        self._members, self._size, self._shard_pages = [], 0, set()
+        self._first_page = self._last_page = None
+
+
+def shard_prefix(blob_name: str) -> str:
+    return blob_name[: -len(".json")] if blob_name.endswith(".json") else blob_name
+
+
+def _indexed_shards(blob_name: str) -> Set[str]:
+    """Shard names the index currently stored at ``blob_name`` points to."""
+    try:
+        stored = json.loads(get_blob_store().read(EXTRACTED_TEXT_BUCKET, blob_name))
+    except BlobNotFound:
+        return set()
+    if stored.get("format") != FORMAT:
+        return set()
+    return {shard["name"] for shard in stored["shards"]}
+
+
+def write_sharded(
+    blob_name: str, content: dict, pages_per_shard: int = EXTRACTED_PAGES_PER_SHARD
+) -> dict:
+    """
+    Write ``content`` (an extracted-output document with ``structured_text``) as shards plus
+    an index at ``blob_name``; the index goes last, so readers never see missing shards.
+    Shards of the index it replaces that the new one does not share are deleted afterwards.
+    """
+    previous = _indexed_shards(blob_name)
+    document = {key: value for key, value in content.items() if key != "structured_text"}
+    container, blocks = _split_structured_text(content.get("structured_text"))
+    writer = _ShardWriter(shard_prefix(blob_name), pages_per_shard)
+    for page, run in _page_runs(blocks):
+        writer.add(page, run)
+    writer.flush()
+    index = {
+        "format": FORMAT,
+        "document": document,
+        "container": container,
+        "blocks": len(blocks),
+        "shards": writer.shards,
+        "pages": writer.pages,
+    }
+    store = get_blob_store()
+    store.write(
+        EXTRACTED_TEXT_BUCKET,
+        blob_name,
+        json.dumps(index, ensure_ascii=False).encode("utf-8"),
+        content_type="application/json",
+    )
+    for name in sorted(previous - {shard["name"] for shard in writer.shards}):
+        try:
+            store.delete(EXTRACTED_TEXT_BUCKET, name)
+        except Exception:
+            # A leftover shard only costs storage; no index refers to it any more.
+            logger.warning("Could not delete replaced shard %s", name, exc_info=True)
+    return index
+
+
+def _decode_lines(data: bytes) -> List[dict]:
+    # gzip.decompress handles several concatenated members in one call.
+    return [json.loads(line) for line in gzip.decompress(data).splitlines() if line]
+
+
+class ExtractedDocument:
+    """
+    Read access to one extracted-output object, sharded or legacy single JSON.
+
+        doc = ExtractedDocument.open("file/<id>.json")
+        doc.pages              # [1, 2, ...]
+        doc.read_pages([412])  # only the byte ranges holding page 412
+        doc.structured_text()  # the whole document, as the extractor produced it
+    """
+
+    def __init__(self, blob_name: str, stored: dict, bucket: str = EXTRACTED_TEXT_BUCKET):
+        self.blob_name = blob_name
+        self.bucket = bucket
+        self.sharded = stored.get("format") == FORMAT
+        self._stored = stored
+
+    @classmethod
+    def open(cls, blob_name: str, bucket: str = EXTRACTED_TEXT_BUCKET) -> "ExtractedDocument":
+        """Raises BlobNotFound if nothing was written under ``blob_name``."""
+        return cls(blob_name, json.loads(get_blob_store().read(bucket, blob_name)), bucket)
+
+    @property
+    def metadata(self) -> dict:
+        if self.sharded:
+            return self._stored["document"]
+        return {key: value for key, value in self._stored.items() if key != "structured_text"}
+
+    @property
+    def pages(self) -> List[int]:
+        if self.sharded:
+            return sorted({entry[0] for entry in self._stored["pages"]})
+        return sorted({page for page, _ in self._legacy_runs()})
+
+    def _legacy_runs(self) -> Iterator[Tuple[int, list]]:
+        _, blocks = _split_structured_text(self._stored.get("structured_text"))
+        return _page_runs(blocks)
+
+    def _read_members(self, entries: List[list]) -> List[dict]:
+        """Fetch index entries (document order), one ranged read per contiguous stretch."""
+        store = get_blob_store()
+        blocks: List[dict] = []
+        stretch: Optional[list] = None  # [shard, start, end]
+        for _, shard, offset, length in entries:
+            if stretch and stretch[0] == shard and stretch[2] == offset:
+                stretch[2] = offset + length
+                continue
+            if stretch:
+                blocks.extend(self._read_stretch(store, *stretch))
+            stretch = [shard, offset, offset + length]
+        if stretch:
+            blocks.extend(self._read_stretch(store, *stretch))
+        return blocks
+
+    def _read_stretch(self, store, shard: int, start: int, end: int) -> List[dict]:
+        name = self._stored["shards"][shard]["name"]
+        return _decode_lines(store.read_range(self.bucket, name, start, end - start))
+
+    def read_pages(self, pages: Iterable[int]) -> List[dict]:
+        """Blocks of the given pages, in document order."""
+        wanted = set(pages)
+        if not self.sharded:
+            return [block for page, run in self._legacy_runs() if page in wanted for block in run]
+        entries = [entry for entry in self._stored["pages"] if entry[0] in wanted]
+        return self._read_members(entries)
+
+    def iter_blocks(self) -> Iterator[dict]:
+        """Every block, one shard in memory at a time."""
+        if not self.sharded:
+            for _, run in self._legacy_runs():
+                yield from run
+            return
+        store = get_blob_store()
+        for shard in self._stored["shards"]:
+            yield from _decode_lines(store.read(self.bucket, shard["name"]))
+
+    def iter_json(self) -> Iterator[str]:
+        """
+        ``json.dumps(self.structured_text(), ensure_ascii=False)`` in pieces, so the text can be
+        hashed without holding every block at once.
+        """
+        if not self.sharded:
+            yield json.dumps(self.structured_text(), ensure_ascii=False)
+            return
+        container = self._stored["container"]
+        if container is None:
+            yield from self._iter_json_blocks()
+        elif "sections" in container and container["sections"] is None:
+            yield "{"
+            for position, (key, value) in enumerate(container.items()):
+                yield (", " if position else "") + json.dumps(key, ensure_ascii=False) + ": "
+                if key == "sections":
+                    yield from self._iter_json_blocks()
+                else:
+                    yield json.dumps(value, ensure_ascii=False)
+            yield "}"
+        else:
+            yield json.dumps(container, ensure_ascii=False)
+
+    def _iter_json_blocks(self) -> Iterator[str]:
+        yield "["
+        for position, block in enumerate(self.iter_blocks()):
+            yield (", " if position else "") + json.dumps(block, ensure_ascii=False)
+        yield "]"
+
+    def structured_text(self):
+        if not self.sharded:
+            return self._stored.get("structured_text")
+        return _join_structured_text(self._stored["container"], list(self.iter_blocks()))
+
+    def to_dict(self) -> Dict:
+        """The legacy single-JSON shape: metadata plus ``structured_text``."""
+        return {**self.metadata, "structured_text": self.structured_text()}
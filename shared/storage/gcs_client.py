@@ -1,52 +1,82 @@
 import json
 import logging
+from typing import Optional
 
-from google.cloud import storage
-
-from config import EXTRACTED_TEXT_BUCKET, GCS_BUCKET
+from config import EXTRACTED_OUTPUT_FORMAT, EXTRACTED_TEXT_BUCKET, GCS_BUCKET, PIPELINE_STATE_BUCKET
+from shared.storage.blob_store import BlobNotFound, get_blob_store, get_storage_client  # noqa: F401
+from shared.storage.extracted_output import ExtractedDocument, write_sharded
 
 logger = logging.getLogger(__name__)
 
 
 def download_file_from_gcs(gcs_path: str, local_path: str):
+    """Copy an uploaded file to ``local_path``; raises BlobNotFound if it does not exist."""
+    logger.info(f"Downloading from GCS path: {gcs_path} to local path: {local_path}")
     try:
-        logger.info(f"Downloading from GCS path: {gcs_path} to local path: {local_path}")
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(GCS_BUCKET)
-
-        blob = bucket.blob(gcs_path)
-        if not blob.exists():
-            logger.error(f" Blob not found in bucket '{GCS_BUCKET}': {gcs_path}")
-            return
-
-        blob.download_to_filename(local_path)
-        logger.info(f" Successfully downloaded {gcs_path} to {local_path}")
-    except Exception as e:
-        logger.error(f"Error downloading file from GCS: {e}", exc_info=True)
+        get_blob_store().download_to_filename(GCS_BUCKET, gcs_path, local_path)
+    except BlobNotFound:
+        logger.error(f" Blob not found in bucket '{GCS_BUCKET}': {gcs_path}")
+        raise
+    logger.info(f" Successfully downloaded {gcs_path} to {local_path}")
 
 
 def upload_extracted_text_to_gcs(blob_name: str, content: dict) -> str:
+    """
+    Store an extracted-output document and return its URL. Public read access, where wanted,
+    comes from the bucket's IAM policy (see terraform/), not from a per-object ACL.
+    """
     try:
         logger.info(f"Uploading extracted content to GCS: {blob_name}")
+        store = get_blob_store()
 
-        client = storage.Client()
-        bucket = client.bucket(EXTRACTED_TEXT_BUCKET)
-        blob = bucket.blob(blob_name)
-
-        # Upload content as JSON
-        blob.upload_from_string(
-            json.dumps(content, ensure_ascii=False), content_type="application/json"
-        )
-
-        # Make the object publicly accessible for read-only
-        blob.make_public()
-
-        # Use GCS-generated public URL
-        public_url = blob.public_url
+        if EXTRACTED_OUTPUT_FORMAT == "json":
+            store.write(
+                EXTRACTED_TEXT_BUCKET,
+                blob_name,
+                json.dumps(content, ensure_ascii=False).encode("utf-8"),
+                content_type="application/json",
+            )
+        else:
+            write_sharded(blob_name, content)
 
+        public_url = store.url(EXTRACTED_TEXT_BUCKET, blob_name)
         logger.info(f"Uploaded to GCS: {public_url}")
         return public_url
 
     except Exception:
         logger.error("Failed to upload extracted text to GCS", exc_info=True)
         return ""
+
+
+def read_extracted_document(blob_name: str) -> dict:
+    """
+    An extracted-output document in the single-JSON shape, whichever layout it was written
+    in; raises BlobNotFound. Use ``ExtractedDocument`` to read only some pages.
+    """
+    return ExtractedDocument.open(blob_name).to_dict()
+
+
+def download_state_json(blob_name: str) -> dict:
+    """Read back a JSON object from the pipeline-state bucket; raises BlobNotFound."""
+    return json.loads(get_blob_store().read(PIPELINE_STATE_BUCKET, blob_name))
+
+
+def load_state_json(blob_name: str) -> Optional[dict]:
+    """Like download_state_json, but returns None when the object does not exist."""
+    try:
+        return download_state_json(blob_name)
+    except BlobNotFound:
+        return None
+
+
+def save_state_json(blob_name: str, content: dict):
+    """
+    Write a JSON sidecar (e.g. a chunk manifest) to the pipeline-state bucket. That bucket
+    is private; the extracted-text bucket may be public and holds only extracted output.
+    """
+    get_blob_store().write(
+        PIPELINE_STATE_BUCKET,
+        blob_name,
+        json.dumps(content).encode("utf-8"),
+        content_type="application/json",
+    )
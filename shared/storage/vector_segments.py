@@ -0,0 +1,139 @@
+"""
+Stored embeddings: one segment per tenant per embedder batch.
+
+A segment is a plain NumPy ``.npy`` array (``EMBED_DTYPE``, float16 by default: half the
+bytes of float32 and ample precision for unit vectors) plus a JSON index next to it:
+
+    embeddings/<tenant>/<segment>.json
+    {"format": "embeddings-v1", "embedder": "hashing-v1-384-c3", "dim": 384,
+     "dtype": "float16", "vectors": "embeddings/<tenant>/<segment>.npy",
+     "rows": [{"chunk_id": ..., "document_id": ..., "content_hash": ...}, ...],
+     "deletes": [{"chunk_id": ..., "document_id": ...}, ...],
+     "aliases": [{"chunk_id": ..., "document_id": ..., "canonical_chunk_id": ...}, ...]}
+
+Row ``i`` of the index describes row ``i`` of the array. ``deletes`` carries the chunker's
+tombstones, so replaying segments in order yields the current set of vectors. ``aliases`` are
+chunks the chunker found to be near-duplicates and did not send for embedding; they share the
+vector of their canonical chunk. When a canonical chunk is deleted, the chunker promotes one of
+its aliases, which is then stored as an ordinary row with the canonical chunk's vector (see
+``find_vector``). Segment names are content hashes of their contents, so a
+redelivered batch overwrites itself.
+"""
+import hashlib
+import io
+import json
+import time
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from config import EMBED_DTYPE, EMBEDDINGS_BUCKET, EMBEDDINGS_PREFIX
+from shared.storage.blob_store import BlobNotFound, get_blob_store
+
+FORMAT = "embeddings-v1"
+
+
+def _segment_id(rows: List[dict], deletes: List[dict], aliases: List[dict]) -> str:
+    key = json.dumps([[row["chunk_id"], row["content_hash"]] for row in rows] + deletes + aliases)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:20]
+
+
+def write_segment(
+    tenant_id: str,
+    embedder: str,
+    rows: List[dict],
+    vectors: np.ndarray,
+    deletes: List[dict],
+    dtype: str = EMBED_DTYPE,
+    aliases: Optional[List[dict]] = None,
+) -> str:
+    """Store one segment and return the name of its index; the array is written first."""
+    store = get_blob_store()
+    aliases = aliases or []
+    base = f"{EMBEDDINGS_PREFIX}/{tenant_id}/{_segment_id(rows, deletes, aliases)}"
+    vectors = np.asarray(vectors, dtype=dtype)
+    buffer = io.BytesIO()
+    np.save(buffer, vectors, allow_pickle=False)
+    store.write(
+        EMBEDDINGS_BUCKET, f"{base}.npy", buffer.getvalue(), content_type="application/octet-stream"
+    )
+    index = {
+        "format": FORMAT,
+        "tenant_id": tenant_id,
+        "embedder": embedder,
+        "dim": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+        "dtype": str(vectors.dtype),
+        "vectors": f"{base}.npy",
+        "rows": rows,
+        "deletes": deletes,
+        "aliases": aliases,
+        "created_at": time.time(),
+    }
+    store.write(
+        EMBEDDINGS_BUCKET,
+        f"{base}.json",
+        json.dumps(index).encode("utf-8"),
+        content_type="application/json",
+    )
+    return f"{base}.json"
+
+
+class VectorSegment:
+    def __init__(self, index: dict, vectors: np.ndarray):
+        self.index = index
+        self.vectors = vectors
+
+    @classmethod
+    def open(cls, index_name: str) -> "VectorSegment":
+        """Raises BlobNotFound if the segment does not exist."""
+        store = get_blob_store()
+        index = json.loads(store.read(EMBEDDINGS_BUCKET, index_name))
+        data = store.read(EMBEDDINGS_BUCKET, index["vectors"])
+        return cls(index, np.load(io.BytesIO(data), allow_pickle=False))
+
+    @property
+    def rows(self) -> List[dict]:
+        return self.index["rows"]
+
+    @property
+    def deletes(self) -> List[dict]:
+        return self.index["deletes"]
+
+    @property
+    def aliases(self) -> List[dict]:
+        return self.index.get("aliases", [])
+
+    def as_float32(self) -> np.ndarray:
+        return self.vectors.astype(np.float32)
+
+
+def list_segments(tenant_id: str) -> Iterator[str]:
+    """Index names of a tenant's segments (lexical, not chronological; see ``created_at``)."""
+    prefix = f"{EMBEDDINGS_PREFIX}/{tenant_id}/"
+    names = get_blob_store().list(EMBEDDINGS_BUCKET, prefix)
+    return (name for name in names if name.endswith(".json"))
+
+
+def find_vector(tenant_id: str, chunk_id: str) -> Optional[np.ndarray]:
+    """
+    The most recently stored vector of ``chunk_id``, deleted or not. Reads every index of the
+    tenant, so it is meant for the rare promotion of an alias, not for queries.
+    """
+    store = get_blob_store()
+    found, found_at = None, None
+    for name in list_segments(tenant_id):
+        try:
+            index = json.loads(store.read(EMBEDDINGS_BUCKET, name))
+        except BlobNotFound:
+            continue
+        created_at = index.get("created_at", 0.0)
+        if found_at is not None and created_at <= found_at:
+            continue
+        for position, row in enumerate(index["rows"]):
+            if row["chunk_id"] == chunk_id:
+                found = (index["vectors"], position)
+                found_at = created_at
+    if found is None:
+        return None
+    data = store.read(EMBEDDINGS_BUCKET, found[0])
+    return np.load(io.BytesIO(data), allow_pickle=False)[found[1]].astype(np.float32)
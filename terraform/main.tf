@@ -10,6 +10,29 @@ resource "google_storage_bucket" "bucket" {
   location = var.region
 }
 
+# The extracted-text bucket predates this configuration, so it is looked up, not managed.
+# Extracted output is public through bucket IAM rather than a per-object ACL call, so every
+# object in it is readable when enabled; only output (file/, url/) may be stored there.
+data "google_storage_bucket" "extracted_text" {
+  name = var.Extraction_bucket
+}
+
+resource "google_storage_bucket_iam_member" "extracted_text_public" {
+  count  = var.extracted_text_public ? 1 : 0
+  bucket = data.google_storage_bucket.extracted_text.name
+  role   = "roles/storage.objectViewer"
+  member = "allUsers"
+}
+
+# Working state (chunk manifests, fetch cache, fan-out parts, near-dedup snapshots,
+# embeddings): PIPELINE_STATE_BUCKET. Never public.
+resource "google_storage_bucket" "pipeline_state" {
+  name                        = var.pipeline_state_bucket
+  location                    = var.region
+  uniform_bucket_level_access = true
+  public_access_prevention    = "enforced"
+}
+
 resource "google_pubsub_topic" "topic" {
   name = var.topic_name
 }
@@ -17,4 +40,66 @@ resource "google_pubsub_topic" "topic" {
 resource "google_pubsub_subscription" "subscription" {
   name  = var.subscription_name
   topic = google_pubsub_topic.topic.id
+
+  # Lets the client read message.delivery_attempt. The service quarantines after
+  # MAX_RETRIES itself; this is the backstop if a replica dies mid-message.
+  dead_letter_policy {
+    dead_letter_topic     = google_pubsub_topic.dead_letter.id
+    max_delivery_attempts = var.max_delivery_attempts
+  }
+
+  retry_policy {
+    minimum_backoff = "10s"
+    maximum_backoff = "600s"
+  }
+}
+
+# Downstream stages. Failed messages are nacked at once, so each subscription needs the same
+# server-side backoff and dead-letter backstop as the extractor's.
+resource "google_pubsub_topic" "extraction" {
+  name = var.extraction_topic_name
+}
+
+resource "google_pubsub_subscription" "chunker" {
+  name  = var.chunker_subscription_name
+  topic = google_pubsub_topic.extraction.id
+
+  dead_letter_policy {
+    dead_letter_topic     = google_pubsub_topic.dead_letter.id
+    max_delivery_attempts = var.max_delivery_attempts
+  }
+
+  retry_policy {
+    minimum_backoff = "10s"
+    maximum_backoff = "600s"
+  }
+}
+
+resource "google_pubsub_topic" "embedding" {
+  name = var.embedding_topic_name
+}
+
+resource "google_pubsub_subscription" "embedder" {
+  name  = var.embedder_subscription_name
+  topic = google_pubsub_topic.embedding.id
+
+  dead_letter_policy {
+    dead_letter_topic     = google_pubsub_topic.dead_letter.id
+    max_delivery_attempts = var.max_delivery_attempts
+  }
+
+  retry_policy {
+    minimum_backoff = "10s"
+    maximum_backoff = "600s"
+  }
+}
+
+resource "google_pubsub_topic" "dead_letter" {
+  name = var.dead_letter_topic_name
+}
+
+resource "google_pubsub_subscription" "dead_letter" {
+  name                       = "${var.dead_letter_topic_name}-sub"
+  topic                      = google_pubsub_topic.dead_letter.id
+  message_retention_duration = "604800s"
 }
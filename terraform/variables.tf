@@ -24,7 +24,60 @@ variable "subscription_name" {
   type        = string
 }
 
+variable "extraction_topic_name" {
+  description = "Topic the extractor publishes to (PUBSUB_EXTRACTION_TOPIC)"
+  type        = string
+  default     = "extraction-topic"
+}
+
+variable "chunker_subscription_name" {
+  description = "Chunker subscription on the extraction topic (CHUNKER_SUBSCRIPTION)"
+  type        = string
+  default     = "chunker-sub"
+}
+
+variable "embedding_topic_name" {
+  description = "Topic the chunker publishes to (PUBSUB_EMBEDDING_TOPIC)"
+  type        = string
+  default     = "embedding-topic"
+}
+
+variable "embedder_subscription_name" {
+  description = "Embedder subscription on the embedding topic (EMBEDDER_SUBSCRIPTION)"
+  type        = string
+  default     = "embedder-sub"
+}
+
 variable "credentials_file" {
   description = "Path to the GCP service account JSON credentials file"
   type        = string
-}
\ No newline at end of file
+}
+variable "dead_letter_topic_name" {
+  description = "Topic that receives quarantined messages"
+  type        = string
+  default     = "ingestion-dead-letter"
+}
+
+variable "max_delivery_attempts" {
+  description = "Delivery attempts before Pub/Sub forwards a message to the dead-letter topic"
+  type        = number
+  default     = 10
+}
+
+variable "Extraction_bucket" {
+  description = "Bucket for extracted output (EXTRACTED_TEXT_BUCKET)"
+  type        = string
+  default     = "ingestion-extracted-text"
+}
+
+variable "pipeline_state_bucket" {
+  description = "Private bucket for pipeline working state (PIPELINE_STATE_BUCKET)"
+  type        = string
+  default     = "ingestion-pipeline-state"
+}
+
+variable "extracted_text_public" {
+  description = "Grant allUsers read access to the extracted-output bucket (output only)"
+  type        = bool
+  default     = true
+}